@@ -0,0 +1,77 @@
+"""Measure the memory used by the parsed AST of a large input
+
+Parses a synthetic corpus (see `bench_parser.py`) of `--statements` statements,
+keeping every node alive, and reports (with tracemalloc):
+1. retained: the memory still allocated by the parsed statements
+2. peak: the peak memory allocated while parsing
+3. the number of allocations that are still alive, by type
+
+The input is passed as a list of lines, so the source buffer is mostly discarded while parsing,
+and the retained memory is dominated by the nodes and their spans.
+
+Usage: python benchmarks/bench_memory.py [--statements N] [--line-length N]
+"""
+import argparse
+import collections
+import gc
+import time
+import tracemalloc
+
+from bench_parser import synthetic_input
+
+from zsh2xonsh.parser import ShellParser
+
+
+def parse(lines: list[str]) -> list:
+    return list(ShellParser(lines).statements())
+
+
+def count_types(stmts: list) -> collections.Counter:
+    counts = collections.Counter()
+    seen = set()
+    pending = list(stmts)
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, (str, int)):
+            continue
+        seen.add(id(obj))
+        counts[type(obj).__name__] += 1
+        pending.extend(gc.get_referents(obj))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--statements", type=int, default=100_000)
+    parser.add_argument("--line-length", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    lines = synthetic_input(args.statements, args.line_length).splitlines()
+    best = float("inf")
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        stmts = parse(lines)
+        best = min(best, time.perf_counter() - start)
+        del stmts
+    gc.collect()
+    tracemalloc.start()
+    try:
+        stmts = parse(lines)
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    print(
+        f"{len(stmts)} statements ({len(lines)} lines): {best:.3f}s"
+        f" ({best / len(stmts) * 1e6:.2f}us per statement)"
+    )
+    print(
+        f"retained {retained / 1e6:.2f}MB ({retained / len(stmts):.0f} bytes per statement),"
+        f" peak {peak / 1e6:.2f}MB"
+    )
+    for name, count in count_types(stmts).most_common(8):
+        print(f"{name:>20}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Measure how parsing scales with the size of the input
+
+Generates large synthetic inputs (long PATH-style exports like `opam env`,
+multi-line command substitutions, functions & conditionals),
+then times `ShellParser` on increasing sizes.
+The time per statement should stay (roughly) constant.
+
+Usage: python benchmarks/bench_parser.py [--statements N] [--line-length N]
+"""
+import argparse
+import time
+
+from zsh2xonsh.parser import ShellParser
+
+
+def synthetic_input(statements: int, line_length: int) -> str:
+    path = ":".join(
+        f"/home/example/.opam/default/lib/pkg{idx}"
+        for idx in range(line_length // 40 + 1)
+    )
+    chunks = []
+    for idx in range(statements // 4):
+        chunks.append(f"VAR{idx}='{path}'; export VAR{idx};")
+        chunks.append(f'export PATH="/opt/tool{idx}/bin:{path}${{PATH+:$PATH}}"')
+        chunks.append(
+            f"local out{idx}=$(printf '%s\\n' ({idx}) |\n    tr a-z A-Z | (cat))"
+        )
+        chunks.append(f'if [[ -d "$out{idx}" ]]; then\n    export X{idx}=1\nfi')
+    return "\n".join(chunks)
+
+
+def bench(text: str, repeat: int) -> tuple[int, float]:
+    best = float("inf")
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parser = ShellParser(text)
+        count = 0
+        while parser.statement() is not None:
+            count += 1
+        best = min(best, time.perf_counter() - start)
+    return count, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--statements", type=int, default=2000)
+    parser.add_argument("--line-length", type=int, default=4000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    for scale in (1, 2, 4, 8):
+        text = synthetic_input(args.statements * scale, args.line_length)
+        count, elapsed = bench(text, args.repeat)
+        print(
+            f"{len(text) / 1e6:8.2f} MB, {count:7} statements: {elapsed:8.3f}s"
+            f" ({elapsed / count * 1e6:8.2f}us per statement)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Measure updating a long path variable (like the PATH from `opam env`)
+
+Each update prepends and appends entries to a PATH with hundreds of entries,
+which is what `ctx.assign_typed_var('PATH', ...)` does for `export PATH="...:$PATH:..."`.
+
+The native splice is compared with the old behavior,
+which expanded "$PATH" (as a string) and inserted the prefix entries one at a time.
+With `--unique`, PATH is deduplicated (like zsh's `typeset -U`).
+
+Usage: python benchmarks/bench_paths.py [--entries N...] [--added N]
+"""
+import argparse
+import os
+import time
+
+from zsh2xonsh.runtime import ZshContext, _SharedState
+
+
+def opam_path(entries: int) -> list[str]:
+    return [f"/home/example/.opam/default/lib/pkg{idx}/bin" for idx in range(entries)]
+
+
+def old_splice(ctx: ZshContext, var_name: str, target: list, new_path: str):
+    os.environ[var_name] = ":".join(target)
+    old_path = ctx.expand_quote(f"${var_name}")
+    offset = new_path.find(old_path)
+    prefix = new_path[:offset].split(":")[:-1]
+    suffix = new_path[offset + len(old_path) :].split(":")[1:]
+    for part in reversed(prefix):
+        target.insert(0, part)
+    for part in suffix:
+        target.append(part)
+
+
+def bench(ctx: ZshContext, entries: int, added: int, updates: int, old: bool) -> float:
+    base = opam_path(entries)
+    elapsed = 0.0
+    for idx in range(updates):
+        path = base.copy()
+        prefix = [f"/opt/tool{idx}/bin{n}" for n in range(added)]
+        suffix = [f"/opt/tool{idx}/lib{n}" for n in range(added)]
+        new_path = ":".join([*prefix, *path, *suffix])
+        start = time.perf_counter()
+        if old:
+            old_splice(ctx, "PATH", path, new_path)
+        else:
+            ctx._splice_path_var("PATH", path, new_path)
+        elapsed += time.perf_counter() - start
+    return elapsed / updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--added", type=int, default=50)
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--unique", action="store_true")
+    args = parser.parse_args()
+    saved_path = os.environ["PATH"]
+    ctx = ZshContext(shared=_SharedState(unique_paths=["PATH"] if args.unique else ()))
+    try:
+        for entries in args.entries:
+            new = bench(ctx, entries, args.added, args.updates, old=False)
+            old = bench(ctx, entries, args.added, args.updates, old=True)
+            print(
+                f"{entries:>6} entries (+{2 * args.added} per update):"
+                f" {new * 1e6:10.2f}us native, {old * 1e6:10.2f}us old"
+            )
+    finally:
+        os.environ["PATH"] = saved_path
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Measure the cost of local scopes in deep chains of function calls
+
+Each call in the chain assigns a local, then (in the innermost call)
+a loop resolves the visible locals,
+which is what every `ctx.zsh(...)` and `ctx.expand_quote(...)` does before running anything.
+
+The cached scope chain is compared with rebuilding the locals from every ancestor (the old behavior).
+The time per operation should stay (roughly) constant as the depth grows.
+
+Usage: python benchmarks/bench_scopes.py [--depths N...] [--calls N]
+"""
+import argparse
+import time
+
+from zsh2xonsh.runtime import ZshContext, _SharedState
+
+
+def uncached_resolved_locals(ctx: ZshContext) -> dict:
+    resolved = uncached_resolved_locals(ctx.parent) if ctx.parent is not None else {}
+    resolved.update(ctx._locals)
+    return resolved
+
+
+def call_chain(ctx: ZshContext, depth: int, calls: int, uncached: bool) -> float:
+    if depth > 0:
+        with ctx.begin_function(f"f{depth}", [str(depth)]) as inner:
+            inner.assign_local(f"var{depth}", depth)
+            return call_chain(inner, depth - 1, calls, uncached)
+    start = time.perf_counter()
+    for _ in range(calls):
+        if uncached:
+            uncached_resolved_locals(ctx)
+        else:
+            ctx._resolved_locals()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--depths", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--calls", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    ctx = ZshContext(shared=_SharedState())
+    for depth in args.depths:
+        results = []
+        for uncached in (False, True):
+            best = min(
+                call_chain(ctx, depth, args.calls, uncached) for _ in range(args.repeat)
+            )
+            results.append(best / args.calls * 1e6)
+        print(
+            f"depth {depth:>5}: {results[0]:8.2f}us/op cached, {results[1]:8.2f}us/op uncached"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""Benchmark parsing, translation and runtime evaluation, saving the results as JSON
+
+The corpora are `examples/*.zsh` and synthetic inputs (see `bench_parser.py`) at increasing scales.
+For each corpus, this measures:
+1. parse: `ShellParser` over the whole input
+2. translate: `translate_to_xonsh` (including the optimization passes)
+3. runtime: evaluating the translated code with `ZshContext`
+
+Each phase reports the best wall time (over `--repeat` runs) and the peak memory allocated (with tracemalloc).
+
+The runtime phase substitutes `stub_zsh.py` for zsh (via `$ZSH2XONSH_ZSH`),
+so the results are deterministic and don't require zsh to be installed.
+It counts the zsh processes spawned by each kind of statement.
+The translated code is run as python, with `$VAR = ...` rewritten into `os.environ` assignments
+(which is what the runtime falls back to without xonsh).
+
+Results can be compared with an earlier run, to catch regressions:
+
+Usage: python benchmarks/bench_suite.py [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import collections
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from bench_parser import synthetic_input
+
+from zsh2xonsh import passes, runtime, translate_to_xonsh
+from zsh2xonsh.ast import AssignmentStmt, FunctionInvocation
+from zsh2xonsh.parser import ShellParser
+from zsh2xonsh.translate import Settings
+
+BENCHMARKS = Path(__file__).resolve().parent
+EXAMPLES = BENCHMARKS.parent / "examples"
+
+_XONSH_ENV_ASSIGN = re.compile(r"^(\s*)\$(\w+)=", re.MULTILINE)
+
+
+def corpora(scales, statements):
+    for path in sorted(EXAMPLES.glob("*.zsh")):
+        yield f"examples/{path.name}", path.read_text()
+    for scale in scales:
+        yield f"synthetic/x{scale}", synthetic_input(statements * scale, 200)
+
+
+def measure(func, repeat: int) -> dict:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"wall": best, "peak_bytes": peak}
+
+
+def parse(text: str) -> list:
+    return list(ShellParser(text).statements())
+
+
+def statement_kind(stmt) -> str:
+    kind = type(stmt).__name__
+    if isinstance(stmt, AssignmentStmt):
+        return f"{kind}[{stmt.kind.value if stmt.kind is not None else 'plain'}]"
+    elif isinstance(stmt, FunctionInvocation):
+        return f"{kind}[{stmt.kind.value}]"
+    return kind
+
+
+class _Env:
+    """Stands in for xonsh's `$VAR = ...` syntax"""
+
+    def __setitem__(self, name, value):
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = str(value)
+
+
+class StubZsh:
+    """Points the runtime at `stub_zsh.py`, counting the processes it spawns"""
+
+    def __init__(self, directory: str):
+        self.wrapper = os.path.join(directory, "zsh")
+        self.log = os.path.join(directory, "spawns.log")
+        with open(self.wrapper, "wt") as f:
+            f.write(
+                f"#!/bin/sh\nexec '{sys.executable}' '{BENCHMARKS / 'stub_zsh.py'}' \"$@\"\n"
+            )
+        os.chmod(self.wrapper, 0o755)
+        os.environ["ZSH2XONSH_ZSH"] = self.wrapper
+        os.environ["ZSH2XONSH_STUB_LOG"] = self.log
+
+    def spawned(self) -> int:
+        try:
+            with open(self.log) as f:
+                return sum(1 for _ in f)
+        except FileNotFoundError:
+            return 0
+
+
+def evaluate(text: str, stub: StubZsh, spawns=None):
+    """Evaluate the translated code one top-level statement at a time
+
+    If `spawns` is specified, the number of zsh processes spawned is added for each kind of statement."""
+    saved_env = dict(os.environ)
+    settings = Settings.default()
+    try:
+        with runtime.init_context(persistent_worker=False, parallel=0) as ctx:
+            namespace = {"ctx": ctx, "__env__": _Env(), "aliases": {}}
+            for stmt in passes.run_passes(parse(text), settings):
+                code = _XONSH_ENV_ASSIGN.sub(
+                    r'\1__env__["\2"]=', stmt.translate(settings)
+                )
+                before = stub.spawned()
+                exec(compile(code, "<bench>", "exec"), namespace)
+                if spawns is not None:
+                    counts = spawns[statement_kind(stmt)]
+                    counts["statements"] += 1
+                    counts["spawns"] += stub.spawned() - before
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_env)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=BENCHMARKS,
+            capture_output=True,
+            encoding="utf-8",
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args) -> dict:
+    results = {}
+    spawns = {}
+    with tempfile.TemporaryDirectory(prefix="zsh2xonsh-bench-") as tmp:
+        stub = StubZsh(tmp)
+        for name, text in corpora(args.scales, args.statements):
+            count = len(parse(text))
+            for phase, func in (
+                ("parse", lambda: parse(text)),
+                ("translate", lambda: translate_to_xonsh(text)),
+            ):
+                res = measure(func, args.repeat)
+                res["statements"] = count
+                results[f"{phase}/{name}"] = res
+                print(
+                    f"{phase:>10} {name:<36} {res['wall'] * 1e3:10.2f}ms"
+                    f" {res['wall'] / count * 1e6:8.2f}us/stmt"
+                    f" {res['peak_bytes'] / 1e6:8.2f}MB peak"
+                )
+            if name.startswith("synthetic/") and name != f"synthetic/x{args.scales[0]}":
+                # Evaluating is slow (and linear), so the smallest scale is enough
+                continue
+            counts = collections.defaultdict(lambda: {"statements": 0, "spawns": 0})
+            evaluate(text, stub, counts)
+            spawns[name] = dict(counts)
+            res = measure(lambda: evaluate(text, stub), args.repeat)
+            res["statements"] = count
+            res["spawns"] = sum(c["spawns"] for c in counts.values())
+            results[f"runtime/{name}"] = res
+            print(
+                f"{'runtime':>10} {name:<36} {res['wall'] * 1e3:10.2f}ms"
+                f" {res['spawns']:8} spawns"
+                f" {res['peak_bytes'] / 1e6:8.2f}MB peak"
+            )
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+        "spawns_by_kind": spawns,
+    }
+
+
+def compare(old: dict, new: dict, threshold: float) -> list[str]:
+    """Returns the descriptions of all the regressions"""
+    regressions = []
+    for key, new_res in new["results"].items():
+        old_res = old["results"].get(key)
+        if old_res is None:
+            continue
+        for metric in ("wall", "peak_bytes", "spawns"):
+            if metric not in new_res or metric not in old_res:
+                continue
+            before, after = old_res[metric], new_res[metric]
+            if before == 0:
+                worse = after > 0
+            else:
+                worse = after / before > 1 + threshold
+            if worse:
+                regressions.append(f"{key} {metric}: {before:.6g} -> {after:.6g}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--statements", type=int, default=500)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--output", type=Path, help="Save the results as JSON")
+    parser.add_argument(
+        "--compare", type=Path, help="Compare against earlier results (from --output)"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="The relative slowdown that counts as a regression",
+    )
+    args = parser.parse_args()
+    results = run_suite(args)
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+    if args.compare is not None:
+        old = json.loads(args.compare.read_text())
+        regressions = compare(old, results, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions compared to {old['meta'].get('commit')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Compare spawning a fresh zsh per expansion against the persistent worker
+
+Replays every expression that the runtime would delegate to zsh
+(from `examples/macbook2021-config.zsh` by default), once in each mode.
+
+Usage: python benchmarks/bench_worker.py [--repeat N] [file.zsh]
+"""
+import argparse
+import shutil
+import sys
+import time
+from pathlib import Path
+
+from zsh2xonsh import ast, translate
+from zsh2xonsh.parser import ShellParser
+from zsh2xonsh.runtime import ZshContext, _SharedState
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "examples"
+
+
+def delegated_expressions(stmts):
+    """Yield a (method name, argument) pair for every expression delegated to zsh"""
+    for stmt in stmts:
+        if isinstance(stmt, ast.ConditionalStmt):
+            yield from delegated_expressions([stmt.condition, *stmt.then])
+        elif isinstance(stmt, ast.FunctionDeclaration):
+            yield from delegated_expressions(stmt.body)
+        elif isinstance(stmt, ast.FunctionInvocation):
+            yield from delegated_expressions(stmt.args)
+        elif isinstance(stmt, ast.AssignmentStmt) and stmt.value is not None:
+            yield from delegated_expressions([stmt.value])
+        elif isinstance(stmt, ast.SubcommandExpr):
+            yield "zsh", stmt.command
+        elif isinstance(stmt, ast.TestCommandExpr):
+            yield "zsh_test_command", stmt.text
+        elif isinstance(stmt, ast.QuotedExpression):
+            if not translate.is_simple_quoted(stmt.inside_text):
+                yield "zsh_expand_quote", stmt.inside_text
+
+
+def bench(exprs, *, persistent_worker: bool, repeat: int) -> float:
+    shared = _SharedState(persistent_worker=persistent_worker)
+    try:
+        ctx = ZshContext(shared=shared)
+        if persistent_worker:
+            ctx.zsh("true")  # Don't count worker startup
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for method, arg in exprs:
+                getattr(ctx, method)(arg)
+        return time.perf_counter() - start
+    finally:
+        shared.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", nargs="?", default=EXAMPLES / "macbook2021-config.zsh")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    if shutil.which("zsh") is None:
+        sys.exit("ERROR: This benchmark requires `zsh` to be installed")
+    source = Path(args.input).read_text()
+    parser = ShellParser(source.splitlines())
+    stmts = []
+    while (stmt := parser.statement()) is not None:
+        stmts.append(stmt)
+    exprs = list(delegated_expressions(stmts))
+    count = len(exprs) * args.repeat
+    print(f"Replaying {len(exprs)} expressions x {args.repeat} from {args.input}")
+    for label, persistent_worker in (("spawn", False), ("worker", True)):
+        elapsed = bench(exprs, persistent_worker=persistent_worker, repeat=args.repeat)
+        print(
+            f"{label:>8}: {elapsed:8.3f}s total, {elapsed / count * 1e3:8.3f}ms per expansion"
+        )
+
+
+if __name__ == "__main__":
+    main()
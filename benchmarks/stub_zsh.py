@@ -0,0 +1,116 @@
+"""A deterministic stand-in for zsh, used by `bench_suite.py`
+
+This understands just enough to satisfy the runtime:
+1. `zsh --no-exec -c CMD` (a syntax check) always succeeds
+2. `zsh -f -c SCRIPT` (the batched syntax check) reports every command as valid
+3. `zsh -c CMD ARGS...` handles `export NAME=VALUE`, `printf '%s\\0' "${NAME}"`,
+   `print -rn -- "..."` and `[[ ... ]]` (which is always true).
+   Any other command prints `stub`.
+
+Values are expanded with simple `$NAME`, `${NAME}`, `$1` and `$(...)` substitutions.
+
+Every invocation is appended to the file `$ZSH2XONSH_STUB_LOG` (if set),
+so the number of spawned processes can be counted.
+
+Usage: ZSH2XONSH_ZSH=<wrapper for this script> ...
+"""
+import os
+import re
+import sys
+
+_EXPANSION_PATTERN = re.compile(
+    r"\$\((?P<subst>[^)]*)\)|\$\{(?P<braced>[^}]*)\}|\$(?P<name>[A-Za-z_]\w*|[0-9])"
+)
+_BRACED_PATTERN = re.compile(r"([A-Za-z_]\w*|[0-9]+)(?:([-+:]+)(.*))?")
+
+
+def expand(text: str, env: dict, args: list) -> str:
+    def lookup(name):
+        if name.isdigit():
+            idx = int(name)
+            return args[idx - 1] if 0 < idx <= len(args) else None
+        return env.get(name)
+
+    def replace(m):
+        if m.group("subst") is not None:
+            return "stub"
+        elif m.group("name") is not None:
+            return lookup(m.group("name")) or ""
+        inner = _BRACED_PATTERN.fullmatch(m.group("braced"))
+        if inner is None:
+            return ""
+        name, op, word = inner.groups()
+        value = lookup(name)
+        if op is None:
+            return value or ""
+        elif "+" in op:
+            return expand(word, env, args) if value else ""
+        else:
+            return value if value else expand(word, env, args)
+
+    return _EXPANSION_PATTERN.sub(replace, text)
+
+
+def unquote(text: str, env: dict, args: list) -> str:
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] == "'":
+        return text[1:-1]
+    elif len(text) >= 2 and text[0] == text[-1] == '"':
+        text = text[1:-1]
+    return expand(text, env, args)
+
+
+def run(script: str, args: list) -> int:
+    env = dict(os.environ)
+    out = sys.stdout
+    status = 0
+    for line in script.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        elif line.startswith("export ") and "=" in line:
+            name, _, value = line[len("export ") :].partition("=")
+            env[name.strip()] = unquote(value, env, args)
+        elif line.startswith("printf '%s\\0' "):
+            out.write(unquote(line[len("printf '%s\\0' ") :], env, args) + "\0")
+        elif line.startswith("print -rn -- "):
+            out.write(unquote(line[len("print -rn -- ") :], env, args))
+        elif line.startswith("[["):
+            status = 0
+        else:
+            out.write("stub\n")
+    return status
+
+
+def main(argv: list) -> int:
+    flags = []
+    idx = 0
+    while idx < len(argv) and argv[idx] != "-c":
+        flags.append(argv[idx])
+        idx += 1
+    if idx + 1 >= len(argv):
+        print("stub_zsh: expected `-c CMD`", file=sys.stderr)
+        return 1
+    cmd, args = argv[idx + 1], argv[idx + 2 :]
+    if "--no-exec" in flags:
+        mode = "check"
+    elif "-f" in flags:
+        mode = "validate"
+    else:
+        mode = "run"
+    log = os.environ.get("ZSH2XONSH_STUB_LOG")
+    if log:
+        with open(log, "at") as f:
+            f.write(mode + "\n")
+    if mode == "check":
+        return 0
+    elif mode == "validate":
+        commands = sys.stdin.read().split("\0")[:-1]
+        sys.stdout.write("0\0\0" * len(commands))
+        return 0
+    # NOTE: Like `zsh -c`, the first argument is $0
+    return run(cmd, args[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -23,9 +23,21 @@ The `ctx` is used to resolve local variables.
 The whole runtime and generator is all pure-python (except for the actual generated code).
 """
 
+__version__ = "0.1.0-beta.1"
+
+
+from typing import Iterable, Iterator, Union
+
+# When streaming, this many statements are optimized (and validated) together
+STREAMING_CHUNK_SIZE = 256
+
 
 def translate_to_xonsh(
-    zsh: str, *, settings=None, extra_builtins: set[str] = frozenset()
+    zsh: Union[str, Iterable[str]],
+    *,
+    settings=None,
+    extra_builtins: set[str] = frozenset(),
+    previous=None,
 ) -> str:
     """Translate the specified zsh code to xonsh
 
@@ -34,20 +46,163 @@ def translate_to_xonsh(
 
     Accepts `extra_builtins` as the set of extra builtin functions
     (assumed to be provided to the code).
+
+    If `settings.validate_syntax` is set, then the syntax of all delegated commands
+    is checked (by zsh) ahead of time, and the runtime will skip checking them again.
+    This is done with a single zsh process (reporting every failure).
+
+    If `previous` is a `zsh2xonsh.incremental.TranslationArtifact` (from translating an earlier version),
+    then only the changed statements are re-translated. See `zsh2xonsh.incremental.translate`,
+    which also returns the new artifact.
+
+    NOTE: The output of incremental translation is less optimized,
+    since the optimization passes only apply within each top-level statement.
+    There is no batching, prefetching, constant propagation or inlining across statements,
+    so the result only matches a full translation when those passes are disabled in the `settings`.
     """
+    if previous is not None:
+        from . import incremental
+
+        return incremental.translate(
+            zsh, previous, settings=settings, extra_builtins=extra_builtins
+        ).text
     from . import translate
-    from .parser import ShellParser
 
     if settings is None:
         settings = translate.Settings.default()
-    parser = ShellParser(zsh.splitlines(), extra_builtins=frozenset(extra_builtins))
-    stmts = []
-    while (stmt := parser.statement()) is not None:
-        stmts.append(stmt)
-    return "\n".join([stmt.translate(settings) for stmt in stmts])
+    chunks = _optimized_chunks(zsh, settings, extra_builtins, streaming=False)
+    return "\n".join(_translate_chunks(chunks, settings, "xonsh"))
+
+
+def translate_to_python(
+    zsh: Union[str, Iterable[str]],
+    *,
+    settings=None,
+    extra_builtins: set[str] = frozenset(),
+):
+    """Translate the specified zsh code directly into a python `ast.Module`
+
+    Unlike `translate_to_xonsh`, the result is plain python:
+    environment variables are assigned with `XSH.env[...]` and aliases with `XSH.aliases[...]`.
+    So it can be compiled with `compile()`, skipping xonsh's (much slower) parser.
+    The code expects `ctx` and `XSH` to be defined (see `runtime.xonshi.session`),
+    along with any extra builtins.
+
+    Line numbers are those of the zsh source. Use `ast.unparse` to see the code.
+    """
+    import ast as pyast
+
+    from . import translate
+
+    if settings is None:
+        settings = translate.Settings.default()
+    body = []
+    for validated, stmts in _optimized_chunks(
+        zsh, settings, extra_builtins, streaming=False
+    ):
+        if validated:
+            call = pyast.Call(
+                pyast.Attribute(
+                    pyast.Name("ctx", pyast.Load()), "assume_valid_syntax", pyast.Load()
+                ),
+                [pyast.Constant(validated)],
+                [],
+            )
+            body.append(pyast.Expr(call, lineno=stmts[0].span.start.line))
+        for stmt in stmts:
+            body.extend(stmt.to_python(settings))
+    return pyast.fix_missing_locations(pyast.Module(body, type_ignores=[]))
+
+
+def iter_translate(
+    zsh: Union[str, Iterable[str]],
+    *,
+    settings=None,
+    extra_builtins: set[str] = frozenset(),
+    target: str = "xonsh",
+) -> Iterator[str]:
+    """Translate the specified zsh code to xonsh, yielding the translated statements as they are parsed
+
+    The input can be a string or any iterable of lines (like a file),
+    which is read lazily. Memory use doesn't depend on the size of the input.
+
+    Statements are optimized (and validated) in chunks of `STREAMING_CHUNK_SIZE`,
+    so a syntax error is only reported after the preceding chunks have been yielded.
+    If the input is a string, the whole input is optimized (and validated) at once instead,
+    just like `translate_to_xonsh`.
+
+    If the `target` is "python", then the statements are plain python instead of xonsh
+    (unparsed from `translate_to_python`).
+
+    See `translate_to_xonsh` for the meaning of the other arguments.
+    """
+    from . import translate
+
+    if target not in ("xonsh", "python"):
+        raise ValueError(f"Unknown target: {target!r}")
+    if settings is None:
+        settings = translate.Settings.default()
+    chunks = _optimized_chunks(
+        zsh, settings, extra_builtins, streaming=not isinstance(zsh, str)
+    )
+    return _translate_chunks(chunks, settings, target)
+
+
+def _translate_chunks(chunks, settings, target: str) -> Iterator[str]:
+    if target == "python":
+        import ast as pyast
+    for validated, stmts in chunks:
+        if validated:
+            yield f"ctx.assume_valid_syntax({validated!r})"
+        for stmt in stmts:
+            if target == "python":
+                yield "\n".join(map(pyast.unparse, stmt.to_python(settings)))
+            else:
+                yield stmt.translate(settings)
+
+
+def _optimized_chunks(
+    zsh, settings, extra_builtins, *, streaming: bool
+) -> Iterator[tuple[tuple, list]]:
+    """Parse and optimize the statements in chunks,
+    yielding the commands validated by `_validate_syntax` along with each chunk
+
+    Unless `streaming`, the whole input is a single chunk,
+    so the passes see every statement (and every syntax error is reported by a single zsh process)."""
+    from . import passes
+    from .parser import ShellParser
+
+    # NOTE: The known constants carry over between chunks
+    constants = passes.Constants()
+
+    def optimize(chunk):
+        stmts = passes.run_passes(chunk, settings, constants)
+        return (_validate_syntax(stmts) if settings.validate_syntax else ()), stmts
 
+    parser = ShellParser(zsh, extra_builtins=frozenset(extra_builtins))
+    if not streaming:
+        stmts = list(parser.statements())
+        if stmts:
+            yield optimize(stmts)
+        return
+    chunk = []
+    for stmt in parser.statements():
+        chunk.append(stmt)
+        if len(chunk) >= STREAMING_CHUNK_SIZE:
+            yield optimize(chunk)
+            chunk = []
+    if chunk:
+        yield optimize(chunk)
 
-def translate_to_xonsh_and_eval(zsh: str, *, extra_builtins: dict[str, object] = None):
+
+def translate_to_xonsh_and_eval(
+    zsh: str,
+    *,
+    extra_builtins: dict[str, object] = None,
+    cache=True,
+    mode: str = "translate",
+    backend: str = "python",
+):
     """Translate the specified zsh code to xonsh,
     then translate it.
 
@@ -55,19 +210,112 @@ def translate_to_xonsh_and_eval(zsh: str, *, extra_builtins: dict[str, object] =
     running `evalx(translate_to_xonsh(zsh))`
 
     The extra_builtins allows the zsh code acess to an extra set of builtin functions.
+
+    By default, the translated & compiled code is cached on disk,
+    so subsequent calls with the same input skip both translation and xonsh's parser.
+    Pass `cache=False` to disable this, or a `zsh2xonsh.cache.TranslationCache` to customize it.
+
+    If the `mode` is "env-diff", then the code isn't translated at all.
+    Instead, the whole script is run by a single zsh process,
+    and the resulting changes to environment variables & aliases are applied to xonsh.
+    This only works for scripts that don't define functions (see `ZshContext.apply_env_diff`).
+
+    The `backend` controls how translated code is compiled.
+    By default ("python") the code is translated straight into a python AST (see `translate_to_python`),
+    which avoids xonsh's parser entirely.
+    The "xonsh" backend compiles the output of `translate_to_xonsh` with xonsh's parser.
     """
     if extra_builtins is None:
         extra_builtins = {}
     assert "runtime" not in extra_builtins, "runtime is already provided"
+    assert "ctx" not in extra_builtins, "ctx is already provided"
+    assert "XSH" not in extra_builtins, "XSH is already provided"
     from . import runtime
 
-    try:
-        from xonsh.built_ins import builtins
+    if mode == "env-diff":
+        if extra_builtins:
+            raise ValueError("The extra builtins can't be called from env-diff mode")
+        with runtime.init_context() as ctx:
+            ctx.apply_env_diff(zsh)
+        return
+    elif mode != "translate":
+        raise ValueError(f"Unknown mode: {mode!r}")
+    if backend not in ("python", "xonsh"):
+        raise ValueError(f"Unknown backend: {backend!r}")
+    from .cache import TranslationCache
+    from .translate import Settings
 
-        evlax = builtins.evalx
+    try:
+        import xonsh
+        from xonsh.built_ins import XSH
     except ImportError:
         raise RuntimeError("Unable to import xonsh builtins. Do you have it installed?")
-    translated = translate_to_xonsh(zsh, extra_builtins=set(extra_builtins.keys()))
+    settings = Settings.default()
+    # We're about to run the code, so zsh must be present anyways
+    settings.validate_syntax = True
+    if cache is True:
+        cache = TranslationCache()
+    if cache:
+        key = cache.key(
+            zsh,
+            settings=settings,
+            extra_builtins=extra_builtins.keys(),
+            extra=(f"xonsh-{xonsh.__version__}", f"backend-{backend}"),
+        )
+        cached = cache.load(key)
+    else:
+        cached = None
     with runtime.init_context() as ctx:
-        global_vars = extra_builtins  # Define extra builtins as globals, so sub-functions can get them
-        execx(translated, mode="exec", locs={"ctx": ctx}, glbs=global_vars)
+        # Define extra builtins as globals, so sub-functions can get them
+        #
+        # NOTE: Functions are defined in the same namespace, so they can call each other
+        namespace = {
+            **{name: ctx.wrap_builtin(func) for name, func in extra_builtins.items()},
+            "ctx": ctx,
+            "XSH": XSH,
+        }
+        if cached is not None:
+            code = cached.code
+        elif backend == "python":
+            import ast as pyast
+
+            module = translate_to_python(
+                zsh, settings=settings, extra_builtins=set(extra_builtins.keys())
+            )
+            code = compile(module, "<zsh2xonsh>", "exec")
+            if cache:
+                cache.store(key, pyast.unparse(module), code)
+        else:
+            translated = translate_to_xonsh(
+                zsh, settings=settings, extra_builtins=set(extra_builtins.keys())
+            )
+            code = XSH.execer.compile(
+                translated, mode="exec", glbs=namespace, filename="<zsh2xonsh>"
+            )
+            if cache:
+                cache.store(key, translated, code)
+        exec(code, namespace)
+
+
+def _validate_syntax(stmts) -> tuple[str, ...]:
+    """Validate the syntax of all commands delegated to zsh, with a single zsh process
+
+    Returns the validated commands, or throws a ZshSyntaxValidationError listing all failures"""
+    from . import ast, translate
+    from .parser import ZshSyntaxValidationError
+
+    nodes_by_command = {}
+    for node, cmd in ast.delegated_commands(stmts):
+        nodes_by_command.setdefault(cmd, []).append(node)
+    commands = list(nodes_by_command.keys())
+    failures = [
+        (node.span.start, cmd, reason)
+        for cmd, reason in zip(commands, translate.validate_zsh_syntax(commands))
+        if reason is not None
+        for node in nodes_by_command[cmd]
+    ]
+    if failures:
+        failures.sort(key=lambda failure: (failure[0].line, failure[0].offset))
+        raise ZshSyntaxValidationError(failures)
+    return tuple(commands)
+
@@ -1,12 +1,32 @@
+import contextlib
+import os
 import sys
+from pathlib import Path
 
 import click
 
-from . import translate_to_xonsh
+from . import batch, iter_translate
 from .parser import ShellParser
+from .translate import Settings
 
 
-@click.command()
+class _DefaultGroup(click.Group):
+    """A group that falls back to the `translate` command
+
+    This keeps `zsh2xonsh input.zsh` working, now that there are subcommands."""
+
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands and args[0] not in ("--help",)):
+            args = ["translate", *args]
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=_DefaultGroup)
+def zsh2xonsh():
+    """Translates zsh to xonsh scripts"""
+
+
+@zsh2xonsh.command("translate")
 @click.option("--validate", help="Only validate the inputs, do not output them")
 @click.option(
     "extra_builtins",
@@ -24,14 +44,32 @@ from .parser import ShellParser
     help="Assume the runtime is already present (instead of assuming it's already present)",
 )
 @click.option("stdin", "--stdin", is_flag=True, help="Read input from stdin")
+@click.option(
+    "check_syntax",
+    "--check-syntax",
+    is_flag=True,
+    help="Validate the syntax of delegated commands with zsh (so the runtime can skip it)",
+)
+@click.option(
+    "env_diff",
+    "--env-diff",
+    is_flag=True,
+    help="Don't translate, just run the whole script in zsh and apply the changes (env vars & aliases only)",
+)
 @click.option(
     "assume_context",
     "--assume-context",
     "-c",
     is_flag=True,
 )
+@click.option(
+    "--target",
+    type=click.Choice(["xonsh", "python"]),
+    default="xonsh",
+    help="Output xonsh code, or plain python (which assigns env vars with `XSH.env`)",
+)
 @click.argument("input_file", required=False)
-def zsh2xonsh(
+def translate(
     input_file: str,
     extra_builtins,
     cmd=None,
@@ -39,38 +77,190 @@ def zsh2xonsh(
     assume_runtime=False,
     assume_context=False,
     stdin=False,
+    check_syntax=False,
+    env_diff=False,
+    target="xonsh",
+):
+    """Translates a single zsh script (the default command)"""
+    with contextlib.ExitStack() as stack:
+        if cmd is not None:
+            source = cmd
+        elif input_file is not None:
+            source = stack.enter_context(open(input_file, "rt"))
+        elif stdin:
+            source = sys.stdin
+        else:
+            raise click.ClickException(
+                "Must specifiy either `--cmd` `--stdin` or an input file"
+            )
+        settings = Settings.default()
+        settings.validate_syntax = check_syntax
+        if env_diff:
+            if extra_builtins:
+                raise click.ClickException("Can't use `--builtin` with `--env-diff`")
+            text = source if isinstance(source, str) else source.read()
+            output = iter([f"ctx.apply_env_diff({text!r})"])
+        else:
+            # NOTE: The input is read (and translated) lazily, so output is streamed
+            output = iter_translate(
+                source,
+                settings=settings,
+                extra_builtins=extra_builtins,
+                target=target,
+            )
+        try:
+            _print_output(
+                output,
+                validate=validate,
+                assume_runtime=assume_runtime,
+                assume_context=assume_context,
+                target=target,
+            )
+        except KeyboardInterrupt as e:
+            import traceback
+
+            print("Interrupted while translating", file=sys.stderr)
+            print("Did the parser stall?", file=sys.stderr)
+            print(traceback.format_exc(), file=sys.stderr)
+            raise
+
+
+def _print_output(
+    output, *, validate, assume_runtime, assume_context, target="xonsh"
 ):
-    """Translates zsh to xonsh scripts"""
-    if cmd is not None:
-        text = cmd
-    elif input_file is not None:
-        with open(input_file, "rt") as f:
-            text = f.read()
-    elif stdin:
-        text = sys.stdin.read()
-    else:
-        raise click.ClickException(
-            "Must specifiy either `--cmd` `--stdin` or an input file"
-        )
-    try:
-        output = translate_to_xonsh(text, extra_builtins=extra_builtins)
-    except KeyboardInterrupt as e:
-        import traceback
-
-        print("Interrupted while translating", file=sys.stderr)
-        print("Did the parser stall?", file=sys.stderr)
-        print(traceback.format_exc(), file=sys.stderr)
-        raise
     if validate:
+        for _ in output:
+            pass
         return
-    indent = ""
-    if not assume_runtime:
-        print("from zsh2xonsh import runtime")
-    if not assume_context:
-        print("with runtime.init_context() as ctx:")
-        indent = " " * 4
-    for line in output.splitlines():
-        print(indent + line)
+    # NOTE: The header isn't printed until the first statement, so nothing is printed for early errors
+    first = next(output, None)
+    if first is None:
+        return
+    lines = batch.format_program(
+        _chain(first, output),
+        assume_runtime=assume_runtime,
+        assume_context=assume_context,
+        target=target,
+    )
+    for line in lines:
+        print(line)
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+@zsh2xonsh.command("batch")
+@click.argument(
+    "inputs", nargs=-1, required=True, type=click.Path(exists=True, path_type=Path)
+)
+@click.option(
+    "output_dir",
+    "--output-dir",
+    "-o",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Write the outputs into this directory (mirroring the inputs), instead of next to the inputs",
+)
+@click.option(
+    "patterns",
+    "--glob",
+    multiple=True,
+    default=batch.DEFAULT_PATTERNS,
+    show_default=True,
+    help="The files to translate when searching directories",
+)
+@click.option(
+    "suffix", "--suffix", default=batch.DEFAULT_SUFFIX, show_default=True
+)
+@click.option(
+    "jobs",
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    help="The number of worker processes (defaults to the number of CPUs)",
+)
+@click.option(
+    "force", "--force", "-f", is_flag=True, help="Translate even if up to date"
+)
+@click.option(
+    "extra_builtins",
+    "--builtin",
+    "-b",
+    help="An extra builtin funciton, assumed to be provided by the environment",
+    multiple=True,
+)
+@click.option(
+    "check_syntax",
+    "--check-syntax",
+    is_flag=True,
+    help="Validate the syntax of delegated commands with zsh (so the runtime can skip it)",
+)
+def batch_command(
+    inputs,
+    output_dir,
+    patterns,
+    suffix,
+    jobs,
+    force,
+    extra_builtins,
+    check_syntax,
+):
+    """Translates many scripts (or directories of scripts) in parallel
+
+    Inputs are skipped if their output is already up to date."""
+    try:
+        found = batch.find_jobs(
+            inputs, output_dir=output_dir, patterns=patterns, suffix=suffix
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    settings = Settings.default()
+    settings.validate_syntax = check_syntax
+    counts = {status: 0 for status in batch.BatchStatus}
+    failures = []
+    for result in batch.run_batch(
+        found,
+        settings=settings,
+        extra_builtins=frozenset(extra_builtins),
+        force=force,
+        max_workers=jobs or os.cpu_count() or 1,
+    ):
+        counts[result.status] += 1
+        if result.status == batch.BatchStatus.FAILED:
+            failures.append(result)
+    for result in failures:
+        click.echo(result.describe_failure(), err=True)
+    click.echo(
+        f"Translated {counts[batch.BatchStatus.TRANSLATED]}, "
+        f"up to date {counts[batch.BatchStatus.UP_TO_DATE]}, "
+        f"failed {counts[batch.BatchStatus.FAILED]}",
+        err=True,
+    )
+    if failures:
+        sys.exit(1)
+
+
+@zsh2xonsh.command("serve")
+@click.option(
+    "socket_path",
+    "--socket",
+    help="The Unix socket to listen on (defaults to `$ZSH2XONSH_SOCKET` or the runtime directory)",
+)
+def serve_command(socket_path):
+    """Runs a translation daemon, for use with `zsh2xonsh.client`
+
+    This avoids paying for startup on every translation."""
+    from . import client, server
+
+    if socket_path is None:
+        socket_path = client.default_socket_path()
+    try:
+        srv = server.create_server(socket_path)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Listening on {socket_path}", err=True)
+    server.serve(srv)
 
 
 if __name__ == "__main__":
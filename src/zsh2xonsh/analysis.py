@@ -0,0 +1,145 @@
+"""Dependency analysis of the AST
+
+This computes the parameters (env vars & locals) and aliases that each node reads and writes.
+It's used by `passes.schedule_prefetch` to decide which expressions are independent.
+
+Everything here is conservative: when in doubt, a node reads (or writes) everything.
+In particular, anything run by zsh reads *every* parameter,
+since a subprocess inherits the whole environment (and locals are passed as env vars).
+A command run by zsh also writes everything (it could modify the filesystem),
+unless it is known to be pure (see `is_pure_command`).
+"""
+from __future__ import annotations
+
+from typing import NamedTuple
+
+from . import conditions, params, translate
+from .ast import (
+    AssignmentBatch,
+    AssignmentKind,
+    AssignmentStmt,
+    ConditionalStmt,
+    ExprStmt,
+    FunctionDeclaration,
+    FunctionInvocation,
+    FunctionInvocationKind,
+    LiteralExpr,
+    Node,
+    QuotedExpression,
+    QuoteStyle,
+    SubcommandExpr,
+    TestCommandExpr,
+)
+
+# Stands for every parameter (and alias)
+EVERYTHING = "*"
+
+
+def alias_key(name: str) -> str:
+    """The key used for an alias (so it doesn't conflict with a parameter of the same name)"""
+    return f"alias:{name}"
+
+
+class Effects(NamedTuple):
+    reads: frozenset[str]
+    writes: frozenset[str]
+
+    def __or__(self, other: Effects) -> Effects:
+        return Effects(self.reads | other.reads, self.writes | other.writes)
+
+    def depends_on(self, earlier: Effects) -> bool:
+        """If this must run after the (earlier) effects
+
+        This only considers the earlier writes.
+        Commands with side effects write everything (see `effects`),
+        so nothing that reads anything can be moved before them."""
+        if not earlier.writes:
+            return False
+        elif EVERYTHING in self.reads or EVERYTHING in earlier.writes:
+            return True
+        return not self.reads.isdisjoint(earlier.writes)
+
+
+NO_EFFECTS = Effects(frozenset(), frozenset())
+UNKNOWN_EFFECTS = Effects(frozenset({EVERYTHING}), frozenset({EVERYTHING}))
+_READS_EVERYTHING = Effects(frozenset({EVERYTHING}), frozenset())
+
+
+def _reads(names) -> Effects:
+    return Effects(frozenset(names), frozenset())
+
+
+def is_pure_command(node: Node) -> bool:
+    """If the command that the node delegates to zsh can't have any side effects
+
+    Command substitutions are only pure if they're marked with the `# zsh2xonsh: pure` pragma.
+    Parameter expansions and tests are pure unless they contain a command substitution."""
+    if isinstance(node, SubcommandExpr):
+        return node.pure
+    elif isinstance(node, (QuotedExpression, TestCommandExpr)):
+        cmd = node.delegated_command()
+        return cmd is None or ("$(" not in cmd and "`" not in cmd)
+    else:
+        return False
+
+
+def _delegated(node: Node) -> Effects:
+    return _READS_EVERYTHING if is_pure_command(node) else UNKNOWN_EFFECTS
+
+
+def effects(node: Node) -> Effects:
+    """The effects of the specified node (including all its children)"""
+    if isinstance(node, SubcommandExpr):
+        return _delegated(node)
+    elif isinstance(node, QuotedExpression):
+        txt = node.inside_text
+        if node.style == QuoteStyle.SINGLE or translate.is_simple_quoted(txt):
+            return NO_EFFECTS
+        try:
+            return _reads(params.referenced_names(params.parse_quoted(txt)))
+        except params.UnsupportedExpansion:
+            return _delegated(node)
+    elif isinstance(node, LiteralExpr):
+        return _reads({"HOME"}) if node.text.startswith("~") else NO_EFFECTS
+    elif isinstance(node, TestCommandExpr):
+        try:
+            return _reads(conditions.referenced_names(conditions.parse_test(node.text)))
+        except params.UnsupportedExpansion:
+            return _delegated(node)
+    elif isinstance(node, ExprStmt):
+        return effects(node.expr)
+    elif isinstance(node, AssignmentStmt):
+        if node.kind == AssignmentKind.ALIAS:
+            # The value isn't evaluated until the alias is invoked
+            return Effects(frozenset(), frozenset({alias_key(node.target)}))
+        value = node.value if node.value is not None else node.implicit_value()
+        return effects(value) | Effects(frozenset(), frozenset({node.target}))
+    elif isinstance(node, AssignmentBatch):
+        res = NO_EFFECTS
+        for stmt in node.assignments:
+            res |= effects(stmt)
+        # Everything is evaluated by zsh
+        return res | _READS_EVERYTHING
+    elif isinstance(node, ConditionalStmt):
+        res = effects(node.condition)
+        for stmt in node.then:
+            res |= effects(stmt)
+        return res
+    elif isinstance(node, FunctionDeclaration):
+        # Declaring it doesn't run anything
+        return NO_EFFECTS
+    elif isinstance(node, FunctionInvocation):
+        if node.kind == FunctionInvocationKind.STANDARD_BUILTIN:
+            res = NO_EFFECTS
+        else:
+            # We don't know what functions (or extra builtins) do
+            res = UNKNOWN_EFFECTS
+        for arg in node.args:
+            res |= effects(arg)
+        return res
+    else:
+        # Unknown node
+        return UNKNOWN_EFFECTS
+
+
+__all__ = ["Effects", "EVERYTHING", "alias_key", "is_pure_command", "effects"]
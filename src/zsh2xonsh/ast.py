@@ -1,50 +1,217 @@
 """Basic AST for zsh code"""
+from __future__ import annotations
+
+import ast as pyast
+import bisect
 import itertools
+import sys
 from abc import ABCMeta, abstractmethod
+from array import array
 from dataclasses import dataclass
 from enum import Enum
-from typing import Optional
+from typing import Iterable, Iterator, Optional, Union
+
+from . import conditions, params, translate
 
-from . import translate
+# NOTE: Nodes are slotted (to save memory on large inputs), which requires python 3.10
+_node = dataclass(**({"slots": True} if sys.version_info >= (3, 10) else {}))
 
 
-@dataclass
+@dataclass(frozen=True)
 class Location:
     line: int
     offset: int
 
 
-@dataclass
+class LineTable:
+    """The offsets where each line of a source starts
+
+    This is shared by all the spans of a source,
+    so they only need to store offsets."""
+
+    __slots__ = ("starts",)
+    # The (absolute) offset of the start of each line (in order)
+    starts: array
+
+    def __init__(self, starts: Iterable[int] = ()):
+        self.starts = array("q", [0])
+        self.starts.extend(starts)
+
+    def add_line(self, start: int):
+        assert start > self.starts[-1]
+        self.starts.append(start)
+
+    def line_index(self, pos: int) -> int:
+        """The (zero-based) index of the line containing the offset"""
+        return bisect.bisect_right(self.starts, pos) - 1
+
+    def location(self, pos: int) -> Location:
+        """Convert an offset into a `Location` (with one-based lines and zero-based offsets)"""
+        idx = self.line_index(pos)
+        return Location(line=idx + 1, offset=pos - self.starts[idx])
+
+
 class Span:
-    start: Location
-    end: Location
+    """The region of the source that a node came from
+
+    This is packed as a pair of offsets,
+    which are only converted into a `Location` when needed (like for error messages)."""
+
+    __slots__ = ("start_offset", "end_offset", "lines")
+    start_offset: int
+    end_offset: int
+    lines: LineTable
+
+    def __init__(self, start_offset: int, end_offset: int, lines: LineTable):
+        self.start_offset = start_offset
+        self.end_offset = end_offset
+        self.lines = lines
+
+    @property
+    def start(self) -> Location:
+        return self.lines.location(self.start_offset)
+
+    @property
+    def end(self) -> Location:
+        return self.lines.location(self.end_offset)
+
+    def to(self, other: Span) -> Span:
+        """The span from the start of this one to the end of the other"""
+        assert self.lines is other.lines
+        return Span(self.start_offset, other.end_offset, self.lines)
+
+    def shifted(self, delta: int, lines: LineTable) -> Span:
+        """The same span, moved by `delta` characters into another (edited) source"""
+        return Span(self.start_offset + delta, self.end_offset + delta, lines)
+
+    def __eq__(self, other):
+        if not isinstance(other, Span):
+            return NotImplemented
+        # NOTE: Spans from different tables are equal if they decode the same
+        if (self.start_offset, self.end_offset) != (other.start_offset, other.end_offset):
+            return False
+        return self.lines is other.lines or (self.start, self.end) == (other.start, other.end)
+
+    def __hash__(self):
+        return hash((self.start_offset, self.end_offset))
+
+    def __repr__(self):
+        return f"Span(start={self.start!r}, end={self.end!r})"
+
 
+class _NodeMixin:
+    __slots__ = ()
 
-@dataclass
-class Statement(metaclass=ABCMeta):
+    def children(self) -> Iterable[Node]:
+        """The direct children of this node (statements and expressions)"""
+        return ()
+
+    def delegated_command(self) -> Optional[str]:
+        """The command that this node (itself) delegates to zsh at runtime, if any"""
+        return None
+
+    def delegated_commands(self) -> Iterator[tuple[Node, str]]:
+        """All the commands delegated to zsh by this node and its children"""
+        if (cmd := self.delegated_command()) is not None:
+            yield self, cmd
+        for child in self.children():
+            yield from child.delegated_commands()
+
+
+@_node
+class Statement(_NodeMixin, metaclass=ABCMeta):
     span: Span
 
     @abstractmethod
     def translate(self, settings: translate.Settings) -> str:
         pass
 
+    @abstractmethod
+    def _to_python(self, settings: translate.Settings) -> list[pyast.stmt]:
+        pass
 
-@dataclass
-class Expression(metaclass=ABCMeta):
+    def to_python(self, settings: translate.Settings) -> list[pyast.stmt]:
+        """Translate directly into python AST (see `zsh2xonsh.translate_to_python`)
+
+        The line numbers are those of the zsh source."""
+        stmts = self._to_python(settings)
+        for stmt in stmts:
+            stmt.lineno = self.span.start.line
+            stmt.end_lineno = max(self.span.end.line, self.span.start.line)
+            stmt.col_offset = stmt.end_col_offset = 0
+        return stmts
+
+
+@_node
+class Expression(_NodeMixin, metaclass=ABCMeta):
     span: Span
 
     @abstractmethod
     def translate(self, settings: translate.Settings) -> str:
         pass
 
+    @abstractmethod
+    def to_python(self, settings: translate.Settings) -> pyast.expr:
+        """Translate directly into a python expression (equivalent to `translate`)"""
+        pass
+
+    @abstractmethod
+    def zsh_source(self) -> str:
+        """The zsh source code of this expression"""
+        pass
+
+
+Node = Union[Statement, Expression]
+
+
+def walk(nodes: Iterable[Node]) -> Iterator[Node]:
+    """Walk the specified nodes and all of their descendants (in pre-order)"""
+    for node in nodes:
+        yield node
+        yield from walk(node.children())
+
+
+def _ctx_call(method: str, *args: pyast.expr, **kwargs: pyast.expr) -> pyast.Call:
+    """A call to `ctx.<method>(...)`"""
+    return pyast.Call(
+        func=pyast.Attribute(pyast.Name("ctx", pyast.Load()), method, pyast.Load()),
+        args=list(args),
+        keywords=[pyast.keyword(key, value) for key, value in kwargs.items()],
+    )
+
 
-@dataclass
+def _xsh_item(attr: str, key: str) -> pyast.Subscript:
+    """The assignment target `XSH.<attr>[key]`"""
+    return pyast.Subscript(
+        pyast.Attribute(pyast.Name("XSH", pyast.Load()), attr, pyast.Load()),
+        pyast.Constant(key),
+        pyast.Store(),
+    )
+
+
+def delegated_commands(nodes: Iterable[Node]) -> Iterator[tuple[Node, str]]:
+    """Find every command that is delegated to zsh (at runtime)
+
+    Yields each node along with the exact command text that `ZshContext.zsh` will execute.
+
+    This does not include commands that are constructed at runtime (like complex aliases)."""
+    for node in nodes:
+        yield from node.delegated_commands()
+
+
+@_node
 class ExprStmt(Statement):
     expr: Expression
 
     def translate(self, settings: translate.Settings) -> str:
         return self.expr.translate(settings)
 
+    def _to_python(self, settings: translate.Settings) -> list[pyast.stmt]:
+        return [pyast.Expr(self.expr.to_python(settings))]
+
+    def children(self) -> Iterable[Node]:
+        return (self.expr,)
+
 
 class QuoteStyle(Enum):
     SINGLE = "'"
@@ -54,7 +221,7 @@ class QuoteStyle(Enum):
         return self.value
 
 
-@dataclass
+@_node
 class QuotedExpression(Expression):
     # The text on the inside, without being interpreted
     inside_text: str
@@ -62,21 +229,74 @@ class QuotedExpression(Expression):
 
     def translate(self, settings: translate.Settings) -> str:
         txt = self.inside_text
-        if translate.is_simple_quoted(txt):
+        if self.style == QuoteStyle.SINGLE or translate.is_simple_quoted(txt):
+            # Single quotes are always literal
             return repr(txt)
+        elif params.is_supported(txt):
+            parts = params.parse_quoted(txt)
+            if all(isinstance(part, str) for part in parts):
+                # Only escapes, no parameters
+                return repr("".join(parts))
+            return f"ctx.expand_quote({txt!r})"
+        else:
+            return f"ctx.zsh_expand_quote({txt!r})"
+
+    def to_python(self, settings: translate.Settings) -> pyast.expr:
+        txt = self.inside_text
+        if self.style == QuoteStyle.SINGLE or translate.is_simple_quoted(txt):
+            return pyast.Constant(txt)
+        elif params.is_supported(txt):
+            parts = params.parse_quoted(txt)
+            if all(isinstance(part, str) for part in parts):
+                return pyast.Constant("".join(parts))
+            return _ctx_call("expand_quote", pyast.Constant(txt))
         else:
-            return f"ctx.zsh_expand_quote({self.style}{txt}{self.style})"
+            return _ctx_call("zsh_expand_quote", pyast.Constant(txt))
 
+    def zsh_source(self) -> str:
+        return f"{self.style}{self.inside_text}{self.style}"
 
-@dataclass
+    def delegated_command(self) -> Optional[str]:
+        txt = self.inside_text
+        if (
+            self.style == QuoteStyle.SINGLE
+            or translate.is_simple_quoted(txt)
+            or params.is_supported(txt)
+        ):
+            return None
+        else:
+            return translate.expand_quote_command(txt)
+
+
+@_node
 class SubcommandExpr(Expression):
     command: str
+    # Marked with the `# zsh2xonsh: pure` pragma, so the result can be memoized
+    pure: bool = False
 
     def translate(self, settings: translate.Settings) -> str:
+        if self.pure:
+            names = translate.referenced_params(self.command)
+            if names is not None:
+                return f"ctx.zsh({self.command!r}, pure={tuple(sorted(names))!r})"
         return f"ctx.zsh({self.command!r})"
 
+    def to_python(self, settings: translate.Settings) -> pyast.expr:
+        kwargs = {}
+        if self.pure:
+            names = translate.referenced_params(self.command)
+            if names is not None:
+                kwargs["pure"] = pyast.Constant(tuple(sorted(names)))
+        return _ctx_call("zsh", pyast.Constant(self.command), **kwargs)
+
+    def delegated_command(self) -> Optional[str]:
+        return self.command
+
+    def zsh_source(self) -> str:
+        return f"$({self.command})"
+
 
-@dataclass
+@_node
 class LiteralExpr(Expression):
     text: str
 
@@ -88,13 +308,67 @@ class LiteralExpr(Expression):
         else:
             return f"{self.text!r}"
 
+    def to_python(self, settings: translate.Settings) -> pyast.expr:
+        if self.text.startswith("~"):
+            return _ctx_call("expand_literal", pyast.Constant(self.text))
+        elif translate.is_valid_integer(self.text):
+            return pyast.Constant(int(self.text))
+        else:
+            return pyast.Constant(self.text)
+
+    def zsh_source(self) -> str:
+        return self.text
+
 
-@dataclass
+@_node
 class TestCommandExpr(Expression):
     text: str
 
     def translate(self, settings: translate.Settings) -> str:
-        return f"ctx.zsh_test_command({self.text!r})"
+        if conditions.is_supported(self.text):
+            return f"ctx.test_condition({self.text!r})"
+        else:
+            return f"ctx.zsh_test_command({self.text!r})"
+
+    def to_python(self, settings: translate.Settings) -> pyast.expr:
+        if conditions.is_supported(self.text):
+            return _ctx_call("test_condition", pyast.Constant(self.text))
+        else:
+            return _ctx_call("zsh_test_command", pyast.Constant(self.text))
+
+    def delegated_command(self) -> Optional[str]:
+        return None if conditions.is_supported(self.text) else self.text
+
+    def zsh_source(self) -> str:
+        return self.text
+
+
+def _path_entries(entries: list[tuple[params.Part, ...]]) -> str:
+    """The entries of a `translate.PathUpdate`, as a list"""
+    items = []
+    for entry in entries:
+        if all(isinstance(part, str) for part in entry):
+            items.append(repr("".join(entry)))
+        else:
+            # NOTE: Parameters can expand into several entries
+            items.append(f"*ctx.expand_quote({params.quote(entry)!r}).split(':')")
+    return "[" + ", ".join(items) + "]"
+
+
+def _path_entries_python(entries: list[tuple[params.Part, ...]]) -> pyast.List:
+    items = []
+    for entry in entries:
+        if all(isinstance(part, str) for part in entry):
+            items.append(pyast.Constant("".join(entry)))
+        else:
+            expanded = _ctx_call("expand_quote", pyast.Constant(params.quote(entry)))
+            split = pyast.Call(
+                pyast.Attribute(expanded, "split", pyast.Load()),
+                [pyast.Constant(":")],
+                [],
+            )
+            items.append(pyast.Starred(split, pyast.Load()))
+    return pyast.List(items, pyast.Load())
 
 
 class AssignmentKind(Enum):
@@ -103,7 +377,7 @@ class AssignmentKind(Enum):
     ALIAS = "alias"
 
 
-@dataclass
+@_node
 class AssignmentStmt(Statement):
     kind: Optional[AssignmentKind]
     target: str
@@ -113,15 +387,25 @@ class AssignmentStmt(Statement):
         if self.value is None:
             assert (
                 self.kind == AssignmentKind.EXPORT
-            ), f"Assignment {kind} must have value"
+            ), f"Assignment {self.kind} must have value"
+
+    def implicit_value(self) -> QuotedExpression:
+        """The implicit value of `export FOO` (without an `=`), which is "${FOO}" """
+        assert self.value is None
+        return QuotedExpression(self.span, f"${{{self.target}}}", QuoteStyle.DOUBLE)
 
     def translate(self, settings: translate.Settings) -> str:
         if self.kind == AssignmentKind.EXPORT:
+            update = self.path_update(settings)
+            if update is not None:
+                prefix = _path_entries(update.prefix)
+                suffix = _path_entries(update.suffix)
+                return f"ctx.extend_path_var({self.target!r}, {prefix}, {suffix}, {self.value.inside_text!r})"
             if self.value is None:
-                translated_value = f'ctx.zsh_expand_quote("${{{self.target}}}")'
+                translated_value = self.implicit_value().translate(settings)
             else:
                 translated_value = f"{self.value.translate(settings)}"
-            if settings.is_path_like_var(self.target) or settings.strict_env_types:
+            if self.is_typed(settings):
                 return f"ctx.assign_typed_var({self.target!r},{translated_value})"
             else:
                 return f"${self.target}={translated_value}"
@@ -131,6 +415,8 @@ class AssignmentStmt(Statement):
         elif self.kind in (AssignmentKind.LOCAL, None):
             return f"{self.target}=ctx.assign_local({self.target!r}, {self.value.translate(settings)})"
         elif self.kind == AssignmentKind.ALIAS:
+            from .parser import ShellParseError
+
             alias_impl = None
             if isinstance(self.value, LiteralExpr):
                 # TODO: Pre-expands `~` ahead of time, when it really should be done at invocation time
@@ -157,26 +443,242 @@ class AssignmentStmt(Statement):
         else:
             raise AssertionError
 
+    def _to_python(self, settings: translate.Settings) -> list[pyast.stmt]:
+        if self.kind == AssignmentKind.EXPORT:
+            update = self.path_update(settings)
+            if update is not None:
+                call = _ctx_call(
+                    "extend_path_var",
+                    pyast.Constant(self.target),
+                    _path_entries_python(update.prefix),
+                    _path_entries_python(update.suffix),
+                    pyast.Constant(self.value.inside_text),
+                )
+                return [pyast.Expr(call)]
+            value = (
+                self.implicit_value() if self.value is None else self.value
+            ).to_python(settings)
+            if self.is_typed(settings):
+                return [
+                    pyast.Expr(
+                        _ctx_call("assign_typed_var", pyast.Constant(self.target), value)
+                    )
+                ]
+            else:
+                return [pyast.Assign([_xsh_item("env", self.target)], value)]
+        elif self.kind in (AssignmentKind.LOCAL, None):
+            value = self.value.to_python(settings)
+            return [
+                pyast.Assign(
+                    [pyast.Name(self.target, pyast.Store())],
+                    _ctx_call("assign_local", pyast.Constant(self.target), value),
+                )
+            ]
+        elif self.kind == AssignmentKind.ALIAS:
+            from .parser import ShellParseError
+
+            if isinstance(self.value, LiteralExpr):
+                alias_impl = pyast.List([self.value.to_python(settings)], pyast.Load())
+            elif isinstance(self.value, QuotedExpression):
+                if translate.can_safely_be_split(self.value.inside_text):
+                    alias_impl = pyast.List(
+                        [
+                            pyast.Constant(word)
+                            for word in self.value.inside_text.split(" ")
+                        ],
+                        pyast.Load(),
+                    )
+                else:
+                    alias_impl = _ctx_call(
+                        "zsh_impl_complex_alias",
+                        pyast.Constant(self.value.inside_text),
+                    )
+            else:
+                raise ShellParseError(
+                    "Don't know how to translate alias target", self.value.span.start
+                )
+            if not translate.is_simple_quoted(self.target):
+                raise ShellParseError("Alias target too complex", self.span.start)
+            return [pyast.Assign([_xsh_item("aliases", self.target)], alias_impl)]
+        else:
+            raise AssertionError
+
+    def children(self) -> Iterable[Node]:
+        return (self.value,) if self.value is not None else ()
+
+    def delegated_command(self) -> Optional[str]:
+        if self.kind == AssignmentKind.EXPORT and self.value is None:
+            return self.implicit_value().delegated_command()
+        return None
+
+    def delegated_commands(self) -> Iterator[tuple[Node, str]]:
+        if self.kind == AssignmentKind.ALIAS:
+            # Complex aliases are delegated when they're invoked (with runtime args)
+            return iter(())
+        return _NodeMixin.delegated_commands(self)
+
+    @property
+    def is_batchable(self) -> bool:
+        """If this assignment can be part of an `AssignmentBatch`
+
+        Literals are excluded, since they are translated differently (`017` becomes an int)."""
+        return self.kind != AssignmentKind.ALIAS and not isinstance(
+            self.value, LiteralExpr
+        )
+
+    def path_update(
+        self, settings: translate.Settings
+    ) -> Optional[translate.PathUpdate]:
+        """The entries added by an idiom like `export PATH="/opt/bin:$PATH"` (if it is one)"""
+        if (
+            self.kind == AssignmentKind.EXPORT
+            and settings.is_path_like_var(self.target)
+            and isinstance(self.value, QuotedExpression)
+            and self.value.style == QuoteStyle.DOUBLE
+        ):
+            return translate.match_path_update(self.target, self.value.inside_text)
+        return None
+
+    def is_typed(self, settings: translate.Settings) -> bool:
+        """If this is an export that uses `ctx.assign_typed_var`"""
+        return self.kind == AssignmentKind.EXPORT and (
+            settings.is_path_like_var(self.target) or settings.strict_env_types
+        )
+
+
+@_node
+class AssignmentBatch(Statement):
+    """A run of consecutive assignments, evaluated by a single zsh process
+
+    The script runs every assignment in order (so later values can depend on earlier ones),
+    printing the exit status of each command substitution and the resulting value
+    (both NUL-terminated).
+    The runtime then applies the results in order, the same way as the individual assignments.
+
+    This is created by `passes.batch_assignments`, never by the parser."""
+
+    assignments: list[AssignmentStmt]
+
+    def children(self) -> Iterable[Node]:
+        return self.assignments
+
+    def script(self) -> str:
+        lines = []
+        for stmt in self.assignments:
+            assert stmt.is_batchable
+            # NOTE: Locals are exported too, since the runtime passes them to zsh as env vars
+            if stmt.value is None:
+                lines.append(f"export {stmt.target}")
+                status = "0"
+            elif isinstance(stmt.value, SubcommandExpr):
+                # A plain assignment has the status of the command (unlike `export`)
+                lines.append(f"export {stmt.target}")
+                lines.append(f"{stmt.target}={stmt.value.zsh_source()}")
+                status = '"$?"'
+            else:
+                lines.append(f"export {stmt.target}={stmt.value.zsh_source()}")
+                status = "0"
+            lines.append(f"printf '%s\\0' {status} \"${{{stmt.target}}}\"")
+        return "\n".join(lines)
+
+    def delegated_command(self) -> Optional[str]:
+        return self.script()
+
+    def delegated_commands(self) -> Iterator[tuple[Node, str]]:
+        # Everything is done by the script
+        yield self, self.script()
+
+    def translate(self, settings: translate.Settings) -> str:
+        targets = []
+        for stmt in self.assignments:
+            kind = "export" if stmt.kind == AssignmentKind.EXPORT else "local"
+            targets.append(f"    ({kind!r}, {stmt.target!r}, {stmt.is_typed(settings)}),")
+        return "\n".join(
+            [
+                "ctx.assign_batch(",
+                f"  {self.script()!r},",
+                "  (",
+                *targets,
+                "  ),",
+                ")",
+            ]
+        )
+
+    def _to_python(self, settings: translate.Settings) -> list[pyast.stmt]:
+        targets = tuple(
+            (
+                "export" if stmt.kind == AssignmentKind.EXPORT else "local",
+                stmt.target,
+                stmt.is_typed(settings),
+            )
+            for stmt in self.assignments
+        )
+        return [
+            pyast.Expr(
+                _ctx_call(
+                    "assign_batch", pyast.Constant(self.script()), pyast.Constant(targets)
+                )
+            )
+        ]
+
+
+@_node
+class PrefetchStmt(Statement):
+    """Start running the specified (independent) commands in the background
+
+    The results are used later, when the commands are actually evaluated (in program order).
+
+    This is created by `passes.schedule_prefetch`, never by the parser."""
+
+    commands: list[str]
+
+    def delegated_commands(self) -> Iterator[tuple[Node, str]]:
+        # These belong to the nodes that actually use them
+        return iter(())
+
+    def translate(self, settings: translate.Settings) -> str:
+        return "\n".join(
+            ["ctx.prefetch((", *(f"    {cmd!r}," for cmd in self.commands), "))"]
+        )
+
+    def _to_python(self, settings: translate.Settings) -> list[pyast.stmt]:
+        return [pyast.Expr(_ctx_call("prefetch", pyast.Constant(tuple(self.commands))))]
 
-@dataclass
+
+@_node
 class ConditionalStmt(Statement):
     condition: Expression
     then: list[Statement]
 
+    def children(self) -> Iterable[Node]:
+        return (self.condition, *self.then)
+
     def translate(self, settings: translate.Settings) -> str:
         return "\n".join(
             [
                 f"if {self.condition.translate(settings)}:",
-                *((" " * 4) + stmt.translate(settings) for stmt in self.then),
+                # NOTE: stmt.translate() might itself be multiline
+                *(
+                    (" " * 4) + line
+                    for stmt in self.then
+                    for line in stmt.translate(settings).splitlines()
+                ),
             ]
         )
 
+    def _to_python(self, settings: translate.Settings) -> list[pyast.stmt]:
+        body = [res for stmt in self.then for res in stmt.to_python(settings)]
+        return [pyast.If(self.condition.to_python(settings), body or [pyast.Pass()], [])]
+
 
-@dataclass
+@_node
 class FunctionDeclaration(Statement):
     name: str
     body: list[Statement]
 
+    def children(self) -> Iterable[Node]:
+        return self.body
+
     def translate(self, settings: translate.Settings) -> str:
         # This is the most complex of them all
         # This translates into a python function that accepts variable positional arguments
@@ -196,6 +698,35 @@ class FunctionDeclaration(Statement):
         ]
         return "\n".join([*header, *((indent * 2) + b for b in body)])
 
+    def _to_python(self, settings: translate.Settings) -> list[pyast.stmt]:
+        body = [res for stmt in self.body for res in stmt.to_python(settings)]
+        frame = pyast.With(
+            [
+                pyast.withitem(
+                    pyast.Call(
+                        pyast.Attribute(
+                            pyast.Name("parent_ctx", pyast.Load()),
+                            "begin_function",
+                            pyast.Load(),
+                        ),
+                        [pyast.Constant(self.name), pyast.Name("args", pyast.Load())],
+                        [],
+                    ),
+                    pyast.Name("ctx", pyast.Store()),
+                )
+            ],
+            body or [pyast.Pass()],
+        )
+        signature = pyast.arguments(
+            posonlyargs=[],
+            args=[],
+            vararg=pyast.arg("args"),
+            kwonlyargs=[pyast.arg("parent_ctx")],
+            kw_defaults=[None],
+            defaults=[],
+        )
+        return [pyast.FunctionDef(self.name, signature, [frame], [])]
+
 
 class FunctionInvocationKind(Enum):
     EXTRA_BUILTIN = "extra"
@@ -206,12 +737,15 @@ class FunctionInvocationKind(Enum):
 _STANDARD_BUILTIN_MAP = {"echo": "print"}
 
 
-@dataclass
+@_node
 class FunctionInvocation(Statement):
     name: str
     args: list[Expression]
     kind: FunctionInvocationKind
 
+    def children(self) -> Iterable[Node]:
+        return self.args
+
     def translate(self, settings: translate.Settings) -> str:
         def format_call(name, args, **kwargs):
             if len(args) <= 1:
@@ -231,17 +765,36 @@ class FunctionInvocation(Statement):
 
         args = []
         kwargs = {}
-        if self.kind == FunctionInvocationKind.EXTRA_BUILTIN:
-            actual_name = self.name
-        elif self.kind == FunctionInvocationKind.STANDARD_BUILTIN:
+        actual_name = self.python_name()
+        if self.kind == FunctionInvocationKind.USER_DEFINED_FUNCTION:
+            kwargs["parent_ctx"] = "ctx"
+        args.extend((arg.translate(settings) for arg in self.args))
+        return format_call(actual_name, args, **kwargs)
+
+    def _to_python(self, settings: translate.Settings) -> list[pyast.stmt]:
+        keywords = []
+        if self.kind == FunctionInvocationKind.USER_DEFINED_FUNCTION:
+            keywords.append(pyast.keyword("parent_ctx", pyast.Name("ctx", pyast.Load())))
+        call = pyast.Call(
+            pyast.Name(self.python_name(), pyast.Load()),
+            [arg.to_python(settings) for arg in self.args],
+            keywords,
+        )
+        return [pyast.Expr(call)]
+
+    def python_name(self) -> str:
+        """The name of the python function that is called"""
+        if self.kind == FunctionInvocationKind.STANDARD_BUILTIN:
             try:
-                actual_name = _STANDARD_BUILTIN_MAP[self.name]
+                return _STANDARD_BUILTIN_MAP[self.name]
             except KeyError:
+                from .runtime import ZshError
+
                 raise ZshError(f"Not yet implemented: Builtin {self.name}") from None
-        elif self.kind == FunctionInvocationKind.USER_DEFINED_FUNCTION:
-            actual_name = self.name
-            kwargs["parent_ctx"] = "ctx"
+        elif self.kind in (
+            FunctionInvocationKind.EXTRA_BUILTIN,
+            FunctionInvocationKind.USER_DEFINED_FUNCTION,
+        ):
+            return self.name
         else:
             raise AssertionError
-        args.extend((arg.translate(settings) for arg in self.args))
-        return format_call(actual_name, args, **kwargs)
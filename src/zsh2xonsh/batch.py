@@ -0,0 +1,241 @@
+"""Translate many files at once (used by `zsh2xonsh batch`)
+
+Inputs are translated across a process pool, and each output is written atomically.
+
+Like `make`, inputs are skipped if their output is already up to date.
+That is, if the output is newer than the input,
+and the hash recorded in the output's header matches the input.
+The hash covers the source, the settings, the extra builtins and the version of zsh2xonsh.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from . import iter_translate
+from .parser import TranslationError
+from .translate import Settings
+
+HEADER_PREFIX = "# zsh2xonsh: input-hash="
+_HEADER_PATTERN = re.compile(re.escape(HEADER_PREFIX) + r"([0-9a-f]{64})\n")
+DEFAULT_PATTERNS = ("*.zsh",)
+DEFAULT_SUFFIX = ".xsh"
+
+
+class BatchJob(NamedTuple):
+    input: Path
+    output: Path
+
+
+class BatchStatus(Enum):
+    TRANSLATED = "translated"
+    UP_TO_DATE = "up-to-date"
+    FAILED = "failed"
+
+
+class BatchResult(NamedTuple):
+    job: BatchJob
+    status: BatchStatus
+    # The error message (if failed)
+    error: Optional[str] = None
+    # The location of the error within the input (line & offset), if known
+    location: Optional[tuple[int, int]] = None
+
+    def describe_failure(self) -> str:
+        assert self.status == BatchStatus.FAILED
+        if self.location is not None:
+            line, offset = self.location
+            return f"{self.job.input}:{line}:{offset + 1}: {self.error}"
+        else:
+            return f"{self.job.input}: {self.error}"
+
+
+def find_jobs(
+    inputs: Iterable[Path],
+    *,
+    output_dir: Optional[Path] = None,
+    patterns: Iterable[str] = DEFAULT_PATTERNS,
+    suffix: str = DEFAULT_SUFFIX,
+) -> list[BatchJob]:
+    """Find all the input files (searching directories recursively)
+
+    If `output_dir` is None, each output is written next to its input.
+    Otherwise, the outputs mirror the directory structure of the inputs inside `output_dir`."""
+    patterns = tuple(patterns)
+    jobs = []
+    for root in inputs:
+        root = Path(root)
+        if root.is_dir():
+            found = sorted(
+                {path for pattern in patterns for path in root.rglob(pattern)}
+            )
+            for path in found:
+                if path.is_file():
+                    jobs.append(_job(path, path.relative_to(root), output_dir, suffix))
+        else:
+            jobs.append(_job(root, Path(root.name), output_dir, suffix))
+    return jobs
+
+
+def _job(path: Path, relative: Path, output_dir: Optional[Path], suffix: str):
+    if output_dir is None:
+        output = path.with_suffix(suffix)
+    else:
+        output = (output_dir / relative).with_suffix(suffix)
+    if output == path:
+        raise ValueError(f"The output for {path} would overwrite the input")
+    return BatchJob(path, output)
+
+
+def input_hash(source: str, *, settings: Settings, extra_builtins: Iterable[str]) -> str:
+    """The hash of everything that affects the translated output"""
+    from . import __version__
+
+    h = hashlib.sha256()
+    for part in (
+        __version__,
+        settings.fingerprint(),
+        repr(sorted(extra_builtins)),
+        source,
+    ):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def recorded_hash(output: Path) -> Optional[str]:
+    """The input hash recorded in the header of an existing output (if any)"""
+    try:
+        with open(output, "rt", encoding="utf-8") as f:
+            header = f.readline()
+    except (OSError, UnicodeDecodeError):
+        return None
+    m = _HEADER_PATTERN.fullmatch(header)
+    return m.group(1) if m is not None else None
+
+
+def is_up_to_date(job: BatchJob, expected_hash: str) -> bool:
+    try:
+        if job.output.stat().st_mtime < job.input.stat().st_mtime:
+            return False
+    except OSError:
+        return False
+    return recorded_hash(job.output) == expected_hash
+
+
+def format_program(
+    translated: Iterable[str],
+    *,
+    assume_runtime=False,
+    assume_context=False,
+    target: str = "xonsh",
+) -> Iterator[str]:
+    """Wrap the translated statements into a complete xonsh program, yielding each line
+
+    For the "python" target, this also defines `XSH` (which plain python doesn't have).
+    Without any statements, the body of the context is just `pass`."""
+    indent = ""
+    if not assume_runtime:
+        yield "from zsh2xonsh import runtime"
+    if target == "python":
+        yield "XSH = runtime.xonshi.session()"
+    if not assume_context:
+        yield "with runtime.init_context() as ctx:"
+        indent = " " * 4
+    empty = True
+    for stmt in translated:
+        for line in stmt.splitlines():
+            empty = False
+            yield indent + line
+    if empty and not assume_context:
+        yield indent + "pass"
+
+
+def write_atomically(path: Path, text: str):
+    """Write the file, so that readers see either the old or the new contents (never a partial write)"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wt", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def translate_job(
+    job: BatchJob,
+    *,
+    settings: Settings,
+    extra_builtins: frozenset[str] = frozenset(),
+    force: bool = False,
+) -> BatchResult:
+    """Translate a single file (if it's not already up to date)
+
+    Errors are returned as a failed result (instead of being raised),
+    since exceptions don't always survive the trip back from a worker process."""
+    try:
+        source = job.input.read_text(encoding="utf-8")
+        expected_hash = input_hash(
+            source, settings=settings, extra_builtins=extra_builtins
+        )
+        if not force and is_up_to_date(job, expected_hash):
+            return BatchResult(job, BatchStatus.UP_TO_DATE)
+        lines = [HEADER_PREFIX + expected_hash]
+        lines.extend(
+            format_program(
+                iter_translate(source, settings=settings, extra_builtins=extra_builtins)
+            )
+        )
+        write_atomically(job.output, "\n".join(lines) + "\n")
+    except TranslationError as e:
+        location = (
+            (e.location.line, e.location.offset) if e.location is not None else None
+        )
+        return BatchResult(job, BatchStatus.FAILED, str(e), location)
+    except (OSError, UnicodeDecodeError, RuntimeError, ValueError) as e:
+        return BatchResult(job, BatchStatus.FAILED, f"{type(e).__name__}: {e}")
+    return BatchResult(job, BatchStatus.TRANSLATED)
+
+
+def run_batch(
+    jobs: list[BatchJob],
+    *,
+    settings: Settings,
+    extra_builtins: frozenset[str] = frozenset(),
+    force: bool = False,
+    max_workers: Optional[int] = None,
+) -> Iterator[BatchResult]:
+    """Translate all the jobs, yielding the results in order
+
+    Uses a process pool unless `max_workers` is 1 (or there is only one job)."""
+    kwargs = dict(settings=settings, extra_builtins=extra_builtins, force=force)
+    if max_workers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield translate_job(job, **kwargs)
+        return
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(translate_job, job, **kwargs) for job in jobs]
+        for future in futures:
+            yield future.result()
+
+
+__all__ = [
+    "BatchJob",
+    "BatchResult",
+    "BatchStatus",
+    "find_jobs",
+    "translate_job",
+    "run_batch",
+    "format_program",
+]
@@ -0,0 +1,160 @@
+"""An on-disk cache of translated (and compiled) code
+
+This is used by `translate_to_xonsh_and_eval`,
+so that a warm start can skip both our parser and xonsh's parser.
+
+Entries are content-addressed, keyed on everything that affects the output:
+the zsh source, the translation settings, the extra builtins,
+and the versions of zsh2xonsh, xonsh and python.
+
+Each entry stores the translated code, along with its compiled code object (using `marshal`, like a .pyc file).
+Writes are atomic, and the total size of the cache is bounded (evicting the least recently used entries).
+"""
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import marshal
+import os
+import tempfile
+from pathlib import Path
+from types import CodeType
+from typing import Iterable, NamedTuple, Optional
+
+_MAGIC = b"Z2XC\x01"
+_SUFFIX = ".z2xc"
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+
+class CachedTranslation(NamedTuple):
+    translated: str
+    code: CodeType
+
+
+def default_cache_dir() -> Path:
+    """The default cache directory, respecting $XDG_CACHE_HOME"""
+    base = os.environ.get("XDG_CACHE_HOME")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return Path(base, "zsh2xonsh")
+
+
+class TranslationCache:
+    """A directory of cached translations
+
+    All errors reading or writing the cache are ignored (treated as a cache miss).
+    """
+
+    __slots__ = ("directory", "max_bytes")
+    directory: Path
+    max_bytes: int
+
+    def __init__(
+        self, directory: Optional[Path] = None, *, max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        self.directory = Path(directory) if directory is not None else default_cache_dir()
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(
+        zsh: str,
+        *,
+        settings,
+        extra_builtins: Iterable[str],
+        extra: Iterable[str] = (),
+    ) -> str:
+        """Compute the cache key for the specified translation
+
+        The `extra` strings are any other inputs that affect the output (like the xonsh version)."""
+        from . import __version__
+
+        h = hashlib.sha256()
+        for part in (
+            __version__,
+            importlib.util.MAGIC_NUMBER.hex(),
+            settings.fingerprint(),
+            repr(sorted(extra_builtins)),
+            *extra,
+            zsh,
+        ):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / (key + _SUFFIX)
+
+    def load(self, key: str) -> Optional[CachedTranslation]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            if not data.startswith(_MAGIC):
+                raise ValueError("Bad magic")
+            translated, code = marshal.loads(data[len(_MAGIC) :])
+            if not isinstance(translated, str) or not isinstance(code, CodeType):
+                raise TypeError("Unexpected types in cache entry")
+        except (ValueError, TypeError, EOFError):
+            # Corrupt entry, remove it
+            self._remove(path)
+            return None
+        try:
+            # Mark as recently used (for eviction)
+            os.utime(path)
+        except OSError:
+            pass
+        return CachedTranslation(translated, code)
+
+    def store(self, key: str, translated: str, code: CodeType):
+        data = _MAGIC + marshal.dumps((translated, code))
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, self._path(key))
+            except BaseException:
+                self._remove(Path(tmp))
+                raise
+        except OSError:
+            return
+        self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache fits within `max_bytes`"""
+        entries = []
+        total = 0
+        try:
+            for path in self.directory.glob("*" + _SUFFIX):
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        except OSError:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path: Path):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    def clear(self):
+        for path in self.directory.glob("*" + _SUFFIX):
+            self._remove(path)
+
+
+__all__ = ["TranslationCache", "CachedTranslation", "default_cache_dir"]
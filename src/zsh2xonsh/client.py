@@ -0,0 +1,193 @@
+"""A thin client for the translation daemon (see `zsh2xonsh.server`)
+
+If the daemon isn't running, requests are handled in-process instead
+(which gives the same results, just without the warm startup).
+
+This can also be run directly, which avoids importing click:
+
+    python -m zsh2xonsh.client [--validate] [-b BUILTIN] [FILE]
+"""
+from __future__ import annotations
+
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+from typing import Iterable, Optional
+
+from .ast import Location
+from .parser import TranslationError
+
+
+def default_socket_path() -> str:
+    """The socket used by the daemon (unless `ZSH2XONSH_SOCKET` says otherwise)"""
+    try:
+        return os.environ["ZSH2XONSH_SOCKET"]
+    except KeyError:
+        pass
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "zsh2xonsh.sock")
+    return os.path.join(tempfile.gettempdir(), f"zsh2xonsh-{os.getuid()}.sock")
+
+
+def _check_socket(socket_path: str):
+    """Check the socket belongs to the current user (before trusting its output)
+
+    Otherwise another user could bind a predictable path (in /tmp) first.
+    Raises `FileNotFoundError` if it doesn't exist, and `PermissionError` if it isn't trusted."""
+    st = os.lstat(socket_path)
+    if not stat.S_ISSOCK(st.st_mode):
+        raise PermissionError(f"Not a socket: {socket_path}")
+    if st.st_uid != os.getuid():
+        raise PermissionError(f"Socket owned by another user: {socket_path}")
+
+
+class RemoteTranslationError(TranslationError):
+    """A `TranslationError` reported by the daemon"""
+
+    def __init__(self, kind: str, msg: str, location: Optional[Location]):
+        super().__init__(msg, location)
+        self._kind = kind
+
+    @property
+    def kind(self) -> str:
+        return self._kind
+
+
+def request(
+    req: dict, *, socket_path: Optional[str] = None, fallback: bool = True
+) -> dict:
+    """Send a request to the daemon, returning the response
+
+    If the daemon isn't running (and `fallback` is set), the request is handled in-process.
+    Raises a `PermissionError` if the socket belongs to another user."""
+    if socket_path is None:
+        socket_path = default_socket_path()
+    try:
+        _check_socket(socket_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_path)
+        except BaseException:
+            sock.close()
+            raise
+    except (FileNotFoundError, ConnectionRefusedError):
+        if not fallback:
+            raise
+        from .server import handle_request
+
+        return handle_request(req)
+    with sock, sock.makefile("rwb") as f:
+        f.write(json.dumps(req).encode("utf-8") + b"\n")
+        f.flush()
+        line = f.readline()
+    if not line:
+        raise ConnectionError("The daemon closed the connection without responding")
+    return json.loads(line)
+
+
+def _check(response: dict) -> str:
+    if response["ok"]:
+        return response["output"]
+    error = response["error"]
+    location = (
+        Location(error["line"], error["offset"]) if "line" in error else None
+    )
+    raise RemoteTranslationError(error["kind"], error["message"], location)
+
+
+def translate(
+    source: str,
+    *,
+    extra_builtins: Iterable[str] = (),
+    check_syntax: bool = False,
+    socket_path: Optional[str] = None,
+) -> str:
+    """Translate the zsh code with the daemon, just like `zsh2xonsh.translate_to_xonsh`"""
+    return _check(
+        request(
+            {
+                "op": "translate",
+                "source": source,
+                "extra_builtins": sorted(extra_builtins),
+                "check_syntax": check_syntax,
+            },
+            socket_path=socket_path,
+        )
+    )
+
+
+def validate(
+    source: str,
+    *,
+    extra_builtins: Iterable[str] = (),
+    check_syntax: bool = False,
+    socket_path: Optional[str] = None,
+):
+    """Check the zsh code can be translated (raising a `TranslationError` if not)"""
+    _check(
+        request(
+            {
+                "op": "validate",
+                "source": source,
+                "extra_builtins": sorted(extra_builtins),
+                "check_syntax": check_syntax,
+            },
+            socket_path=socket_path,
+        )
+    )
+
+
+def main(argv: Optional[list[str]] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="python -m zsh2xonsh.client",
+        description="Translates zsh to xonsh, using the daemon if it's running",
+    )
+    parser.add_argument("input_file", nargs="?", help="Defaults to stdin")
+    parser.add_argument("--validate", action="store_true")
+    parser.add_argument(
+        "-b", "--builtin", dest="extra_builtins", action="append", default=[]
+    )
+    parser.add_argument("--check-syntax", action="store_true")
+    parser.add_argument("--socket", dest="socket_path")
+    args = parser.parse_args(argv)
+    if args.input_file is not None:
+        with open(args.input_file, "rt") as f:
+            source = f.read()
+    else:
+        source = sys.stdin.read()
+    kwargs = dict(
+        extra_builtins=args.extra_builtins,
+        check_syntax=args.check_syntax,
+        socket_path=args.socket_path,
+    )
+    try:
+        if args.validate:
+            validate(source, **kwargs)
+            return
+        output = translate(source, **kwargs)
+    except TranslationError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if output:
+        from .batch import format_program
+
+        for line in format_program([output]):
+            print(line)
+
+
+__all__ = [
+    "RemoteTranslationError",
+    "default_socket_path",
+    "request",
+    "translate",
+    "validate",
+]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""A pure-python implementation of a subset of zsh's `[[ ... ]]` conditional expressions
+
+The supported subset is:
+1. The file tests `-d -f -e -x -r -L` and the string tests `-n -z`
+2. String comparisons `==`, `=` and `!=`, where the right-hand side is a literal (not a pattern)
+3. Combining with `&&`, `||`, `!` and parentheses
+
+Operands may be quoted strings (in the subset supported by `zsh2xonsh.params`),
+single-quoted strings, simple unquoted words, or unquoted `$VAR`/`${VAR}`.
+
+Anything else raises an `UnsupportedCondition`, and the caller is expected to fallback to zsh.
+
+Like `zsh2xonsh.params`, this is used by both the translator and the runtime.
+"""
+from __future__ import annotations
+
+import functools
+import os
+import re
+import stat
+from typing import Callable, NamedTuple, Optional, Union
+
+from . import params
+from .params import UnsupportedExpansion
+
+
+class UnsupportedCondition(UnsupportedExpansion):
+    """Indicates the condition is outside the supported subset (so it must be run by zsh)"""
+
+
+# An operand is a sequence of parts, just like an expanded string
+Operand = tuple[params.Part, ...]
+
+
+class Unary(NamedTuple):
+    op: str
+    operand: Operand
+
+
+class Compare(NamedTuple):
+    negated: bool
+    lhs: Operand
+    rhs: Operand
+
+
+class Not(NamedTuple):
+    inner: Condition
+
+
+class And(NamedTuple):
+    lhs: Condition
+    rhs: Condition
+
+
+class Or(NamedTuple):
+    lhs: Condition
+    rhs: Condition
+
+
+Condition = Union[Unary, Compare, Not, And, Or]
+
+FILE_TESTS = frozenset({"-d", "-f", "-e", "-x", "-r", "-L"})
+STRING_TESTS = frozenset({"-n", "-z"})
+
+# NOTE: These are compiled on first use (by `re`'s cache), since compiling takes longer than importing everything else
+_TOKEN_PATTERN = (
+    r"""
+    (?P<space>\s+)
+    |(?P<op>(?:&&|\|\||!=|==|=|!|\(|\))(?=[\s()]|$))
+    |(?P<word>(?:
+        "(?:[^"\\]|\\.)*"
+        |'[^']*'
+        |\$\{[A-Za-z_][A-Za-z0-9_]*\}
+        |\$\{[0-9]+\}
+        |\$[A-Za-z_][A-Za-z0-9_]*
+        |\$[1-9](?![0-9])
+        |[A-Za-z0-9_/.\-@%+,:]+
+    )+)
+    """
+)
+_WORD_PIECE_PATTERN = (
+    r"""
+    (?P<dquote>"(?:[^"\\]|\\.)*")
+    |(?P<squote>'[^']*')
+    |(?P<param>\$\{?[A-Za-z0-9_]+\}?)
+    |(?P<literal>[A-Za-z0-9_/.\-@%+,:]+)
+    """
+)
+
+
+class _Word(NamedTuple):
+    raw: str
+    # True if it contains no quotes or parameters (so it can be an operator)
+    bare: bool
+    # True if any part is an unquoted parameter
+    unquoted_param: bool
+    operand: Operand
+
+
+def _parse_word(raw: str) -> _Word:
+    parts = []
+    unquoted_param = False
+    for m in re.finditer(_WORD_PIECE_PATTERN, raw, re.VERBOSE):
+        kind = m.lastgroup
+        text = m.group()
+        if kind == "dquote":
+            parts.extend(params.parse_quoted(text[1:-1]))
+        elif kind == "squote":
+            parts.append(text[1:-1])
+        elif kind == "param":
+            if not text.endswith("}") and raw.startswith(":", m.end()):
+                raise UnsupportedCondition(f"Possible modifier after {text}")
+            # NOTE: Inside [[ ... ]], there is no word splitting or globbing of parameters
+            parts.extend(params.parse_quoted(text))
+            unquoted_param = True
+        else:
+            parts.append(text)
+    bare = all(
+        m.lastgroup == "literal"
+        for m in re.finditer(_WORD_PIECE_PATTERN, raw, re.VERBOSE)
+    )
+    if bare and raw[:1] in ("=", "~"):
+        raise UnsupportedCondition(f"Unsupported expansion in {raw!r}")
+    return _Word(raw, bare, unquoted_param, tuple(parts))
+
+
+def _tokenize(text: str) -> list[Union[str, _Word]]:
+    token_pattern = re.compile(_TOKEN_PATTERN, re.VERBOSE)
+    tokens = []
+    idx = 0
+    while idx < len(text):
+        m = token_pattern.match(text, idx)
+        if m is None:
+            raise UnsupportedCondition(f"Unsupported syntax at {text[idx:]!r}")
+        idx = m.end()
+        if m.lastgroup == "op":
+            tokens.append(m.group())
+        elif m.lastgroup == "word":
+            tokens.append(_parse_word(m.group()))
+    return tokens
+
+
+class _Parser:
+    __slots__ = ("tokens", "idx")
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.idx = 0
+
+    def peek(self):
+        try:
+            return self.tokens[self.idx]
+        except IndexError:
+            return None
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            raise UnsupportedCondition("Unexpected end of condition")
+        self.idx += 1
+        return token
+
+    def operand(self) -> _Word:
+        token = self.take()
+        if not isinstance(token, _Word):
+            raise UnsupportedCondition(f"Expected an operand, but got {token!r}")
+        elif token.bare and token.raw.startswith("-"):
+            raise UnsupportedCondition(f"Unsupported operator {token.raw!r}")
+        return token
+
+    def or_expr(self) -> Condition:
+        res = self.and_expr()
+        while self.peek() == "||":
+            self.take()
+            res = Or(res, self.and_expr())
+        return res
+
+    def and_expr(self) -> Condition:
+        res = self.not_expr()
+        while self.peek() == "&&":
+            self.take()
+            res = And(res, self.not_expr())
+        return res
+
+    def not_expr(self) -> Condition:
+        if self.peek() == "!":
+            self.take()
+            return Not(self.not_expr())
+        return self.primary()
+
+    def primary(self) -> Condition:
+        token = self.peek()
+        if token == "(":
+            self.take()
+            res = self.or_expr()
+            if self.take() != ")":
+                raise UnsupportedCondition("Expected a closing `)`")
+            return res
+        elif isinstance(token, _Word) and token.bare and token.raw.startswith("-"):
+            self.take()
+            if token.raw not in FILE_TESTS and token.raw not in STRING_TESTS:
+                raise UnsupportedCondition(f"Unsupported operator {token.raw!r}")
+            return Unary(token.raw, self.operand().operand)
+        lhs = self.operand()
+        if self.peek() in ("==", "=", "!="):
+            op = self.take()
+            rhs = self.operand()
+            if rhs.unquoted_param:
+                # This would be interpreted as a pattern
+                raise UnsupportedCondition(f"Non-literal pattern {rhs.raw!r}")
+            return Compare(op == "!=", lhs.operand, rhs.operand)
+        else:
+            # A single word is the same as `-n`
+            return Unary("-n", lhs.operand)
+
+
+@functools.lru_cache(maxsize=512)
+def parse_test(text: str) -> Condition:
+    """Parse the text of a test command like `[[ -d "$foo" ]]`
+
+    Raises UnsupportedCondition (or UnsupportedExpansion) if it's outside the supported subset."""
+    text = text.strip()
+    if not text.startswith("[[") or not text.endswith("]]"):
+        raise UnsupportedCondition("Not a [[ ... ]] test")
+    parser = _Parser(_tokenize(text[2:-2]))
+    res = parser.or_expr()
+    if parser.peek() is not None:
+        raise UnsupportedCondition(f"Unexpected {parser.peek()!r}")
+    return res
+
+
+def is_supported(text: str) -> bool:
+    try:
+        parse_test(text)
+    except UnsupportedExpansion:
+        return False
+    else:
+        return True
+
+
+def referenced_names(cond: Condition) -> set[str]:
+    """All the parameters referenced by the specified condition"""
+    if isinstance(cond, Unary):
+        return params.referenced_names(cond.operand)
+    elif isinstance(cond, Compare):
+        return params.referenced_names(cond.lhs) | params.referenced_names(cond.rhs)
+    elif isinstance(cond, Not):
+        return referenced_names(cond.inner)
+    else:
+        return referenced_names(cond.lhs) | referenced_names(cond.rhs)
+
+
+def map_operands(cond: Condition, func: Callable[[Operand], Operand]) -> Condition:
+    """Replace every operand of the condition with `func(operand)`"""
+    if isinstance(cond, Unary):
+        return Unary(cond.op, func(cond.operand))
+    elif isinstance(cond, Compare):
+        return Compare(cond.negated, func(cond.lhs), func(cond.rhs))
+    elif isinstance(cond, Not):
+        return Not(map_operands(cond.inner, func))
+    else:
+        return type(cond)(map_operands(cond.lhs, func), map_operands(cond.rhs, func))
+
+
+def to_text(cond: Condition) -> str:
+    """The text of a test command for the condition (the inverse of `parse_test`)
+
+    Every operand is double-quoted, so the right side of a comparison is never a pattern.
+    Raises UnsupportedExpansion if an operand can't be quoted (see `params.quote`)."""
+
+    def text(cond: Condition, *, nested: bool) -> str:
+        if isinstance(cond, Unary):
+            return f'{cond.op} "{params.quote(cond.operand)}"'
+        elif isinstance(cond, Compare):
+            op = "!=" if cond.negated else "=="
+            return f'"{params.quote(cond.lhs)}" {op} "{params.quote(cond.rhs)}"'
+        elif isinstance(cond, Not):
+            return "! " + text(cond.inner, nested=True)
+        op = "&&" if isinstance(cond, And) else "||"
+        res = f"{text(cond.lhs, nested=True)} {op} {text(cond.rhs, nested=True)}"
+        return f"( {res} )" if nested else res
+
+    return f"[[ {text(cond, nested=False)} ]]"
+
+
+class StatCache:
+    """Caches the results of `stat`, `lstat` and `access` calls
+
+    This must be cleared whenever something could have modified the filesystem
+    (like running zsh or an extra builtin)."""
+
+    __slots__ = ("_results",)
+
+    def __init__(self):
+        self._results = {}
+
+    def _cached(self, key, func):
+        if not key[1].startswith("/"):
+            # Relative paths depend on the working directory
+            key = (*key, os.getcwd())
+        try:
+            return self._results[key]
+        except KeyError:
+            pass
+        try:
+            res = func()
+        except (OSError, ValueError):
+            res = None
+        self._results[key] = res
+        return res
+
+    def stat(self, path: str) -> Optional[os.stat_result]:
+        return self._cached(("stat", path), lambda: os.stat(path))
+
+    def lstat(self, path: str) -> Optional[os.stat_result]:
+        return self._cached(("lstat", path), lambda: os.lstat(path))
+
+    def access(self, path: str, mode: int) -> bool:
+        return bool(self._cached(("access", path, mode), lambda: os.access(path, mode)))
+
+    def clear(self):
+        self._results.clear()
+
+
+def _file_test(op: str, path: str, stats: StatCache) -> bool:
+    if path.startswith("/dev/fd/"):
+        # zsh checks the file descriptor instead
+        raise UnsupportedCondition(f"Special file {path!r}")
+    elif op == "-L":
+        st = stats.lstat(path)
+        return st is not None and stat.S_ISLNK(st.st_mode)
+    st = stats.stat(path)
+    if st is None:
+        return False
+    elif op == "-e":
+        return True
+    elif op == "-d":
+        return stat.S_ISDIR(st.st_mode)
+    elif op == "-f":
+        return stat.S_ISREG(st.st_mode)
+    elif op == "-r":
+        return stats.access(path, os.R_OK)
+    elif op == "-x":
+        return stats.access(path, os.X_OK)
+    else:
+        raise AssertionError(op)
+
+
+def evaluate(
+    cond: Condition, lookup: Callable[[str], Optional[str]], stats: StatCache
+) -> bool:
+    """Evaluate the parsed condition
+
+    The `lookup` function has the same meaning as in `params.expand`."""
+    if isinstance(cond, Unary):
+        value = params.expand(cond.operand, lookup)
+        if cond.op == "-n":
+            return bool(value)
+        elif cond.op == "-z":
+            return not value
+        else:
+            return _file_test(cond.op, value, stats)
+    elif isinstance(cond, Compare):
+        equal = params.expand(cond.lhs, lookup) == params.expand(cond.rhs, lookup)
+        return equal != cond.negated
+    elif isinstance(cond, Not):
+        return not evaluate(cond.inner, lookup, stats)
+    elif isinstance(cond, And):
+        return evaluate(cond.lhs, lookup, stats) and evaluate(cond.rhs, lookup, stats)
+    elif isinstance(cond, Or):
+        return evaluate(cond.lhs, lookup, stats) or evaluate(cond.rhs, lookup, stats)
+    else:
+        raise AssertionError(cond)
+
+
+__all__ = [
+    "UnsupportedCondition",
+    "StatCache",
+    "parse_test",
+    "is_supported",
+    "referenced_names",
+    "map_operands",
+    "to_text",
+    "evaluate",
+]
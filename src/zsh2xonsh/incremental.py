@@ -0,0 +1,206 @@
+"""Incremental re-translation, reusing the output of a previous translation
+
+The previous `TranslationArtifact` records the source text, span and output of each top-level statement.
+When the source is edited, only the statements touched by the edit are re-parsed (and re-translated).
+Parsing resumes at the first statement affected by the edit,
+and stops as soon as it reaches a statement in the unchanged tail,
+with the same set of defined functions as before (the only state that carries between statements).
+After that, the previous statements are reused (with their spans shifted).
+
+The optimization passes (batching, prefetching, constant propagation & inlining) only apply within each top-level statement,
+since their output must be attributable to a single statement.
+Use `zsh2xonsh.translate_to_xonsh` if that matters more than re-translation speed.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from .ast import Span, Statement
+from .translate import Settings
+
+
+@dataclass(frozen=True)
+class StatementRecord:
+    """The translation of a single top-level statement"""
+
+    # The source text of the statement (including any preceding blank lines & comments)
+    text: str
+    span: Span
+    output: str
+    # The offset of the start of `text` within the source
+    start: int
+    # The end of the text that was examined while parsing this statement
+    #
+    # This is past the end of `text`, since the parser looks at the following token
+    # (and the lexer looks at the character after that).
+    checked_end: int
+    # The functions that are defined after this statement
+    defined_functions: frozenset[str]
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.text)
+
+
+@dataclass(frozen=True)
+class TranslationArtifact:
+    """The result of a translation, which can be used to speed up the next one"""
+
+    source: str
+    statements: tuple[StatementRecord, ...]
+    # The settings & builtins that were used (anything else requires a full translation)
+    fingerprint: str
+
+    @property
+    def text(self) -> str:
+        """The translated xonsh code"""
+        return "\n".join(record.output for record in self.statements if record.output)
+
+
+def _fingerprint(settings: Settings, extra_builtins: frozenset[str]) -> str:
+    return repr((settings.fingerprint(), sorted(extra_builtins)))
+
+
+def _common_prefix(a: str, b: str) -> int:
+    lo, hi = 0, min(len(a), len(b))
+    # NOTE: Binary search, so all the comparisons happen in C
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix(a: str, b: str, limit: int) -> int:
+    lo, hi = 0, min(len(a), len(b), limit)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid :] == b[len(b) - mid :]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _functions_before(records, idx: int) -> frozenset[str]:
+    return records[idx - 1].defined_functions if idx > 0 else frozenset()
+
+
+def _translate_statements(stmts: list[Statement], settings: Settings) -> list[str]:
+    """Translate each statement separately, validating their syntax together (if enabled)"""
+    from . import _validate_syntax, passes
+
+    stmts = [passes.run_passes([stmt], settings) for stmt in stmts]
+    if settings.validate_syntax:
+        # NOTE: This raises errors for all the statements at once
+        _validate_syntax([node for group in stmts for node in group])
+    res = []
+    for group in stmts:
+        lines = []
+        if settings.validate_syntax:
+            commands = tuple(
+                dict.fromkeys(cmd for node in group for _, cmd in node.delegated_commands())
+            )
+            if commands:
+                lines.append(f"ctx.assume_valid_syntax({commands!r})")
+        lines.extend(node.translate(settings) for node in group)
+        res.append("\n".join(lines))
+    return res
+
+
+def translate(
+    zsh: str,
+    previous: Optional[TranslationArtifact] = None,
+    *,
+    settings: Optional[Settings] = None,
+    extra_builtins: Iterable[str] = frozenset(),
+) -> TranslationArtifact:
+    """Translate the zsh code, reusing the unchanged parts of a previous translation
+
+    Throws a `zsh2xonsh.parser.TranslationError` just like `translate_to_xonsh`."""
+    from .parser import ShellParser
+
+    if settings is None:
+        settings = Settings.default()
+    extra_builtins = frozenset(extra_builtins)
+    fingerprint = _fingerprint(settings, extra_builtins)
+    if previous is not None and previous.fingerprint != fingerprint:
+        previous = None
+    old_source = previous.source if previous is not None else ""
+    old_records = previous.statements if previous is not None else ()
+
+    prefix = _common_prefix(old_source, zsh)
+    suffix = _common_suffix(old_source, zsh, min(len(old_source), len(zsh)) - prefix)
+    if previous is not None and prefix == len(old_source) == len(zsh):
+        return previous
+    # Keep the statements that were parsed without looking at the edit
+    kept = 0
+    while kept < len(old_records) and old_records[kept].checked_end <= prefix:
+        kept += 1
+    records = list(old_records[:kept])
+    resume_at = records[-1].end if records else 0
+    defined_functions = records[-1].defined_functions if records else frozenset()
+
+    # Where the unchanged tail starts (in the new source)
+    new_tail = len(zsh) - suffix
+    delta = len(zsh) - len(old_source)
+    old_starts = {record.start: idx for idx, record in enumerate(old_records)}
+
+    parser = ShellParser(zsh, extra_builtins=extra_builtins)
+    parser.resume(resume_at, defined_functions)
+    parsed: list[tuple[int, int, int, Statement, frozenset[str]]] = []
+    reused: list[StatementRecord] = []
+    while True:
+        start = parser.offset
+        old_idx = old_starts.get(start - delta) if start >= new_tail else None
+        if (
+            old_idx is not None
+            and _functions_before(old_records, old_idx) == defined_functions
+            # The column of the statement must be unchanged too
+            and zsh.rfind("\n", 0, start) + 1 >= new_tail
+        ):
+            # The rest is the same as before (just shifted)
+            for record in old_records[old_idx:]:
+                reused.append(
+                    StatementRecord(
+                        text=record.text,
+                        span=record.span.shifted(delta, parser.line_table),
+                        output=record.output,
+                        start=record.start + delta,
+                        checked_end=record.checked_end + delta,
+                        defined_functions=record.defined_functions,
+                    )
+                )
+            break
+        stmt = parser.statement()
+        if stmt is None:
+            break
+        end = parser.offset
+        following = parser.peek()
+        # NOTE: The lexer also looked at the character after the token (or the end of the input)
+        checked_end = following.end + 1
+        if len(parser.defined_functions) != len(defined_functions):
+            # NOTE: Otherwise the (shared) set is unchanged, since functions are never undefined
+            defined_functions = parser.defined_functions
+        parsed.append((start, end, checked_end, stmt, defined_functions))
+
+    outputs = _translate_statements([stmt for _, _, _, stmt, _ in parsed], settings)
+    for (start, end, checked_end, stmt, functions), output in zip(parsed, outputs):
+        records.append(
+            StatementRecord(
+                text=zsh[start:end],
+                span=stmt.span,
+                output=output,
+                start=start,
+                checked_end=checked_end,
+                defined_functions=functions,
+            )
+        )
+    records.extend(reused)
+    return TranslationArtifact(zsh, tuple(records), fingerprint)
+
+
+__all__ = ["TranslationArtifact", "StatementRecord", "translate"]
@@ -0,0 +1,284 @@
+"""The tokenizer for `ShellParser`
+
+This works on a buffer of the source (instead of line by line),
+using a single compiled regex that combines every kind of token.
+Tokens carry their (absolute) offsets into the source,
+which are only converted into a line & column when a `Location` is needed.
+
+When the source is an iterable of lines (like a file), the buffer is filled lazily,
+and text before the current statement is dropped.
+
+The zsh grammar is context-sensitive (the inside of `$(...)` is kept as raw text),
+so the parser requests tokens lazily at a specific offset, instead of tokenizing everything upfront.
+The raw regions are skipped over by `Lexer.scan_balanced`, which is also regex-driven.
+
+Everything is linear in the size of the input.
+"""
+from __future__ import annotations
+
+import bisect
+import functools
+import re
+from enum import Enum
+from typing import Iterable, Iterator, NamedTuple, Optional, Union
+
+from . import translate
+from .ast import LineTable, Location
+
+
+class TokenKind(Enum):
+    NEWLINE = "newline"
+    WHITESPACE = "whitespace"
+    COMMENT = "comment"
+    # The start of a command substitution `$(`
+    SUBST_OPEN = "subst_open"
+    # A `$` that doesn't start a command substitution
+    DOLLAR = "dollar"
+    # The start of a test `[[`
+    TEST_OPEN = "test_open"
+    DOUBLE_QUOTED = "double_quoted"
+    SINGLE_QUOTED = "single_quoted"
+    # A quote that is never closed
+    UNTERMINATED = "unterminated"
+    # The `()` in a function declaration
+    EMPTY_PARENS = "empty_parens"
+    # A word that is a valid identifier
+    WORD = "word"
+    # A literal that is not a valid identifier (like `~/foo` or `1.2`)
+    LITERAL = "literal"
+    SEMICOLON = "semicolon"
+    EQUALS = "equals"
+    OPEN_BRACE = "open_brace"
+    CLOSE_BRACE = "close_brace"
+    OTHER = "other"
+    EOF = "eof"
+
+
+class Token(NamedTuple):
+    kind: TokenKind
+    start: int
+    end: int
+
+
+_TOKEN_PATTERN = re.compile(
+    "|".join(
+        f"(?P<{kind.name}>{pattern})"
+        for kind, pattern in (
+            (TokenKind.NEWLINE, r"\n"),
+            (TokenKind.WHITESPACE, r"[^\S\n]+"),
+            (TokenKind.COMMENT, r"\#[^\n]*"),
+            (TokenKind.SUBST_OPEN, r"\$\("),
+            (TokenKind.DOLLAR, r"\$"),
+            (TokenKind.TEST_OPEN, r"\[\["),
+            (TokenKind.DOUBLE_QUOTED, r'"(?:[^"\\]|\\.)*"'),
+            (TokenKind.SINGLE_QUOTED, r"'[^']*'"),
+            (TokenKind.UNTERMINATED, r"[\"']"),
+            (TokenKind.EMPTY_PARENS, r"\(\s*\)"),
+            # NOTE: We only allow literals that the translator considers safe
+            (TokenKind.LITERAL, translate.SAFE_LITERAL_PATTERN.pattern),
+            (TokenKind.SEMICOLON, r";"),
+            (TokenKind.EQUALS, r"="),
+            (TokenKind.OPEN_BRACE, r"\{"),
+            (TokenKind.CLOSE_BRACE, r"\}"),
+            (TokenKind.OTHER, r"."),
+        )
+    ),
+    re.DOTALL,
+)
+_WORD_PATTERN = re.compile(r"\w+")
+_NEWLINE_PATTERN = re.compile(r"\n")
+
+
+@functools.lru_cache(maxsize=None)
+def _balanced_pattern(opening: str, closing: str) -> re.Pattern:
+    # NOTE: Quoted strings and escapes are skipped (so they can contain unbalanced delimiters)
+    return re.compile(
+        rf"""(?P<open>{re.escape(opening)})|(?P<close>{re.escape(closing)})|"(?:[^"\\]|\\.)*"|'[^']*'|\\.|(?P<unterminated>["'\\])""",
+        re.DOTALL,
+    )
+
+
+def _strip_newline(line: str) -> str:
+    return line[:-1] if line.endswith("\n") else line
+
+
+class Lexer:
+    """Tokenizes zsh source code
+
+    The source is either a string (the whole buffer),
+    or an iterable of lines (like a file), which is read lazily.
+
+    All offsets are absolute (relative to the start of the source).
+    Text before the current statement can be dropped with `discard`,
+    so memory stays bounded when reading lines lazily."""
+
+    __slots__ = ("_text", "_base", "lines", "_lines", "_last")
+    # The buffered text (everything from `_base` onwards that has been read so far)
+    _text: str
+    # The absolute offset of the start of the buffer
+    _base: int
+    # The (absolute) offset where each line starts (shared with the spans of the parsed nodes)
+    #
+    # NOTE: This is kept after the text is discarded (it's just 8 bytes per line)
+    lines: LineTable
+    # The remaining lines, or None if there aren't any more
+    _lines: Optional[Iterator[str]]
+    # The most recently lexed token (since the parser usually peeks before taking)
+    _last: Optional[Token]
+
+    def __init__(self, source: Union[str, Iterable[str]]):
+        self._base = 0
+        self._last = None
+        if isinstance(source, str):
+            self._text = source
+            self.lines = LineTable(m.end() for m in _NEWLINE_PATTERN.finditer(source))
+            self._lines = None
+        else:
+            self.lines = LineTable()
+            self._lines = iter(source)
+            first = next(self._lines, None)
+            if first is None:
+                self._lines = None
+            self._text = _strip_newline(first or "")
+
+    def _load(self, count: int = 1) -> bool:
+        """Read up to `count` more lines into the buffer, returning False if there aren't any more
+
+        Callers that are waiting for the end of a multi-line region double the count each time,
+        so the buffer is copied (and rescanned) a logarithmic number of times."""
+        if self._lines is None:
+            return False
+        pieces = []
+        end = self._base + len(self._text)
+        for _ in range(count):
+            line = next(self._lines, None)
+            if line is None:
+                self._lines = None
+                break
+            line = _strip_newline(line)
+            # NOTE: Lines are joined with newlines, just like `"\n".join(lines)`
+            end += 1
+            self.lines.add_line(end)
+            pieces.append(line)
+            end += len(line)
+        if not pieces:
+            return False
+        self._text += "\n" + "\n".join(pieces)
+        return True
+
+    def _ensure(self, pos: int):
+        """Make sure the line containing `pos` (and its newline) is buffered"""
+        while self._lines is not None and pos >= self.lines.starts[-1]:
+            self._load()
+
+    def discard(self, pos: int):
+        """Drop buffered text before the line containing `pos`
+
+        Text before that line can no longer be used (but locations can)."""
+        lines = self.lines
+        consumed = lines.starts[lines.line_index(pos)] - self._base
+        # NOTE: Only copy the buffer once it's mostly consumed (to stay linear)
+        if consumed > 0 and consumed * 2 >= len(self._text):
+            self._text = self._text[consumed:]
+            self._base += consumed
+
+    def at_eof(self, pos: int) -> bool:
+        self._ensure(pos)
+        return pos - self._base >= len(self._text)
+
+    def token(self, pos: int) -> Token:
+        """The token starting at the specified offset"""
+        last = self._last
+        if last is not None and last.start == pos:
+            return last
+        self._ensure(pos)
+        count = 1
+        while True:
+            idx = pos - self._base
+            text = self._text
+            if idx >= len(text):
+                return Token(TokenKind.EOF, pos, pos)
+            m = _TOKEN_PATTERN.match(text, idx)
+            kind = TokenKind[m.lastgroup]
+            if (kind == TokenKind.UNTERMINATED or m.end() == len(text)) and self._load(
+                count
+            ):
+                # The token could continue onto the next line
+                count *= 2
+                continue
+            break
+        if kind == TokenKind.LITERAL and _WORD_PATTERN.fullmatch(m.group()):
+            kind = TokenKind.WORD
+        token = Token(kind, pos, pos + (m.end() - idx))
+        self._last = token
+        return token
+
+    def tokens(self, pos: int = 0) -> Iterator[Token]:
+        """All the tokens from the specified offset on (ignoring the context-sensitivity of `$(...)`)"""
+        while (token := self.token(pos)).kind != TokenKind.EOF:
+            yield token
+            pos = token.end
+
+    def token_text(self, token: Token) -> str:
+        return self.text_between(token.start, token.end)
+
+    def text_between(self, start: int, end: int) -> str:
+        assert start >= self._base, "Text was already discarded"
+        return self._text[start - self._base : end - self._base]
+
+    def startswith(self, prefix: str, pos: int) -> bool:
+        self._ensure(pos)
+        return self._text.startswith(prefix, pos - self._base)
+
+    def match_text(self, pattern: re.Pattern, pos: int, endpos: int) -> Optional[str]:
+        """Match the pattern at `pos` (stopping at `endpos`), returning the matched text"""
+        self._ensure(pos)
+        m = pattern.match(self._text, pos - self._base, endpos - self._base)
+        return m.group() if m is not None else None
+
+    def location(self, pos: int) -> Location:
+        """Convert an offset into a `Location` (with one-based lines and zero-based offsets)"""
+        return self.lines.location(pos)
+
+    def line_end(self, pos: int) -> int:
+        """The offset of the end of the line containing `pos` (excluding the newline)"""
+        self._ensure(pos)
+        line_starts = self.lines.starts
+        idx = bisect.bisect_right(line_starts, pos)
+        if idx < len(line_starts):
+            return line_starts[idx] - 1
+        else:
+            return self._base + len(self._text)
+
+    def scan_balanced(self, pos: int, opening: str, closing: str) -> int:
+        """Find the end of the balanced region starting at `pos` (with the opening delimiter)
+
+        Returns the offset just after the matching closing delimiter,
+        or -1 if there isn't one."""
+        assert self.startswith(opening, pos)
+        pattern = _balanced_pattern(opening, closing)
+        level = 0
+        count = 1
+        while True:
+            # NOTE: This resumes from where the previous scan stopped (to stay linear)
+            for m in pattern.finditer(self._text, pos - self._base):
+                kind = m.lastgroup
+                if kind == "unterminated" and self._lines is not None:
+                    # The quote (or escape) could continue onto the next line
+                    pos = self._base + m.start()
+                    break
+                elif kind == "open":
+                    level += 1
+                elif kind == "close":
+                    level -= 1
+                    if level == 0:
+                        return self._base + m.end()
+                pos = self._base + m.end()
+            else:
+                pos = self._base + len(self._text)
+            if not self._load(count):
+                return -1
+            count *= 2
+
+
+__all__ = ["Lexer", "Token", "TokenKind"]
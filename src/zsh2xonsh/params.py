@@ -0,0 +1,295 @@
+"""A pure-python implementation of a (tiny) subset of zsh parameter expansion
+
+This handles the contents of double-quoted strings like `"$HOME/bin"` or `"${PATH+:$PATH}"`,
+which are extremely common in environment files.
+
+The supported subset is:
+1. Plain parameters `$VAR` and `${VAR}` (including positional params `$1` and `${1}`)
+2. The conditional forms `${VAR:-word}`, `${VAR-word}`, `${VAR+word}` and `${VAR:+word}`
+   where the `word` is itself in the supported subset.
+3. Backslash escapes
+
+Within that subset, the semantics are exactly the same as zsh.
+Anything else (command substitution, subscripts, modifiers, flags, special parameters, ...)
+raises an `UnsupportedExpansion`, and the caller is expected to fallback to zsh.
+
+This module is used both by the translator (to decide if the native path can be used)
+and by the runtime (to actually do the expansion), so it must not have any dependencies.
+"""
+from __future__ import annotations
+
+import functools
+import re
+from typing import Callable, NamedTuple, Optional, Union
+
+
+class UnsupportedExpansion(ValueError):
+    """Indicates the expansion is outside the supported subset (so it must be done by zsh)"""
+
+
+class Param(NamedTuple):
+    name: str
+    # One of None, ':-', '-', '+', ':+'
+    op: Optional[str]
+    word: tuple[Part, ...]
+
+
+Part = Union[str, Param]
+
+# Special parameters whose values come from zsh itself (not the environment)
+_ZSH_SPECIAL_PARAMS = frozenset(
+    """
+    _ ARGC argv status pipestatus ERRNO HISTCMD LINENO PPID RANDOM SECONDS EPOCHSECONDS
+    EPOCHREALTIME SHLVL PWD OLDPWD UID EUID GID EGID USERNAME TTY TTYIDLE HOST OSTYPE
+    MACHTYPE CPUTYPE VENDOR IFS COLUMNS LINES PS1 PS2 PS3 PS4 PROMPT PROMPT2 PROMPT3
+    PROMPT4 RPS1 RPS2 RPROMPT RPROMPT2 HISTCHARS HISTSIZE SAVEHIST KEYTIMEOUT LISTMAX
+    MAILCHECK TMPPREFIX WORDCHARS TIMEFMT NULLCMD READNULLCMD FPATH MODULE_PATH
+    path fpath cdpath manpath mailpath module_path fignore psvar watch signals
+    options parameters functions aliases galiases saliases commands builtins
+    modules dirstack historywords jobdirs jobstates jobtexts nameddirs userdirs
+    funcstack funcfiletrace funcsourcetrace functrace reswords patchars widgets
+    keymaps sysparams termcap terminfo errnos histchars OPTIND OPTARG SPROMPT
+    """.split()
+)
+# Prefixes of parameters that zsh sets itself (like `$ZSH_VERSION` or `$zsh_eval_context`)
+_ZSH_SPECIAL_PREFIXES = ("ZSH_", "zsh_")
+# Parameters that zsh initializes itself if they are missing from the environment.
+#
+# These are only supported if they are set.
+ZSH_DEFAULTED_PARAMS = frozenset({"HOME", "LOGNAME", "PATH"})
+
+_NAME_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|[0-9]+")
+_OPERATORS = (":-", ":+", "-", "+")
+# Characters allowed after `$NAME:` that can't start a modifier (like `$NAME:h`)
+_SAFE_AFTER_COLON = frozenset({"/", "$", "."})
+_ESCAPABLE = frozenset({"$", "`", '"', "\\"})
+
+
+def _check_name(name: str):
+    if name in _ZSH_SPECIAL_PARAMS or name.startswith(_ZSH_SPECIAL_PREFIXES):
+        raise UnsupportedExpansion(f"Special parameter ${name}")
+    elif name == "0":
+        raise UnsupportedExpansion("The parameter $0")
+
+
+class _Parser:
+    __slots__ = ("text", "idx")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.idx = 0
+
+    def parts(self, *, in_word: bool) -> tuple[Part, ...]:
+        text = self.text
+        parts = []
+        literal = []
+        while self.idx < len(text):
+            c = text[self.idx]
+            if in_word and c == "}":
+                break
+            elif c == "\\":
+                if in_word:
+                    raise UnsupportedExpansion("Backslash inside ${...}")
+                try:
+                    escaped = text[self.idx + 1]
+                except IndexError:
+                    raise UnsupportedExpansion("Trailing backslash") from None
+                if escaped in _ESCAPABLE:
+                    literal.append(escaped)
+                elif escaped == "\n":
+                    raise UnsupportedExpansion("Line continuation")
+                else:
+                    literal.append("\\" + escaped)
+                self.idx += 2
+            elif c == "$":
+                if literal:
+                    parts.append("".join(literal))
+                    literal.clear()
+                parts.append(self.param())
+            elif c in "`\n" or (in_word and c in "\"'{"):
+                raise UnsupportedExpansion(f"Unsupported character {c!r}")
+            elif in_word and not literal and not parts and c in "~=":
+                raise UnsupportedExpansion(f"Unsupported leading {c!r}")
+            else:
+                literal.append(c)
+                self.idx += 1
+        if literal:
+            parts.append("".join(literal))
+        return tuple(parts)
+
+    def param(self) -> Param:
+        text = self.text
+        assert text[self.idx] == "$"
+        self.idx += 1
+        if text.startswith("{", self.idx):
+            self.idx += 1
+            m = _NAME_PATTERN.match(text, self.idx)
+            if m is None:
+                raise UnsupportedExpansion("Unsupported ${...} form")
+            name = m.group()
+            _check_name(name)
+            self.idx = m.end()
+            if text.startswith("}", self.idx):
+                self.idx += 1
+                return Param(name, None, ())
+            for op in _OPERATORS:
+                if text.startswith(op, self.idx):
+                    self.idx += len(op)
+                    break
+            else:
+                raise UnsupportedExpansion("Unsupported ${...} operator")
+            word = self.parts(in_word=True)
+            if not text.startswith("}", self.idx):
+                raise UnsupportedExpansion("Unterminated ${...}")
+            self.idx += 1
+            return Param(name, op, word)
+        m = _NAME_PATTERN.match(text, self.idx)
+        if m is None:
+            raise UnsupportedExpansion("Unsupported $ form")
+        name = m.group()
+        if name.isdigit() and len(name) > 1:
+            # Unlike POSIX sh, zsh treats this as ${12} (not ${1}2), unless in sh mode
+            raise UnsupportedExpansion(f"Ambiguous positional parameter ${name}")
+        _check_name(name)
+        self.idx += len(name)
+        following = text[self.idx : self.idx + 1]
+        if following == "[" or (following and not following.isascii()):
+            # Subscripts or (potentially) multibyte identifiers
+            raise UnsupportedExpansion(f"Unsupported character after ${name}")
+        elif following == ":":
+            after_colon = text[self.idx + 1 : self.idx + 2]
+            if after_colon and after_colon not in _SAFE_AFTER_COLON:
+                raise UnsupportedExpansion(f"Possible modifier after ${name}")
+        return Param(name, None, ())
+
+
+@functools.lru_cache(maxsize=512)
+def parse_quoted(text: str) -> tuple[Part, ...]:
+    """Parse the inside of a double-quoted string
+
+    Raises UnsupportedExpansion if it's outside the supported subset."""
+    parser = _Parser(text)
+    parts = parser.parts(in_word=False)
+    assert parser.idx == len(text)
+    return parts
+
+
+def is_supported(text: str) -> bool:
+    try:
+        parse_quoted(text)
+    except UnsupportedExpansion:
+        return False
+    else:
+        return True
+
+
+def referenced_names(parts: tuple[Part, ...]) -> set[str]:
+    """All the parameters referenced by the specified (parsed) expansion"""
+    res = set()
+    for part in parts:
+        if isinstance(part, Param):
+            res.add(part.name)
+            res.update(referenced_names(part.word))
+    return res
+
+
+def expand(parts: tuple[Part, ...], lookup: Callable[[str], Optional[str]]) -> str:
+    """Expand the parsed parts, using `lookup` to get the values of parameters
+
+    The lookup function returns None if the parameter is unset.
+    It may raise UnsupportedExpansion if it can't determine the value."""
+    res = []
+    for part in parts:
+        if isinstance(part, str):
+            res.append(part)
+            continue
+        value = lookup(part.name)
+        if value is None and part.name in ZSH_DEFAULTED_PARAMS:
+            raise UnsupportedExpansion(f"Unset ${part.name} is initialized by zsh")
+        op = part.op
+        if op is None:
+            use_word = False
+        elif op == ":-":
+            use_word = not value
+        elif op == "-":
+            use_word = value is None
+        elif op == ":+":
+            use_word = bool(value)
+            value = None
+        elif op == "+":
+            use_word = value is not None
+            value = None
+        else:
+            raise AssertionError(op)
+        if use_word:
+            res.append(expand(part.word, lookup))
+        elif value is not None:
+            res.append(value)
+    return "".join(res)
+
+
+def substitute(
+    parts: tuple[Part, ...], lookup: Callable[[str], Optional[str]]
+) -> tuple[Part, ...]:
+    """Partially expand the parsed parts, substituting the parameters with known values
+
+    Unlike `expand`, the lookup function returns None if the value is unknown
+    (so those parameters are kept as-is)."""
+    res = []
+    for part in parts:
+        if isinstance(part, str):
+            res.append(part)
+            continue
+        value = lookup(part.name)
+        op = part.op
+        if value is None:
+            res.append(Param(part.name, op, substitute(part.word, lookup)))
+        elif op is None or op == "-" or (op == ":-" and value):
+            res.append(value)
+        elif op in ("+", ":-") or value:
+            res.extend(substitute(part.word, lookup))
+        # Otherwise it's `${VAR:+word}` with an empty value (which expands to nothing)
+    merged = []
+    for part in res:
+        if isinstance(part, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += part
+        elif part != "":
+            merged.append(part)
+    return tuple(merged)
+
+
+def quote(parts: tuple[Part, ...], *, in_word: bool = False) -> str:
+    """Convert the parts back into the inside of a double-quoted string (the inverse of `parse_quoted`)
+
+    Raises UnsupportedExpansion if they can't be written in the supported subset
+    (like a literal `}` inside `${VAR:-word}`)."""
+    res = []
+    for part in parts:
+        if isinstance(part, Param):
+            if part.op is None:
+                res.append(f"${{{part.name}}}")
+            else:
+                res.append(f"${{{part.name}{part.op}{quote(part.word, in_word=True)}}}")
+        elif "\n" in part:
+            raise UnsupportedExpansion("Newline in literal")
+        elif in_word:
+            if any(c in part for c in "\\\"'{}`$"):
+                raise UnsupportedExpansion(f"Unsupported character in {part!r}")
+            elif not res and part[:1] in ("~", "="):
+                raise UnsupportedExpansion(f"Unsupported leading {part[0]!r}")
+            res.append(part)
+        else:
+            res.append("".join("\\" + c if c in _ESCAPABLE else c for c in part))
+    return "".join(res)
+
+
+__all__ = [
+    "UnsupportedExpansion",
+    "Param",
+    "parse_quoted",
+    "is_supported",
+    "referenced_names",
+    "expand",
+    "substitute",
+    "quote",
+]
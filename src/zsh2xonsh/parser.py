@@ -2,14 +2,14 @@
 
 Please shoot me"""
 
+import functools
 import re
 from enum import Enum
-from typing import Callable, Optional, Union
-
-from click import ClickException
+from typing import Callable, Iterable, Iterator, Optional, Union
 
 from . import translate
 from .ast import *
+from .lexer import Lexer, Token, TokenKind
 
 
 class TranslationError(RuntimeError):
@@ -59,165 +59,237 @@ class ShellParseError(TranslationError):
         return "Error parsing zsh subset (NYI?)"
 
 
+class ZshSyntaxValidationError(TranslationError):
+    """Indicates that zsh rejected the syntax of one or more delegated commands
+
+    Unlike other errors, this reports *all* the failures (not just the first one)."""
+
+    failures: list[tuple[Location, str, str]]  # (location, command, reason)
+
+    def __init__(self, failures: list[tuple[Location, str, str]]):
+        assert failures, "Expected at least one failure"
+        location, cmd, reason = failures[0]
+        msg = "\n".join(
+            [
+                f"{len(failures)} command(s) have invalid syntax",
+                *(
+                    f"  {cmd!r} @ {location}: {reason}"
+                    for location, cmd, reason in failures
+                ),
+            ]
+        )
+        super().__init__(msg, location)
+        self.failures = failures
+
+    @property
+    def kind(self) -> str:
+        return "Invalid zsh syntax"
+
+
 WORD_PATTERN = re.compile(r"\w+")
 WHITESPACE_PATTERN = re.compile(r"\s*")
 # NOTE: We only allow what the translator considers safe
 SHELL_LITERAL_PATTERN = translate.SAFE_LITERAL_PATTERN
+# The text of a command (in an `if`), which runs until the end of the statement
+COMMAND_TEXT_PATTERN = re.compile(r"[^;\n]*")
 STANDARD_BUILTINS = {"echo"}
 
+_INLINE_WHITESPACE = frozenset({TokenKind.WHITESPACE})
+# Things that can be skipped between statements
+_BLANK = frozenset({TokenKind.WHITESPACE, TokenKind.NEWLINE, TokenKind.COMMENT})
+# Things that terminate a list of expressions
+_END_OF_EXPRESSIONS = frozenset(
+    {TokenKind.NEWLINE, TokenKind.COMMENT, TokenKind.EOF, TokenKind.SEMICOLON}
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _char_set_pattern(chars: frozenset[str]) -> re.Pattern:
+    return re.compile("[" + "".join(map(re.escape, sorted(chars))) + "]*")
+
 
 class ShellParser:
     """A recursive decent parser for a limited subset of `zsh`.
 
+    The source is tokenized by a `Lexer`, which works on the whole buffer at once.
+    The parser just tracks the current offset into that buffer.
+
     Please shoot me :)"""
 
     __slots__ = (
-        "_current_line",
-        "lines",
-        "_lineno",
-        "_offset",
+        "_lexer",
+        "_pos",
         "dialect",
         "extra_builtins",
         "_stmt_dispatch",
         "_defined_functions",
     )
-    lines: list[str]
-    _current_line: Optional[str]  # None if EOF
+    _lexer: Lexer
+    # The current offset into the source
+    _pos: int
     extra_builtins: set[str]
     # HACK: This should not be in the parser
     _defined_functions: set[str]
     dialect: str
 
     def __init__(
-        self, lines: list[str], *, extra_builtins: set[str] = frozenset(), dialect="zsh"
+        self,
+        lines: Union[str, Iterable[str]],
+        *,
+        extra_builtins: set[str] = frozenset(),
+        dialect="zsh",
     ):
-        global _BUILTIN_STMT_DISPATCH
         if dialect != "zsh":
             raise NotImplementedError(f"Unsupported dialect: {dialect}")
         assert isinstance(extra_builtins, (set, frozenset))
-        self._current_line = lines[0] if lines else None
-        self.lines = lines
+        self._lexer = Lexer(lines)
+        self._pos = 0
         self.dialect = dialect
         self.extra_builtins = extra_builtins
-        dispatch = _BUILTIN_STMT_DISPATCH.copy()
-        # In theory we could hoist this out of here, but it's not really worth it
-        for bltn in STANDARD_BUILTINS:
-            assert (
-                WORD_PATTERN.fullmatch(bltn) is not None
-            ), "Invalid builtin function: {bltn!r}"
-            assert (
-                bltn not in dispatch
-            ), "The standard builtin function {bltn!r} conflicts with an existing builtin"
-            dispatch[bltn] = ShellParser.function_invocation
-        if extra_builtins:
-            for extra in extra_builtins:
-                assert (
-                    WORD_PATTERN.fullmatch(extra) is not None
-                ), "Invalid extra function: {extra!r}"
-                assert (
-                    extra not in dispatch
-                ), 'The "extra" function {extra!r} conflicts with a builtin'
-                dispatch[extra] = ShellParser.function_invocation
+        # NOTE: Copied, since defining functions modifies it
+        dispatch = _dispatch_table(frozenset(extra_builtins)).copy()
         self._defined_functions = set()
-        self._lineno = 1
-        self._offset = 0
         self._stmt_dispatch = dispatch
 
     @property
     def location(self) -> Location:
-        return Location(line=self._lineno, offset=self._offset)
+        return self._lexer.location(self._pos)
+
+    def _span(self, start: int, end: int) -> Span:
+        return Span(start, end, self._lexer.lines)
+
+    @property
+    def line_table(self) -> LineTable:
+        """The line table of the source (shared by the spans of the parsed nodes)"""
+        return self._lexer.lines
+
+    @property
+    def offset(self) -> int:
+        """The current offset into the source"""
+        return self._pos
+
+    @property
+    def defined_functions(self) -> frozenset[str]:
+        return frozenset(self._defined_functions)
+
+    def resume(self, offset: int, defined_functions: Iterable[str]):
+        """Continue parsing from the specified offset, which must be the start of a statement
+
+        The functions are the ones defined by the skipped statements.
+        This is used for incremental translation."""
+        assert offset >= self._pos
+        self._pos = offset
+        self._lexer.discard(offset)
+        for name in defined_functions:
+            self._define_function(name, offset)
+
+    def _define_function(self, name: str, pos: int):
+        # TODO: This doesn't care about overriding or scoping or anything
+        #
+        # Ah well
+        self._defined_functions.add(name)
+        if name in self._stmt_dispatch:
+            raise ShellParseError(
+                f"Defining {name!r} conflicts with existing builtin/statement",
+                self._lexer.location(pos),
+            )
+        else:
+            self._stmt_dispatch[name] = ShellParser.function_invocation
 
     @property
     def remaining_line(self) -> Optional[str]:
-        try:
-            return self._current_line[self._offset :]
-        except TypeError:
-            assert self._current_line is None, "Unexepected type: {self._current_line}"
+        """The rest of the current line (or None if at EOF)"""
+        lexer = self._lexer
+        if lexer.at_eof(self._pos):
             return None
+        return lexer.text_between(self._pos, lexer.line_end(self._pos))
+
+    def peek(self) -> Token:
+        return self._lexer.token(self._pos)
+
+    def take(self) -> Token:
+        token = self._lexer.token(self._pos)
+        self._pos = token.end
+        return token
+
+    def skip(self, kinds: frozenset[TokenKind]):
+        lexer = self._lexer
+        while (token := lexer.token(self._pos)).kind in kinds:
+            self._pos = token.end
 
     def take_while(
         self,
         pred: Union[set[str], Callable[[str], bool], re.Pattern],
         *,
         multiline=False,
-    ) -> str:
+    ) -> Optional[str]:
+        """Take characters matching the predicate (on the current line)
+
+        Returns None if already at EOF."""
         assert not multiline
+        lexer = self._lexer
+        if lexer.at_eof(self._pos):
+            return None
+        if isinstance(pred, (set, frozenset)):
+            pred = _char_set_pattern(frozenset(pred))
         if isinstance(pred, re.Pattern):
-            if self._current_line is None:
-                return None
-            m = pred.match(self._current_line, self._offset)
-            if m is None:
+            text = lexer.match_text(pred, self._pos, lexer.line_end(self._pos))
+            if text is None:
                 return ""
-            start, end = m.span()
-            assert end >= start
-            assert start >= self._offset
-            self._offset = end
-            return self._current_line[start:end]
+            self._pos += len(text)
+            return text
         elif callable(pred):
-            remaining = self.remaining_line
-            if remaining is None:
-                return None
+            text = lexer.text_between(self._pos, lexer.line_end(self._pos))
             idx = 0
-            while idx < len(remaining):
-                if pred(remaining[idx]):
-                    idx += 1
-                    continue
-                else:
-                    break
-            self._offset += idx
-            return remaining[:idx]
-        elif isinstance(pred, set):
-            return self.take_while(lambda c: c in pred)
+            while idx < len(text) and pred(text[idx]):
+                idx += 1
+            self._pos += idx
+            return text[:idx]
         else:
-            raise TypeError("Unsupported predicate type: {self.pred}")
+            raise TypeError(f"Unsupported predicate type: {pred!r}")
 
-    def next_line(self) -> Optional[str]:
-        if self._current_line is None:
+    def take_word(self) -> Optional[str]:
+        token = self.peek()
+        if token.kind == TokenKind.EOF:
             return None
-        lines = self.lines
-        if self._lineno < len(lines):
-            self._current_line = lines[self._lineno]
-            self._lineno += 1
+        elif token.kind == TokenKind.WORD:
+            self._pos = token.end
+            return self._lexer.token_text(token)
         else:
-            if self._current_line is not None:
-                self._lineno += 1
-            self._current_line = None
-        self._offset = 0
-        return self._current_line
-
-    def take_word(self) -> Optional[str]:
-        return self.take_while(WORD_PATTERN)
+            return ""
 
     def peek_word(self) -> Optional[str]:
-        old_offset = self._offset
-        word = self.take_word()
-        self._offset = old_offset
-        return word
+        token = self.peek()
+        if token.kind == TokenKind.EOF:
+            return None
+        elif token.kind == TokenKind.WORD:
+            return self._lexer.token_text(token)
+        else:
+            return ""
 
-    def skip_whitespace(self) -> str:
-        return self.take_while(WHITESPACE_PATTERN)
+    def skip_whitespace(self):
+        self.skip(_INLINE_WHITESPACE)
 
-    def skip_whitespace_lines(self) -> bool:
-        while True:
-            if self._current_line is None:
-                return None
-            self.skip_whitespace()
-            if not self.remaining_line or self.remaining_line.startswith("#"):
-                self.next_line()
-            else:
-                break
+    def skip_whitespace_lines(self):
+        self.skip(_BLANK)
 
     def statement(self) -> Optional[Statement]:
         stmt = self._statement()
-        if self.remaining_line:
-            self.skip_whitespace()
-            if self.remaining_line.startswith(";"):
-                self._offset += 1
+        self.skip_whitespace()
+        if self.peek().kind == TokenKind.SEMICOLON:
+            self.take()
+        # Nothing before here is needed anymore
+        self._lexer.discard(self._pos)
         return stmt
 
+    def statements(self) -> Iterator[Statement]:
+        """Parse the remaining statements (lazily)"""
+        while (stmt := self.statement()) is not None:
+            yield stmt
+
     def _statement(self) -> Optional[Statement]:
         self.skip_whitespace_lines()
-        start = self.location
+        start = self._pos
         first_word = self.peek_word()
         if first_word is None:
             return None
@@ -230,34 +302,36 @@ class ShellParser:
         except KeyError:
             pass  # Not a keyword, treat as a regular identifier..
         name = self.take_word()
-        self.take_while(WHITESPACE_PATTERN)
-        if self.remaining_line.startswith("="):
-            self._offset += 1
-            self.take_while(WHITESPACE_PATTERN)
+        self.skip_whitespace()
+        if self.peek().kind == TokenKind.EQUALS:
+            self.take()
+            self.skip_whitespace()
             value = self.expression(required=True)
-            end = self.location
-            return AssignmentStmt(Span(start, end), None, name, value)
+            end = self._pos
+            return AssignmentStmt(self._span(start, end), None, name, value)
         else:
             raise ShellParseError(
-                f"Unexpected char `{self.remaining_line[:1]}` after {name!r}",
+                f"Unexpected char `{(self.remaining_line or '')[:1]}` after {name!r}",
                 self.location,
             )
 
     def assignment_stmt(self) -> AssignmentStmt:
-        start = self.location
+        start = self._pos
         kind = AssignmentKind(self.take_word())
-        self.take_while(WHITESPACE_PATTERN)
+        self.skip_whitespace()
         target = self.take_word()
-        self.take_while(WHITESPACE_PATTERN)
-        if self.remaining_line.startswith("="):
-            self._offset += 1
+        if not target:
+            raise ShellParseError(f"Expected a name after `{kind.value}`", self.location)
+        self.skip_whitespace()
+        if self.peek().kind == TokenKind.EQUALS:
+            self.take()
             value = self.expression(required=True)
         elif kind == AssignmentKind.EXPORT:
             value = None
         else:
             raise ShellParseError(f"Expected an `=`", self.location)
-        end = self.location
-        return AssignmentStmt(Span(start, end), kind, target, value)
+        end = self._pos
+        return AssignmentStmt(self._span(start, end), kind, target, value)
 
     def expression(
         self,
@@ -268,47 +342,59 @@ class ShellParser:
     ) -> Expression:
         assert ctx in {ExpressionContext.VALUE, ExpressionContext.COMMAND}
         self.skip_whitespace()
-        start = self.location
-        remaining = self.remaining_line
-        if not remaining:
+        start = self._pos
+        token = self.peek()
+        kind = token.kind
+        if kind in (TokenKind.NEWLINE, TokenKind.COMMENT, TokenKind.EOF):
             if required:
-                raise ShellParseError("Expected an expression", start)
+                raise ShellParseError(
+                    "Expected an expression", self._lexer.location(start)
+                )
             else:
                 return None
-        if remaining.startswith("$"):
-            self._offset += 1
-            remaining = self.remaining_line
-            if remaining.startswith("("):
-                text = self.parse_balanced_parens()
-                return SubcommandExpr(Span(start, self.location), text)
-            else:
-                raise ShellParseError("Raw $VAR is not supported", self.location)
-        elif remaining.startswith("[["):
+        if kind == TokenKind.SUBST_OPEN:
+            self._pos += 1  # Skip the `$`
+            text = self.parse_balanced_parens()
+            lexer = self._lexer
+            pure = (
+                translate.PURE_PRAGMA_PATTERN.search(
+                    lexer.text_between(self._pos, lexer.line_end(self._pos))
+                )
+                is not None
+            )
+            return SubcommandExpr(self._span(start, self._pos), text, pure=pure)
+        elif kind == TokenKind.DOLLAR:
+            self.take()
+            raise ShellParseError("Raw $VAR is not supported", self.location)
+        elif kind == TokenKind.TEST_OPEN:
             test = self.parse_balanced(opening="[[", closing="]]")
             return TestCommandExpr(
-                span=Span(start, self.location), text=f"[[ {test} ]]"
+                span=self._span(start, self._pos), text=f"[[ {test} ]]"
             )
         elif ctx == ExpressionContext.COMMAND:
             # Interpret remaining as a command
             #
             # TODO: Skip over ';' inside string :(
-            text = self.take_while(lambda c: c != ";")
-            return TestCommandExpr(span=Span(start, self.location), text=text)
-        elif m := SHELL_LITERAL_PATTERN.match(remaining):
-            assert m.span()[0] == 0
-            self._offset += m.span()[1]
-            assert self.location.offset == self._offset
+            text = self.take_while(COMMAND_TEXT_PATTERN)
+            return TestCommandExpr(span=self._span(start, self._pos), text=text)
+        elif kind in (TokenKind.WORD, TokenKind.LITERAL):
+            self.take()
             return LiteralExpr(
-                Span(start, self.location),
-                self._current_line[start.offset : self._offset],
+                self._span(start, self._pos), self._lexer.token_text(token)
+            )
+        elif kind in (TokenKind.DOUBLE_QUOTED, TokenKind.SINGLE_QUOTED):
+            text = self._lexer.token_text(token)
+            self.take()
+            # NOTE: We don't want to include starting or ending quote
+            return QuotedExpression(
+                self._span(start, self._pos), text[1:-1], QuoteStyle(text[0])
+            )
+        elif kind == TokenKind.UNTERMINATED:
+            raise ShellParseError(
+                f"Unable to find closing quote `{self._lexer.token_text(token)}`",
+                self._lexer.location(start),
             )
-        elif remaining[0] in ('"', "'"):
-            style = QuoteStyle(remaining[0])
-            start = self.location
-            s = self.parse_string(style)
-            end = self.location
-            return QuotedExpression(Span(start, end), s, style)
-        elif remaining.startswith(";"):
+        elif kind == TokenKind.SEMICOLON:
             return (
                 None  # Consider end of expressions (because this terminates statement)
             )
@@ -319,28 +405,23 @@ class ShellParser:
         """Parse a string.
 
         This does not interpret escape codes. It passes them through as-is."""
-        start = self.location
-        remaining = self.remaining_line
-        quote = str(style)
-        assert remaining.startswith(quote)
-        idx = 1
-        while True:
-            next_quote = remaining.find(quote, idx)
-            if next_quote < 0:
-                raise ShellParseError(
-                    "Unable to find closing quote `{quote}` (NOTE: Multi-line strings are unsupporteed)",
-                    start,
-                )
-            elif remaining[next_quote - 1] == "\\" and (
-                next_quote < 2 or remaining[next_quote - 2] != "\\"
-            ):
-                # It's an escaped quote
-                idx = next_quote + 1
-            else:
-                assert next_quote < len(remaining)
-                self._offset += next_quote + 1
-                # NOTE: We don't want to include starting or ending quote
-                return remaining[1:next_quote]
+        start = self._pos
+        token = self.peek()
+        if token.kind == TokenKind.UNTERMINATED:
+            raise ShellParseError(
+                f"Unable to find closing quote `{style}`", self._lexer.location(start)
+            )
+        expected = (
+            TokenKind.DOUBLE_QUOTED
+            if style == QuoteStyle.DOUBLE
+            else TokenKind.SINGLE_QUOTED
+        )
+        if token.kind != expected:
+            raise ShellParseError(
+                f"Expected a string quoted with `{style}`", self._lexer.location(start)
+            )
+        self.take()
+        return self._lexer.text_between(token.start + 1, token.end - 1)
 
     def parse_balanced_parens(self, **kwargs):
         kwargs["opening"] = "("
@@ -359,75 +440,18 @@ class ShellParser:
     ) -> str:
         assert len(opening) >= 1
         assert len(closing) >= 1
-        remaining = self.remaining_line
-        assert remaining.startswith(
-            opening
-        ), f"Expected start {opening!r}, but got {remaining[:len(start) + 1]!r}"
-        current = self._current_line
-        start_loc = self.location
-        idx = self._offset + 1
-        level = 1
-
-        def try_advance():
-            nonlocal idx, current
-            if not multiline or (current := self.next_line()) is None:
-                raise ShellParseError(
-                    f"Expected a matching closing `{closing}`", start_loc
-                )
-            else:
-                self.next_line()
-                current = self._current_line
-                idx = 0
-
-        end_loc = None
-        while True:
-            next_opening = current.find(opening, idx)
-            next_closing = current.find(closing, idx)
-            if next_opening < 0:
-                # no opening
-                if next_closing < 0:
-                    # no opening and no closing
-                    try_advance()
-                    continue
-                else:
-                    # no opening, but a closing
-                    level -= 1
-                    idx = next_closing + len(closing)
-            elif next_closing < 0:
-                # no closing, but an opening
-                level += 1
-                idx += next_opening + len(opening)
-            else:
-                # Both an opening and a closing. Which comes first?
-                if next_opening < next_closing:
-                    # opening first
-                    idx = next_opening + len(opening)
-                    level += 1
-                    continue
-                else:
-                    # closing first
-                    assert next_opening > next_closing
-                    level -= 1
-                    idx = next_closing + len(closing)
-            if level == 0:
-                self._offset = idx
-                end_loc = self.location
-                break
-        if multiline and start_loc.line != end_loc.line:
-            assert start_loc.line < end_loc.line
-            first_line = self.lines[start_loc.line - 1][start_loc.offset :]
-            lines = [first_line]
-            line = start_loc.line + 1
-            while line < end_loc.line:
-                lines.append(self.lines[line - 1])
-            assert self.lines[end_loc.line - 1] == self._current_line
-            res.append(self._current_line[: self._offset])
-            text = "\n".join(res)
-        else:
-            assert start_loc.line == end_loc.line
-            assert start_loc.offset < end_loc.offset
-            assert start_loc.line == self._lineno
-            text = self._current_line[start_loc.offset : end_loc.offset]
+        lexer = self._lexer
+        start = self._pos
+        assert lexer.startswith(
+            opening, start
+        ), f"Expected start {opening!r}, but got {lexer.text_between(start, start + len(opening))!r}"
+        end = lexer.scan_balanced(start, opening, closing)
+        if end < 0 or (not multiline and end > lexer.line_end(start)):
+            raise ShellParseError(
+                f"Expected a matching closing `{closing}`", self.location
+            )
+        self._pos = end
+        text = lexer.text_between(start, end)
         assert text.startswith(opening), repr(text)
         assert text.endswith(closing), repr(text)
         if strip_outer:
@@ -435,40 +459,42 @@ class ShellParser:
         return text
 
     def conditional_stmt(self) -> ConditionalStmt:
-        start = self.location
+        start = self._pos
         start_word = self.take_word()
         if start_word != "if":
             raise ShellParseError("Expected an `if`", self.location)
         condition = self.expression(ctx=ExpressionContext.COMMAND)
         self.skip_whitespace()
-        if not self.remaining_line.startswith(";"):
+        if self.peek().kind != TokenKind.SEMICOLON:
             raise ShellParseError("Expected a semicolon", self.location)
         else:
-            self._offset += 1
+            self.take()
         self.skip_whitespace()
         if (word := self.peek_word()) != "then":
-            raise ShellParseError("Expected `then`, but got `{word!r}`", self.location)
+            raise ShellParseError(f"Expected `then`, but got `{word!r}`", self.location)
         self.take_word()
         then = []
         while True:
             self.skip_whitespace_lines()
-            if self._current_line is None:
-                return None
             word = self.peek_word()
-            if word in ("else", "elif"):
+            if word is None:
+                raise ShellParseError(
+                    "Expected a closing `fi`", self._lexer.location(start)
+                )
+            elif word in ("else", "elif"):
                 raise ShellParseError(
-                    "Unsupported conditional operation `{word}`", self.location
+                    f"Unsupported conditional operation `{word}`", self.location
                 )
             elif word == "fi":
                 self.take_word()
                 break
             else:
                 then.append(self.statement())
-        end = self.location
-        return ConditionalStmt(Span(start, end), condition=condition, then=then)
+        end = self._pos
+        return ConditionalStmt(self._span(start, end), condition=condition, then=then)
 
     def function_declaration(self) -> FunctionDeclaration:
-        start = self.location
+        start = self._pos
         start_word = self.take_word()
         if start_word != "function":
             raise ShellParseError("Expected a `function`", self.location)
@@ -477,46 +503,42 @@ class ShellParser:
         if not name:
             raise ShellParseError("Expected a name for the function", self.location)
         self.skip_whitespace()
-        open_parens = self.take_while(re.compile(r"\(\s*\)"))
-        if not open_parens:
+        if self.peek().kind != TokenKind.EMPTY_PARENS:
             raise ShellParseError(
                 f"Expected opening parens () for function declaration {name!r}",
                 self.location,
             )
+        self.take()
         self.skip_whitespace()
-        if self.remaining_line.startswith("{"):
-            self._offset += 1
+        if self.peek().kind == TokenKind.OPEN_BRACE:
+            self.take()
         else:
-            raise ShellParseError("Expected opening brace")
+            raise ShellParseError("Expected opening brace", self.location)
         body = []
         while True:
             self.skip_whitespace_lines()
-            if self.remaining_line.startswith("}"):
-                self._offset += 1
-                end = self.location
+            kind = self.peek().kind
+            if kind == TokenKind.CLOSE_BRACE:
+                self.take()
+                end = self._pos
                 break
+            elif kind == TokenKind.EOF:
+                raise ShellParseError(
+                    "Expected a closing brace", self._lexer.location(start)
+                )
             else:
                 stmt = self.statement()
                 body.append(stmt)
 
-        # TODO: This doesn't care about overriding or scoping or anything
-        #
-        # Ah well
-        self._defined_functions.add(name)
-        if name in self._stmt_dispatch:
-            raise ShellParseError(
-                "Defining {name!r} conflicts with existing builtin/statement", start
-            )
-        else:
-            self._stmt_dispatch[name] = ShellParser.function_invocation
+        self._define_function(name, start)
         return FunctionDeclaration(
-            span=Span(start, end),
+            span=self._span(start, end),
             name=name,
             body=body,
         )
 
     def function_invocation(self) -> FunctionInvocation:
-        start = self.location
+        start = self._pos
         name = self.take_word()
         if name in self.extra_builtins:
             kind = FunctionInvocationKind.EXTRA_BUILTIN
@@ -525,17 +547,16 @@ class ShellParser:
         elif name in self._defined_functions:
             kind = FunctionInvocationKind.USER_DEFINED_FUNCTION
         else:
-            raise AssertionError(f"Unknown type of invocation for {name!r} @ {start}")
-        end = self.location
+            raise AssertionError(
+                f"Unknown type of invocation for {name!r} @ {self._lexer.location(start)}"
+            )
+        end = self._pos
         args = []
-        while self.remaining_line.strip():
-            expr = self.expression()
-            if expr is None:
-                break
+        while (expr := self.expression()) is not None:
             args.append(expr)
-            end = self.location
+            end = self._pos
         return FunctionInvocation(
-            span=Span(start, end), name=name, args=args, kind=kind
+            span=self._span(start, end), name=name, args=args, kind=kind
         )
 
 
@@ -546,3 +567,31 @@ _BUILTIN_STMT_DISPATCH = {
     "if": ShellParser.conditional_stmt,
     "function": ShellParser.function_declaration,
 }
+# The words that start a special statement (which can't be used as builtins)
+STATEMENT_KEYWORDS = frozenset(_BUILTIN_STMT_DISPATCH)
+
+
+@functools.lru_cache(maxsize=64)
+def _dispatch_table(extra_builtins: frozenset[str]) -> dict[str, Callable]:
+    """The (validated) statement dispatch table for the specified set of extra builtins
+
+    This is cached, since parsers are frequently created with the same builtins.
+    The result must not be modified."""
+    dispatch = _BUILTIN_STMT_DISPATCH.copy()
+    for bltn in STANDARD_BUILTINS:
+        assert (
+            WORD_PATTERN.fullmatch(bltn) is not None
+        ), "Invalid builtin function: {bltn!r}"
+        assert (
+            bltn not in dispatch
+        ), "The standard builtin function {bltn!r} conflicts with an existing builtin"
+        dispatch[bltn] = ShellParser.function_invocation
+    for extra in extra_builtins:
+        assert (
+            WORD_PATTERN.fullmatch(extra) is not None
+        ), "Invalid extra function: {extra!r}"
+        assert (
+            extra not in dispatch
+        ), 'The "extra" function {extra!r} conflicts with a builtin'
+        dispatch[extra] = ShellParser.function_invocation
+    return dispatch
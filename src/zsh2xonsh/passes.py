@@ -0,0 +1,570 @@
+"""Transformation passes over the parsed AST
+
+These run after parsing (and before translation),
+rewriting the statements into more efficient (but equivalent) forms."""
+from __future__ import annotations
+
+import dataclasses
+from typing import Optional
+
+from . import analysis, conditions, params, translate
+from .ast import (
+    AssignmentBatch,
+    AssignmentKind,
+    AssignmentStmt,
+    ConditionalStmt,
+    Expression,
+    ExprStmt,
+    FunctionDeclaration,
+    FunctionInvocation,
+    FunctionInvocationKind,
+    LiteralExpr,
+    PrefetchStmt,
+    QuotedExpression,
+    QuoteStyle,
+    Statement,
+    TestCommandExpr,
+    walk,
+)
+
+
+def _map_bodies(stmt: Statement, func) -> Statement:
+    """Apply the pass to the bodies of conditionals and functions"""
+    if isinstance(stmt, ConditionalStmt):
+        return dataclasses.replace(stmt, then=func(stmt.then))
+    elif isinstance(stmt, FunctionDeclaration):
+        return dataclasses.replace(stmt, body=func(stmt.body))
+    else:
+        return stmt
+
+
+def _needs_zsh(stmt: Statement) -> bool:
+    return next(stmt.delegated_commands(), None) is not None
+
+
+def batch_assignments(
+    stmts: list[Statement], settings: translate.Settings
+) -> list[Statement]:
+    """Group runs of consecutive assignments into a single `AssignmentBatch`
+
+    Only assignments that actually need zsh are worth batching,
+    so each batch starts and ends with one of those.
+    A batch is only created if it saves at least one zsh process.
+
+    Updates to path variables that are spliced in directly (see `AssignmentStmt.path_update`)
+    end the run, so they don't go through zsh. So do literals (see `AssignmentStmt.is_batchable`).
+
+    This recurses into the bodies of functions and conditionals."""
+    res = []
+    run = []
+
+    def flush():
+        delegated = [idx for idx, stmt in enumerate(run) if _needs_zsh(stmt)]
+        if len(delegated) >= 2:
+            first, last = delegated[0], delegated[-1]
+            batched = run[first : last + 1]
+            res.extend(run[:first])
+            res.append(AssignmentBatch(batched[0].span.to(batched[-1].span), batched))
+            res.extend(run[last + 1 :])
+        else:
+            res.extend(run)
+        run.clear()
+
+    for stmt in stmts:
+        if (
+            isinstance(stmt, AssignmentStmt)
+            and stmt.is_batchable
+            and stmt.path_update(settings) is None
+        ):
+            run.append(stmt)
+            continue
+        flush()
+        res.append(_map_bodies(stmt, lambda body: batch_assignments(body, settings)))
+    flush()
+    return res
+
+
+def _eager_commands(stmt: Statement) -> list[tuple[analysis.Effects, str]]:
+    """The pure commands that are always delegated to zsh when the statement runs,
+    before it does anything else"""
+    if isinstance(stmt, AssignmentStmt):
+        if stmt.kind == AssignmentKind.ALIAS:
+            return []
+        exprs = [stmt.value if stmt.value is not None else stmt.implicit_value()]
+    elif isinstance(stmt, AssignmentBatch):
+        batch_effects = analysis.effects(stmt)
+        if analysis.EVERYTHING in batch_effects.writes:
+            # One of the values has side effects
+            return []
+        return [(batch_effects, stmt.script())]
+    elif isinstance(stmt, ConditionalStmt):
+        # NOTE: The body is conditional, so it can't be run eagerly
+        exprs = [stmt.condition]
+    elif isinstance(stmt, ExprStmt):
+        exprs = [stmt.expr]
+    elif isinstance(stmt, FunctionInvocation):
+        exprs = stmt.args
+    else:
+        return []
+    return [
+        (analysis.effects(expr), cmd)
+        for expr in exprs
+        if (cmd := expr.delegated_command()) is not None
+        and analysis.is_pure_command(expr)
+    ]
+
+
+def schedule_prefetch(stmts: list[Statement]) -> list[Statement]:
+    """Start independent zsh commands in the background, as early as possible
+
+    Each pure command that is always run by a statement is moved back
+    to the earliest point where nothing it reads has been written.
+    Commands that could have side effects (see `analysis.is_pure_command`) are never prefetched,
+    and they write everything, so nothing is moved before them.
+    If at least two commands can start at the same point,
+    a `PrefetchStmt` is inserted there to run them concurrently.
+
+    The commands are still evaluated in program order (using the prefetched results),
+    and the runtime double-checks that their inputs are unchanged.
+
+    This recurses into the bodies of functions and conditionals."""
+    stmts = [_map_bodies(stmt, schedule_prefetch) for stmt in stmts]
+    stmt_effects = [analysis.effects(stmt) for stmt in stmts]
+    groups: dict[int, list[str]] = {}
+    for idx, stmt in enumerate(stmts):
+        for cmd_effects, cmd in _eager_commands(stmt):
+            start = idx
+            while start > 0 and not cmd_effects.depends_on(stmt_effects[start - 1]):
+                start -= 1
+            group = groups.setdefault(start, [])
+            if cmd not in group:
+                group.append(cmd)
+    res = []
+    for idx, stmt in enumerate(stmts):
+        group = groups.get(idx, ())
+        if len(group) >= 2:
+            res.append(PrefetchStmt(stmt.span, group))
+        res.append(stmt)
+    return res
+
+
+class Constants:
+    """The values of parameters that are known at translation time (see `propagate_constants`)
+
+    This also tracks the functions that can be inlined (see `inline_functions`)."""
+
+    __slots__ = ("locals", "env", "functions")
+    # Every local that has been assigned, with None if its value is unknown
+    #
+    # NOTE: Locals shadow environment variables at runtime (even if they are exported later)
+    locals: dict[str, Optional[str]]
+    # The known values of environment variables
+    env: dict[str, str]
+    # The current definitions of the functions that can be inlined
+    functions: dict[str, FunctionDeclaration]
+
+    def __init__(self):
+        self.locals = {}
+        self.env = {}
+        self.functions = {}
+
+    def copy(self) -> Constants:
+        res = Constants()
+        res.locals = self.locals.copy()
+        res.env = self.env.copy()
+        res.functions = self.functions.copy()
+        return res
+
+    def lookup(self, name: str) -> Optional[str]:
+        """The value of the parameter, or None if it isn't known"""
+        if name in self.locals:
+            return self.locals[name]
+        return self.env.get(name)
+
+    def forget(self):
+        """Forget all the values (after running code that could change anything)
+
+        Functions are only ever redefined by declarations, so those are kept."""
+        self.locals = dict.fromkeys(self.locals)
+        self.env = {}
+
+    def join(self, branch: Constants):
+        """Merge the values after a branch that may (or may not) have run"""
+        self.locals = {
+            name: value if self.locals.get(name) == value else None
+            for name, value in branch.locals.items()
+        }
+        self.env = {
+            name: value
+            for name, value in self.env.items()
+            if branch.env.get(name) == value
+        }
+        self.functions = {
+            name: func
+            for name, func in self.functions.items()
+            if branch.functions.get(name) is func
+        }
+
+
+def _static_value(expr: Expression) -> Optional[str]:
+    """The value that the expression evaluates to at runtime (as a string), if it's known"""
+    if isinstance(expr, LiteralExpr):
+        if expr.text.startswith("~"):
+            return None
+        elif translate.is_valid_integer(expr.text):
+            # NOTE: The runtime stringifies the python int
+            return str(int(expr.text))
+        else:
+            return expr.text
+    elif isinstance(expr, QuotedExpression):
+        if expr.style == QuoteStyle.SINGLE:
+            return expr.inside_text
+        try:
+            parts = params.parse_quoted(expr.inside_text)
+        except params.UnsupportedExpansion:
+            return None
+        if all(isinstance(part, str) for part in parts):
+            return "".join(parts)
+    return None
+
+
+def _substitute(expr: Expression, constants: Constants) -> Expression:
+    if not isinstance(expr, QuotedExpression) or expr.style != QuoteStyle.DOUBLE:
+        return expr
+    try:
+        parts = params.parse_quoted(expr.inside_text)
+        substituted = params.substitute(parts, constants.lookup)
+        if substituted == parts:
+            return expr
+        text = params.quote(substituted)
+    except params.UnsupportedExpansion:
+        return expr
+    return QuotedExpression(expr.span, text, QuoteStyle.DOUBLE)
+
+
+def propagate_constants(
+    stmts: list[Statement],
+    settings: translate.Settings,
+    constants: Optional[Constants] = None,
+) -> list[Statement]:
+    """Substitute the parameters whose values are known at translation time into later strings
+
+    Locals and exports are known if they're assigned a literal (or a string that is fully known).
+    Strings that become fully known are translated into python literals,
+    so they don't need to be expanded at runtime.
+
+    Only double-quoted strings in the subset supported by `zsh2xonsh.params` are changed.
+    Command substitutions and conditions are left alone,
+    since substituting into them would require understanding zsh's quoting.
+
+    The body of a conditional may not run, so anything it assigns is unknown afterwards.
+    The body of a function can run at any time, so it starts out knowing nothing.
+    Calling anything other than a standard builtin forgets everything.
+
+    The constants are updated in-place (if specified), so they can carry over to the next statements."""
+    if constants is None:
+        constants = Constants()
+    res = []
+    for stmt in stmts:
+        if isinstance(stmt, AssignmentStmt):
+            if stmt.kind == AssignmentKind.ALIAS:
+                res.append(stmt)
+                continue
+            if stmt.value is not None:
+                substituted = _substitute(stmt.value, constants)
+                if substituted is not stmt.value:
+                    stmt = dataclasses.replace(stmt, value=substituted)
+                value = _static_value(substituted)
+            else:
+                # The implicit value of `export FOO` is "${FOO}"
+                value = constants.lookup(stmt.target)
+            if stmt.kind != AssignmentKind.EXPORT:
+                constants.locals[stmt.target] = value
+            elif value is not None and not stmt.is_typed(settings):
+                constants.env[stmt.target] = value
+            else:
+                constants.env.pop(stmt.target, None)
+        elif isinstance(stmt, ExprStmt):
+            substituted = _substitute(stmt.expr, constants)
+            if substituted is not stmt.expr:
+                stmt = dataclasses.replace(stmt, expr=substituted)
+        elif isinstance(stmt, FunctionInvocation):
+            args = [_substitute(arg, constants) for arg in stmt.args]
+            if any(new is not old for new, old in zip(args, stmt.args)):
+                stmt = dataclasses.replace(stmt, args=args)
+            if stmt.kind != FunctionInvocationKind.STANDARD_BUILTIN:
+                constants.forget()
+        elif isinstance(stmt, ConditionalStmt):
+            branch = constants.copy()
+            stmt = dataclasses.replace(
+                stmt, then=propagate_constants(stmt.then, settings, branch)
+            )
+            constants.join(branch)
+        elif isinstance(stmt, FunctionDeclaration):
+            stmt = dataclasses.replace(
+                stmt, body=propagate_constants(stmt.body, settings)
+            )
+        else:
+            constants.forget()
+        res.append(stmt)
+    return res
+
+
+# The maximum number of statements in a function that can be inlined
+#
+# NOTE: The body is copied into every call site
+MAX_INLINED_STATEMENTS = 4
+
+
+def _is_inlinable(stmt: Statement) -> bool:
+    if isinstance(stmt, AssignmentStmt):
+        # NOTE: Locals would leak into the caller
+        return stmt.kind == AssignmentKind.EXPORT and (
+            stmt.value is None or isinstance(stmt.value, (LiteralExpr, QuotedExpression))
+        )
+    elif isinstance(stmt, ConditionalStmt):
+        return isinstance(stmt.condition, TestCommandExpr) and all(
+            map(_is_inlinable, stmt.then)
+        )
+    else:
+        return False
+
+
+def _arg_parts(expr: Expression) -> tuple[params.Part, ...]:
+    """The value of an argument, as parsed parts (raises UnsupportedExpansion if it's too complex)"""
+    if isinstance(expr, LiteralExpr):
+        if expr.text == "~" or expr.text.startswith("~/"):
+            # NOTE: This is how zsh expands `~` (falling back to zsh if $HOME is unset)
+            return (params.Param("HOME", None, ()), expr.text[1:])
+        elif expr.text.startswith("~"):
+            raise params.UnsupportedExpansion(f"Named directory in {expr.text!r}")
+        elif translate.is_valid_integer(expr.text):
+            return (str(int(expr.text)),)
+        return (expr.text,)
+    elif isinstance(expr, QuotedExpression):
+        if expr.style == QuoteStyle.SINGLE:
+            return (expr.inside_text,)
+        return params.parse_quoted(expr.inside_text)
+    else:
+        raise params.UnsupportedExpansion(f"Complex argument {expr.zsh_source()!r}")
+
+
+def _bind_parts(
+    parts: tuple[params.Part, ...], args: list[tuple[params.Part, ...]]
+) -> tuple[params.Part, ...]:
+    """Substitute the positional parameters with the parts of the arguments"""
+    res = []
+    for part in parts:
+        if isinstance(part, str):
+            res.append(part)
+            continue
+        elif not part.name.isdigit():
+            res.append(params.Param(part.name, part.op, _bind_parts(part.word, args)))
+            continue
+        idx = int(part.name)
+        if not 0 < idx <= len(args):
+            raise params.UnsupportedExpansion(f"Missing argument ${part.name}")
+        value = args[idx - 1]
+        if part.op in (None, "-"):
+            res.extend(value)
+        elif part.op == "+":
+            res.extend(_bind_parts(part.word, args))
+        elif not all(isinstance(arg_part, str) for arg_part in value):
+            raise params.UnsupportedExpansion(f"Unknown emptiness of ${part.name}")
+        elif bool("".join(value)) == (part.op == ":+"):
+            res.extend(_bind_parts(part.word, args))
+        elif part.op == ":-":
+            res.extend(value)
+    merged = []
+    for part in res:
+        if isinstance(part, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += part
+        elif part != "":
+            merged.append(part)
+    return tuple(merged)
+
+
+def _bind_quoted(
+    expr: QuotedExpression, args: list[tuple[params.Part, ...]]
+) -> QuotedExpression:
+    if expr.style == QuoteStyle.SINGLE:
+        return expr
+    parts = params.parse_quoted(expr.inside_text)
+    bound = _bind_parts(parts, args)
+    if bound == parts:
+        return expr
+    return QuotedExpression(expr.span, params.quote(bound), QuoteStyle.DOUBLE)
+
+
+def _bind_body(
+    stmts: list[Statement], call: FunctionInvocation, args: list[tuple[params.Part, ...]]
+) -> list[Statement]:
+    res = []
+    for stmt in stmts:
+        if isinstance(stmt, AssignmentStmt):
+            value = stmt.value
+            if isinstance(value, QuotedExpression):
+                value = _bind_quoted(value, args)
+            res.append(dataclasses.replace(stmt, span=call.span, value=value))
+        elif isinstance(stmt, ConditionalStmt):
+            cond = conditions.parse_test(stmt.condition.text)
+            bound = conditions.map_operands(cond, lambda parts: _bind_parts(parts, args))
+            condition = stmt.condition
+            if bound != cond:
+                condition = TestCommandExpr(call.span, conditions.to_text(bound))
+            res.append(
+                ConditionalStmt(call.span, condition, _bind_body(stmt.then, call, args))
+            )
+        else:
+            raise AssertionError(stmt)
+    return res
+
+
+def _inline_call(
+    func: FunctionDeclaration, call: FunctionInvocation
+) -> Optional[list[Statement]]:
+    """The body of the function with the arguments of the call substituted (if possible)"""
+    try:
+        args = [_arg_parts(arg) for arg in call.args]
+        assigned = {
+            stmt.target for stmt in walk(func.body) if isinstance(stmt, AssignmentStmt)
+        }
+        if any(params.referenced_names(parts) & assigned for parts in args):
+            # The body would change the value of the argument
+            return None
+        return _bind_body(func.body, call, args)
+    except params.UnsupportedExpansion:
+        return None
+
+
+def inline_functions(
+    stmts: list[Statement],
+    settings: translate.Settings,
+    constants: Optional[Constants] = None,
+) -> list[Statement]:
+    """Replace calls to small functions with the body of the function
+
+    A function can be inlined if its body only contains exports and `[[ ... ]]` conditionals
+    (with at most `MAX_INLINED_STATEMENTS` statements in total).
+    The arguments of the call must be literals (including `~/...`)
+    or strings in the subset supported by `zsh2xonsh.params`,
+    and the body must not assign any of the parameters they reference.
+
+    The positional parameters are substituted with the arguments,
+    so the inlined code runs directly in the caller's context (without `begin_function`).
+    Any other call (or a reference to a missing argument) uses the generic function.
+
+    Calls inside the bodies of functions are left alone,
+    since the function they refer to could be redefined before they run.
+
+    The functions are tracked by the `constants`, so they carry over to the next statements."""
+    if constants is None:
+        constants = Constants()
+    res = []
+    for stmt in stmts:
+        if isinstance(stmt, FunctionDeclaration):
+            if (
+                sum(1 for node in walk(stmt.body) if isinstance(node, Statement))
+                <= MAX_INLINED_STATEMENTS
+                and all(map(_is_inlinable, stmt.body))
+            ):
+                constants.functions[stmt.name] = stmt
+            else:
+                constants.functions.pop(stmt.name, None)
+        elif isinstance(stmt, ConditionalStmt):
+            branch = constants.copy()
+            stmt = dataclasses.replace(
+                stmt, then=inline_functions(stmt.then, settings, branch)
+            )
+            constants.join(branch)
+        elif (
+            isinstance(stmt, FunctionInvocation)
+            and stmt.kind == FunctionInvocationKind.USER_DEFINED_FUNCTION
+            and stmt.name in constants.functions
+        ):
+            inlined = _inline_call(constants.functions[stmt.name], stmt)
+            if inlined is not None:
+                res.extend(inlined)
+                continue
+        res.append(stmt)
+    return res
+
+
+def _merge_path_updates(
+    first: AssignmentStmt, second: AssignmentStmt, settings: translate.Settings
+) -> Optional[AssignmentStmt]:
+    if not (
+        first.target == second.target
+        and first.path_update(settings) is not None
+        and second.path_update(settings) is not None
+    ):
+        return None
+    parts = params.parse_quoted(second.value.inside_text)
+    reference = params.Param(second.target, None, ())
+    if parts.count(reference) != 1:
+        # Conditional references depend on the value of the first assignment
+        return None
+    idx = parts.index(reference)
+    merged = (
+        *parts[:idx],
+        *params.parse_quoted(first.value.inside_text),
+        *parts[idx + 1 :],
+    )
+    try:
+        text = params.quote(merged)
+    except params.UnsupportedExpansion:
+        return None
+    if translate.match_path_update(first.target, text) is None:
+        return None
+    value = QuotedExpression(
+        first.value.span.to(second.value.span), text, QuoteStyle.DOUBLE
+    )
+    return dataclasses.replace(first, span=first.span.to(second.span), value=value)
+
+
+def coalesce_path_updates(
+    stmts: list[Statement], settings: translate.Settings
+) -> list[Statement]:
+    """Merge consecutive updates to the same path variable into a single update
+
+    For example `export PATH="$PATH:/a"` followed by `export PATH="$PATH:/b"`
+    becomes `export PATH="$PATH:/a:/b"`, so the entries are added all at once
+    (see `ZshContext.extend_path_var`).
+    This is common after `inline_functions`, with helpers like `extend_path`.
+
+    Both must be idioms recognized by `translate.match_path_update`,
+    and the second must reference the variable directly (not in `${VAR+...}`).
+
+    This recurses into the bodies of functions and conditionals."""
+    res = []
+    for stmt in stmts:
+        if isinstance(stmt, AssignmentStmt) and res and isinstance(res[-1], AssignmentStmt):
+            merged = _merge_path_updates(res[-1], stmt, settings)
+            if merged is not None:
+                res[-1] = merged
+                continue
+        res.append(_map_bodies(stmt, lambda body: coalesce_path_updates(body, settings)))
+    return res
+
+
+def run_passes(
+    stmts: list[Statement],
+    settings: translate.Settings,
+    constants: Optional[Constants] = None,
+) -> list[Statement]:
+    """Run all the enabled passes over the specified statements
+
+    The `constants` carry over between calls (see `propagate_constants` and `inline_functions`)."""
+    if constants is None:
+        constants = Constants()
+    if settings.inline_functions:
+        stmts = inline_functions(stmts, settings, constants)
+    if settings.propagate_constants:
+        stmts = propagate_constants(stmts, settings, constants)
+    if settings.coalesce_path_updates:
+        stmts = coalesce_path_updates(stmts, settings)
+    if settings.batch_assignments:
+        stmts = batch_assignments(stmts, settings)
+    if settings.prefetch:
+        stmts = schedule_prefetch(stmts)
+    return stmts
@@ -2,12 +2,24 @@
 from __future__ import annotations
 
 import collections.abc
+import itertools
+import os
 import os.path
 from contextlib import contextmanager
-from subprocess import DEVNULL, PIPE, CalledProcessError, run
-from typing import Callable, Optional
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable, Iterable, NamedTuple, Optional
 
+# NOTE: Generated code imports this on every shell startup, so it must be cheap to import.
+# In particular, none of the translator's modules (or click) are imported,
+# and rarely used dependencies (like subprocess and concurrent.futures) are imported lazily.
+from .. import conditions, params, shell
 from . import xonshi
+from .instrument import ChromeTrace, Instrumentation
+from .memo import MemoTable, default_budget
+from .worker import ZshWorker, ZshWorkerDied
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ThreadPoolExecutor
 
 
 class ZshError(RuntimeError):
@@ -23,47 +35,216 @@ class ZshSyntaxError(ZshError):
 
 
 FAKE_ENV = {"SHELL": "/bin/zsh"}
+# The resolved locals of a context without any (never modified)
+_EMPTY_SCOPE: dict[str, str] = {}
+
+
+class _Prefetched(NamedTuple):
+    """A command that was started in the background, along with the inputs it was run with"""
+
+    env: dict[str, str]
+    positional_vars: list[str]
+    # The result of `ZshContext._spawn_zsh`
+    future: Future
+
+
+class _SharedState:
+    """State shared between a context and all of its child contexts"""
+
+    __slots__ = (
+        "worker",
+        "valid_syntax",
+        "stat_cache",
+        "prefetch_workers",
+        "executor",
+        "prefetched",
+        "instrumentation",
+        "memo",
+        "scope_version",
+        "unique_paths",
+    )
+    # The persistent zsh process, or None if every command spawns a fresh process
+    worker: Optional[ZshWorker]
+    # Commands whose syntax has already been validated (by the translator)
+    valid_syntax: set[str]
+    # Used by native [[ ... ]] tests. Cleared whenever zsh runs a command.
+    stat_cache: conditions.StatCache
+    # The maximum number of prefetched commands to run at once (zero disables prefetching)
+    prefetch_workers: int
+    # Runs prefetched commands, or None if it hasn't been started yet (see `start_executor`)
+    executor: Optional[ThreadPoolExecutor]
+    # Prefetched commands that haven't been used yet
+    prefetched: dict[str, _Prefetched]
+    instrumentation: Instrumentation
+    # The results of pure commands (see `ZshContext.zsh`)
+    memo: MemoTable
+    # Incremented whenever any local is assigned (invalidating the cached scopes)
+    scope_version: int
+    # Path variables that never contain duplicates (like zsh's `typeset -U`)
+    unique_paths: frozenset[str]
+
+    def __init__(
+        self,
+        *,
+        persistent_worker: bool = False,
+        prefetch_workers: int = 0,
+        memo_budget: Optional[int] = None,
+        unique_paths: Iterable[str] = (),
+    ):
+        self.worker = ZshWorker() if persistent_worker else None
+        self.valid_syntax = set()
+        self.stat_cache = conditions.StatCache()
+        self.prefetch_workers = prefetch_workers
+        self.executor = None
+        self.prefetched = {}
+        self.instrumentation = Instrumentation()
+        self.scope_version = 0
+        self.memo = MemoTable(default_budget() if memo_budget is None else memo_budget)
+        self.unique_paths = frozenset(unique_paths)
+
+    def start_executor(self) -> Optional[ThreadPoolExecutor]:
+        """The executor for prefetched commands, or None if prefetching is disabled
+
+        The threads are started on first use."""
+        if self.executor is None and self.prefetch_workers > 0:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self.executor = ThreadPoolExecutor(
+                self.prefetch_workers, thread_name_prefix="zsh2xonsh"
+            )
+        return self.executor
+
+    def close(self):
+        if self.executor is not None:
+            for prefetched in self.prefetched.values():
+                prefetched.future.cancel()
+            self.prefetched.clear()
+            self.executor.shutdown(wait=True)
+        if self.worker is not None:
+            self.worker.close()
 
 
 class ZshContext:
-    __slots__ = "_locals", "parent", "_positional_vars"
+    __slots__ = (
+        "_locals",
+        "parent",
+        "_positional_vars",
+        "_shared",
+        "_resolved",
+        "_resolved_base",
+        "_resolved_version",
+    )
     parent: Optional[ZshContext]
-    _locals: dict[str, object]  # A mapping from local variable names to values
+    _locals: dict[str, str]  # A mapping from local variable names to values
     _positional_vars: list[
         str
     ]  # Note: These are seperate from locals because zsh handles $0 $1 $2 specially
-
-    def __init__(self, *, parent: Optional[ZshContext] = None):
+    _shared: _SharedState
+    # The cached result of `_resolved_locals`, or None if it needs to be recomputed
+    _resolved: Optional[dict[str, str]]
+    # The parent's resolved locals that `_resolved` was computed from
+    _resolved_base: Optional[dict[str, str]]
+    # The `scope_version` when `_resolved` was last known to be up to date
+    _resolved_version: int
+
+    def __init__(
+        self,
+        *,
+        parent: Optional[ZshContext] = None,
+        shared: Optional[_SharedState] = None,
+        positional_vars: Optional[list[str]] = None,
+    ):
         self._locals = {}
         self.parent = parent
-        self._positional_vars = []
+        self._positional_vars = positional_vars if positional_vars is not None else []
+        self._resolved = self._resolved_base = None
+        self._resolved_version = -1
+        if shared is None:
+            shared = parent._shared if parent is not None else _SharedState()
+        self._shared = shared
+
+    @property
+    def instrumentation(self) -> Instrumentation:
+        """Records what this context (and its children) spend time on"""
+        return self._shared.instrumentation
+
+    @property
+    def memo(self) -> MemoTable:
+        """The memoized results of pure commands (including the hit and miss counts)"""
+        return self._shared.memo
 
-    @contextmanager
     def begin_function(self, name: str, args: object) -> ZshContext:
+        """Create the context of a function call (used as a context manager)"""
         assert isinstance(name, str)
-        ctx = ZshContext(parent=self)
-        assert not ctx._positional_vars
-        ctx._positional_vars.append(name)  # $0
-        ctx._positional_vars.extend(args)
-        yield ctx
-        ctx._locals.clear()
+        return ZshContext(parent=self, positional_vars=[name, *args])  # $0 is the name
+
+    def __enter__(self) -> ZshContext:
+        return self
+
+    def __exit__(self, *exc_info):
+        self._locals.clear()
+        self._resolved = self._resolved_base = None
 
     def assign_local(self, name: str, value: object):
         assert isinstance(name, str)
         self._locals[name] = str(
             value
         )  # Everything must be normalized to string for zsh :(
+        self._resolved = None
+        self._shared.scope_version += 1
         return value
 
     def zsh_test_command(self, test: str) -> bool:
+        start = perf_counter()
+        status = None
         try:
             self.zsh(test, check=True)
         except ZshSyntaxError:
             raise
         except ZshError as e:
+            status = e.returncode
             return False
         else:
+            status = 0
             return True
+        finally:
+            self.instrumentation.record(
+                "zsh_test_command", start, path="zsh", detail=test, status=status
+            )
+
+    def test_condition(self, test: str) -> bool:
+        """Evaluate a `[[ ... ]]` test
+
+        This is done natively when the test is in the subset supported by `zsh2xonsh.conditions`,
+        otherwise it falls back to `zsh_test_command`."""
+        start = perf_counter()
+        try:
+            res = conditions.evaluate(
+                conditions.parse_test(test),
+                self._param_lookup(),
+                self._shared.stat_cache,
+            )
+        except params.UnsupportedExpansion:
+            return self.zsh_test_command(test)
+        self.instrumentation.record("test_condition", start, path="native", detail=test)
+        return res
+
+    def wrap_builtin(self, func: Callable) -> Callable:
+        """Wrap an extra builtin function, so it can be called by translated code
+
+        The builtin could modify the filesystem (like `mkdir`),
+        so the cached results of file tests are discarded after it runs."""
+        stat_cache = self._shared.stat_cache
+
+        def builtin(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stat_cache.clear()
+
+        builtin.__name__ = getattr(func, "__name__", "builtin")
+        builtin.__wrapped__ = func
+        return builtin
 
     def zsh_impl_complex_alias(self, alias: str) -> Callable:
         """Handle a "complex" alias like `alias foo='echo .*'`
@@ -101,7 +282,158 @@ class ZshContext:
 
     def zsh_expand_quote(self, quoted: str) -> str:
         # NOTE: It's up to the compiler/translator to avoid unessicary calls to `zsh_expand_quote`
-        return self.zsh(f'echo "{quoted}"')
+        #
+        # NOTE: Must be kept in sync with `translate.expand_quote_command`
+        #
+        # Use `print -rn` instead of `echo`, which would interpret escapes (and options)
+        start = perf_counter()
+        try:
+            # Without command substitutions, the output only depends on the parameters
+            pure = (
+                shell.referenced_params(quoted)
+                if "$(" not in quoted and "`" not in quoted
+                else None
+            )
+            return self.zsh(
+                f'print -rn -- "{quoted}"', trim_trailing_newline=False, pure=pure
+            )
+        finally:
+            self.instrumentation.record(
+                "zsh_expand_quote", start, path="zsh", detail=quoted
+            )
+
+    def expand_quote(self, quoted: str) -> str:
+        """Expand the inside of a double-quoted string
+
+        This is done natively when the string is in the subset supported by `zsh2xonsh.params`,
+        otherwise it falls back to `zsh_expand_quote`."""
+        start = perf_counter()
+        try:
+            res = params.expand(params.parse_quoted(quoted), self._param_lookup())
+        except params.UnsupportedExpansion:
+            return self.zsh_expand_quote(quoted)
+        self.instrumentation.record("expand_quote", start, path="native", detail=quoted)
+        return res
+
+    def _param_lookup(self) -> Callable[[str], Optional[str]]:
+        """Create a function that looks up the values of parameters (as zsh would see them)"""
+        resolved_locals = self._resolved_locals()
+        env = xonshi.get_correct_env()
+        positional = self._positional_vars
+
+        def lookup(name: str) -> Optional[str]:
+            if name.isdigit():
+                idx = int(name)
+                return positional[idx] if idx < len(positional) else None
+            try:
+                return resolved_locals[name]
+            except KeyError:
+                pass
+            try:
+                return FAKE_ENV[name]
+            except KeyError:
+                return env.get(name)
+
+        return lookup
+
+    def assume_valid_syntax(self, commands: collections.abc.Iterable[str]):
+        """Skip checking the syntax of the specified commands.
+
+        The translator calls this for commands it has already validated."""
+        self._shared.valid_syntax.update(commands)
+
+    def prefetch(self, commands: collections.abc.Iterable[str]):
+        """Start running the specified commands in the background
+
+        The translator only emits this for commands that are independent
+        of everything between here and where they're actually used.
+        When a command is later run by `zsh`, the prefetched result is used
+        (as long as the environment and positional args are unchanged).
+
+        Does nothing if prefetching is disabled."""
+        shared = self._shared
+        executor = shared.start_executor()
+        if executor is None:
+            return
+        env = self._zsh_env()
+        positional_vars = list(self._positional_vars)
+        for cmd in commands:
+            if cmd in shared.prefetched:
+                continue
+            future = executor.submit(self._run_prefetched, cmd, env)
+            shared.prefetched[cmd] = _Prefetched(env, positional_vars, future)
+
+    def _run_prefetched(self, cmd: str, env: dict) -> tuple[int, str]:
+        self._check_syntax(cmd)
+        return self._spawn_zsh(cmd, env)
+
+    def _take_prefetched(self, cmd: str, env: dict) -> Optional[Future]:
+        try:
+            prefetched = self._shared.prefetched.pop(cmd)
+        except KeyError:
+            return None
+        if (
+            prefetched.env == env
+            and prefetched.positional_vars == self._positional_vars
+        ):
+            return prefetched.future
+        else:
+            # The inputs changed, so the result is useless
+            prefetched.future.cancel()
+            return None
+
+    def assign_batch(self, script: str, targets: tuple[tuple[str, str, bool], ...]):
+        """Run a batch of assignments with a single zsh process, then apply them in order
+
+        The script prints the status and value of each target (both NUL-terminated).
+        A failed command substitution gives `None`, just like `zsh` itself.
+        Each target is `(kind, name, typed)`, where kind is "export" or "local",
+        and `typed` indicates the export should go through `assign_typed_var`."""
+        output = self.zsh(script, check=True, trim_trailing_newline=False)
+        fields = output.split("\0")
+        if fields.pop() != "" or len(fields) != 2 * len(targets):
+            raise ZshError(f"Unexpected output from assignment batch: {output!r}")
+        for (kind, name, typed), status, value in zip(
+            targets, fields[::2], fields[1::2]
+        ):
+            if status != "0":
+                value = None
+            if kind == "local":
+                self.assign_local(name, value)
+            elif typed:
+                self.assign_typed_var(name, value)
+            else:
+                xonshi.assign_env_var(name, value)
+
+    def apply_env_diff(self, script: str):
+        """Run the whole script with a single zsh process, then apply the changes it made
+
+        This is an alternative to translating the script,
+        which only works for scripts that just set variables and aliases.
+        It refuses to run scripts that define functions (raising an `EnvDiffError`).
+
+        Existing typed variables (like $PATH) go through `assign_typed_var`,
+        so their types are preserved."""
+        from .envdiff import capture_env_diff
+
+        env = self._zsh_env()
+        self._shared.stat_cache.clear()
+        diff = capture_env_diff(script, env, self._positional_vars)
+        for name, value in diff.changed_vars.items():
+            try:
+                self.assign_typed_var(name, value)
+            except ZshError:
+                # Too complicated to splice into the existing $PATH, so replace it entirely
+                xonshi.assign_env_var(name, value)
+        for name in diff.removed_vars:
+            xonshi.delete_env_var(name)
+        for name, value in diff.changed_aliases.items():
+            if shell.can_safely_be_split(value):
+                xonshi.assign_alias(name, value.split(" "))
+            else:
+                xonshi.assign_alias(name, self.zsh_impl_complex_alias(value))
+        for name in diff.removed_aliases:
+            xonshi.delete_alias(name)
 
     def assign_typed_var(self, variable_name, new_value):
         """
@@ -130,6 +462,21 @@ class ZshContext:
             new_value, str
         ), f"Expected a string, not a {type(new_value)!r}"
 
+        start = perf_counter()
+        path = None
+        try:
+            path = self._assign_typed_var(variable_name, new_value)
+        except BaseException:
+            path = "error"
+            raise
+        finally:
+            self.instrumentation.record(
+                "assign_typed_var", start, path=path, detail=variable_name
+            )
+
+    def _assign_typed_var(self, variable_name, new_value) -> str:
+        """Returns how the variable was assigned (for instrumentation)"""
+
         def assign_untyped():
             """Fallback to directly assigning as a string"""
             xonshi.assign_env_var(variable_name, new_value)
@@ -144,14 +491,16 @@ class ZshContext:
             #
             # In xonsh, this will correctly initialize $PATH variables to EnvVar
             assign_untyped()
-            return
+            return "untyped"
         if old_value.kind is None:
             # If unable to detect type of the previous value,
             # fallback to setting as string
             assign_untyped()
+            return "untyped"
         elif old_value.kind == xonshi.VarKind.PATH:
             # Special handling for path variables
             self._assign_path_var(variable_name, old_value.value, new_value)
+            return "path"
         else:
             # Be careful to preserve the original type of the variable wherever possible
             try:
@@ -163,61 +512,155 @@ class ZshContext:
                 # but is better than ignoring the assignment completely
                 # or throwing an error
                 assign_untyped()
-                return
+                return "untyped"
             xonshi.assign_env_var(variable_name, typed_value)
+            return "typed"
 
     def _assign_path_var(self, var_name: str, target, new_path: str):
+        start = perf_counter()
+        try:
+            self._splice_path_var(var_name, target, new_path)
+        finally:
+            self.instrumentation.record("assign_path_var", start, detail=var_name)
+
+    def _splice_path_var(self, var_name: str, target, new_path: str):
         assert isinstance(target, collections.abc.MutableSequence)
-        # Expand the old path variable as a string
-        old_path = self.zsh_expand_quote(f"${var_name}")
+        # The old value as a string (just like zsh sees it)
+        old_path = ":".join(map(str, target))
         # We don't support removal. Only addition at the beginning (prefix) or end (suffix)
         #
         # This is a poor man's diff
-        if old_path not in new_path:
+        # NOTE: An empty path is treated as a suffix (so `/x${PATH+:$PATH}` is just `/x`)
+        offset = new_path.find(old_path) if old_path else len(new_path)
+        if offset < 0:
             raise ZshError(
                 f"Changes between old and new ${var_name} are too complicated: {old_path!r} -> {new_path!r}"
             )
-        offset = new_path.find(old_path)
         prefix = new_path[:offset]
         suffix = new_path[offset + len(old_path) :]
         if prefix:
-            preifxed_parts = prefix.split(":")
-            if preifxed_parts[-1] == "":
-                preifxed_parts.pop()
+            prefixed_parts = prefix.split(":")
+            if prefixed_parts[-1] == "":
+                prefixed_parts.pop()
         else:
-            preifxed_parts = []
-        for part in reversed(preifxed_parts):
-            target.insert(0, part)
+            prefixed_parts = []
         if suffix:
             suffixed_parts = suffix.split(":")
             if suffixed_parts[0] == "":
                 suffixed_parts.pop(0)
         else:
             suffixed_parts = []
-        for part in suffixed_parts:
-            target.append(part)
+        self._add_path_entries(var_name, target, prefixed_parts, suffixed_parts)
+
+    def _add_path_entries(
+        self, var_name: str, target, prefix: list[str], suffix: list[str]
+    ):
+        if var_name in self._shared.unique_paths:
+            # Keep the first occurrence of each entry
+            seen = set()
+            entries = [
+                entry
+                for entry in itertools.chain(prefix, target, suffix)
+                if not (entry in seen or seen.add(entry))
+            ]
+            if entries != list(target):
+                target[:] = entries
+        else:
+            # NOTE: Splice all the entries at once (inserting one-by-one is quadratic)
+            if prefix:
+                target[0:0] = prefix
+            if suffix:
+                target.extend(suffix)
+        # We modified the variable in-place
+        xonshi.invalidate_env(var_name)
+
+    def extend_path_var(
+        self, var_name: str, prefix: list[str], suffix: list[str], quoted: str
+    ):
+        """Add entries to the start and end of a path variable
+
+        The translator emits this for idioms like `export PATH="/opt/bin${PATH+:$PATH}"`,
+        with the entries already split (see `translate.match_path_update`).
+        Unless the variable is a non-empty path list,
+        this falls back to `assign_typed_var` with the expanded `quoted` string."""
+        start = perf_counter()
+        try:
+            old_value = xonshi.get_typed_env_var(var_name, allow_unknown_type=True)
+        except KeyError:
+            old_value = None
+        if (
+            old_value is None
+            or old_value.kind != xonshi.VarKind.PATH
+            or not old_value.value
+        ):
+            self.assign_typed_var(var_name, self.expand_quote(quoted))
+            return
+        self._add_path_entries(var_name, old_value.value, prefix, suffix)
+        self.instrumentation.record(
+            "extend_path_var", start, path="native", detail=var_name
+        )
 
     def _check_syntax(self, cmd):
+        instrumentation = self.instrumentation
+        start = perf_counter()
+        if cmd in self._shared.valid_syntax:
+            instrumentation.record("check_syntax", start, path="cache", detail=cmd)
+            return
+        worker = self._shared.worker
+        if worker is not None and worker.alive:
+            try:
+                reason = worker.check_syntax(cmd, self._zsh_env())
+            except ZshWorkerDied:
+                pass  # Fallback to spawning a fresh process
+            else:
+                instrumentation.record(
+                    "check_syntax",
+                    start,
+                    path="worker",
+                    detail=cmd,
+                    status=0 if reason is None else 1,
+                )
+                if reason is not None:
+                    raise ZshSyntaxError(f"Invalid `zsh` command {cmd!r}: {reason}")
+                return
+        from subprocess import DEVNULL, PIPE, CalledProcessError, run
+
+        status = 0
         try:
             run(
-                ["zsh", "--no-exec", "-c", cmd],
+                [shell.zsh_executable(), "--no-exec", "-c", cmd],
                 check=True,
                 stderr=PIPE,
                 stdout=DEVNULL,
                 encoding="utf8",
             )
         except CalledProcessError as e:
+            status = e.returncode
             # Only reason this can fail is if syntax is invalid
             reason = e.stderr.strip()
-            raise ZshSyntaxError("Invalid `zsh` command {cmd!r}: {reason}") from None
+            raise ZshSyntaxError(f"Invalid `zsh` command {cmd!r}: {reason}") from None
+        finally:
+            instrumentation.record(
+                "check_syntax", start, path="spawn", detail=cmd, status=status
+            )
 
-    def _resolved_locals(self) -> dict:
-        if self.parent is not None:
-            resolved = self.parent._resolved_locals()
-        else:
-            resolved = {}
-        # Inner locals override outer locals
-        resolved.update(self._locals)
+    def _resolved_locals(self) -> dict[str, str]:
+        """All the locals visible from this context (which must not be modified)
+
+        This is cached until `assign_local` is called (on this context or one of its parents).
+        A context without any locals shares the result of its parent."""
+        version = self._shared.scope_version
+        resolved = self._resolved
+        if resolved is not None and self._resolved_version == version:
+            return resolved
+        parent = self.parent
+        base = parent._resolved_locals() if parent is not None else _EMPTY_SCOPE
+        if resolved is None or self._resolved_base is not base:
+            # Inner locals override outer locals
+            resolved = {**base, **self._locals} if self._locals else base
+            self._resolved = resolved
+            self._resolved_base = base
+        self._resolved_version = version
         return resolved
 
     def zsh(
@@ -228,43 +671,160 @@ class ZshContext:
         check=False,
         pipe=True,
         trim_trailing_newline=True,
+        pure: Optional[collections.abc.Iterable[str]] = None,
     ) -> str:
-        self._check_syntax(cmd)  # Verify its valid syntax
+        """Run the command in zsh, returning its output
+
+        If `pure` is specified, the command is assumed to only depend on its text,
+        the positional args and the specified parameters (plus $PATH).
+        The results of pure commands are memoized."""
+        start = perf_counter()
+        env = self._zsh_env(inherit_env=inherit_env)
+        memo_key = None
+        if pure is not None and pipe and self._shared.memo.budget > 0:
+            memo_key = MemoTable.key(cmd, self._positional_vars, frozenset(pure), env)
+            s = self._shared.memo.get(memo_key)
+            if s is not None:
+                prefetched = self._take_prefetched(cmd, env)
+                if prefetched is not None:
+                    prefetched.cancel()
+                self.instrumentation.record("zsh", start, path="memo", detail=cmd, status=0)
+                if trim_trailing_newline and s and s[-1] == "\n":
+                    s = s[:-1]
+                return s
+        prefetched = self._take_prefetched(cmd, env) if pipe else None
+        if prefetched is None:
+            self._check_syntax(cmd)  # Verify its valid syntax
+        # The command could modify the filesystem
+        self._shared.stat_cache.clear()
+        worker = self._shared.worker
+        path = returncode = None
+        try:
+            if prefetched is not None:
+                path = "prefetch"
+                # NOTE: This also raises any errors (including syntax errors)
+                returncode, s = prefetched.result()
+            elif pipe and worker is not None and worker.alive:
+                try:
+                    path = "worker"
+                    returncode, s = worker.run(cmd, self._positional_vars, env)
+                except ZshWorkerDied:
+                    path = "spawn"
+                    returncode, s = self._spawn_zsh(cmd, env, pipe=pipe)
+            else:
+                path = "spawn"
+                returncode, s = self._spawn_zsh(cmd, env, pipe=pipe)
+        finally:
+            self.instrumentation.record(
+                "zsh",
+                start,
+                path=path,
+                detail=cmd,
+                status=returncode,
+                env_size=len(env),
+            )
+        if returncode != 0:
+            if check:
+                raise ZshError(f"Failed to execute {cmd!r}", returncode=returncode)
+            else:
+                # TODO: Is it a good idea to swallow errors like this?
+                return None
+        if memo_key is not None:
+            self._shared.memo.put(memo_key, s)
+        if trim_trailing_newline and s and s[-1] == "\n":
+            s = s[:-1]
+        return s
+
+    def _zsh_env(self, *, inherit_env=True) -> dict:
         # NOTE: Use xonsh's environment
         #
         # This avoids issue with `os.environ` caching
-        env = xonshi.get_correct_env() if inherit_env else {}
-        env.update(FAKE_ENV)
+        if inherit_env:
+            env = {**xonshi.get_correct_env(), **FAKE_ENV}
+        else:
+            env = FAKE_ENV.copy()
         # Locals override globals
         env.update(self._resolved_locals())
+        return env
+
+    def _spawn_zsh(self, cmd: str, env: dict, *, pipe=True) -> tuple[int, str]:
+        # NOTE: Inherit stderr. This matches behavior of zsh's $(...)
+        #
+        # Per the zsh docs, $0 $1 $2 are specified after the literal `-c`
+        # You can test this with `zsh -c 'echo $1' foo bar` -> bar
+        from subprocess import PIPE, run
+
+        res = run(
+            [shell.zsh_executable(), "-c", cmd, *self._positional_vars],
+            env=env,
+            stdout=PIPE if pipe else None,
+            encoding="utf-8",
+        )
+        return res.returncode, res.stdout
+
+
+def _default_prefetch_workers() -> int:
+    setting = os.environ.get("ZSH2XONSH_PARALLEL", "")
+    if setting:
         try:
-            # NOTE: Inherit stderr. This matches behavior of zsh's $(...)
-            #
-            # Per the zsh docs, $0 $1 $2 are specified after the literal `-c`
-            # You can test this with `zsh -c 'echo $1' foo bar` -> bar
-            s = run(
-                ["zsh", "-c", cmd, *self._positional_vars],
-                env=env,
-                check=True,
-                stdout=PIPE if pipe else None,
-                encoding="utf-8",
-            ).stdout
-            if trim_trailing_newline and s and s[-1] == "\n":
-                s = s[:-1]
-            return s
-        except CalledProcessError as cause:
-            if check:
-                raise ZshError(
-                    "Failed to execute {cmd!r}", returncode=cause.returncode
-                ) from cause
-            else:
-                # TODO: Is it a good idea to swallow errors like this?
-                return None
+            return max(int(setting), 0)
+        except ValueError:
+            pass
+    return min(8, os.cpu_count() or 1)
 
 
 @contextmanager
-def init_context() -> ZshContext:
-    yield ZshContext()
+def init_context(
+    *,
+    persistent_worker: Optional[bool] = None,
+    parallel: Optional[int] = None,
+    unique_paths: Optional[Iterable[str]] = None,
+) -> ZshContext:
+    """Initialize a new top-level context
+
+    If `persistent_worker` is true, commands are sent to a single long-lived
+    zsh process instead of spawning a fresh process for each one.
+    This falls back to spawning processes if the worker dies.
+
+    By default, this is controlled by the `ZSH2XONSH_PERSISTENT_WORKER` environment variable.
+
+    The `parallel` argument is the maximum number of prefetched commands to run at once
+    (see `ZshContext.prefetch`), where zero disables prefetching entirely.
+    By default, this is controlled by the `ZSH2XONSH_PARALLEL` environment variable.
+
+    The `unique_paths` are path variables that never contain duplicate entries,
+    like zsh's `typeset -U` (so prepending an existing entry moves it to the front).
+    By default, these are the (colon-separated) names in `ZSH2XONSH_UNIQUE_PATHS`.
+
+    If the `ZSH2XONSH_TRACE` environment variable is set to a file,
+    then a Chrome trace of the context's operations is appended to it (see `zsh2xonsh.runtime.instrument`).
+    """
+    if persistent_worker is None:
+        persistent_worker = os.environ.get("ZSH2XONSH_PERSISTENT_WORKER", "") not in (
+            "",
+            "0",
+        )
+    if parallel is None:
+        parallel = _default_prefetch_workers()
+    if unique_paths is None:
+        unique_paths = os.environ.get("ZSH2XONSH_UNIQUE_PATHS", "").split(":")
+        unique_paths = [name for name in unique_paths if name]
+    shared = _SharedState(
+        persistent_worker=persistent_worker,
+        prefetch_workers=parallel,
+        unique_paths=unique_paths,
+    )
+    trace_file = os.environ.get("ZSH2XONSH_TRACE")
+    trace = None
+    if trace_file:
+        trace = ChromeTrace()
+        shared.instrumentation.add_listener(trace)
+    try:
+        yield ZshContext(shared=shared)
+    finally:
+        shared.close()
+        if trace is not None:
+            trace.save(trace_file)
 
 
 # TODO: This could use some work
@@ -285,4 +845,13 @@ def quote_into_shell_string(s):
     return "".join(res)
 
 
-__all__ = ["init", "ZshContext", "ZshError"]
+def __getattr__(name: str):
+    # NOTE: The env-diff mode is rarely used, so it's imported lazily
+    if name == "EnvDiffError":
+        from .envdiff import EnvDiffError
+
+        return EnvDiffError
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ["init", "ZshContext", "ZshError", "EnvDiffError"]
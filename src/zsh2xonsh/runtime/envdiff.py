@@ -0,0 +1,179 @@
+"""Run a whole script in a single zsh process, and capture the changes it makes.
+
+This is the implementation of the "env-diff" mode.
+Instead of translating the script, the whole thing is sourced by zsh
+and the resulting changes to the environment & aliases are applied to xonsh.
+
+This is only correct for scripts that just set variables and aliases.
+Anything that xonsh would need to call later (like functions) can't be transferred,
+so scripts that declare functions are refused before they are run (see `declared_functions`).
+As a fallback, the capture also fails if the script leaves any new functions behind.
+
+The dumps are written to files in a temporary directory (given by `$__ZSH2XONSH_DUMP`),
+so the script's own output is unaffected.
+"""
+from __future__ import annotations
+
+import os
+import re
+import shlex
+import tempfile
+from subprocess import run
+from typing import NamedTuple, Optional
+
+from .. import shell
+
+# Variables that zsh changes by itself (or that don't make sense to transfer)
+IGNORED_VARS = frozenset({"_", "PWD", "OLDPWD", "SHLVL", "__ZSH2XONSH_DUMP"})
+
+_DRIVER = r"""
+__z2x_dump=$__ZSH2XONSH_DUMP
+unset __ZSH2XONSH_DUMP
+IFS= read -r -d '' __z2x_script
+if ! { functions[__z2x_syntax_check]=$__z2x_script } 2>"$__z2x_dump/syntax"; then
+    exit 2
+fi
+unfunction __z2x_syntax_check
+env -0 >"$__z2x_dump/env.before"
+alias -rL >"$__z2x_dump/aliases.before"
+__z2x_functions=(${(k)functions})
+eval "$__z2x_script"
+env -0 >"$__z2x_dump/env.after"
+alias -rL >"$__z2x_dump/aliases.after"
+__z2x_new_functions=(${(k)functions})
+printf '%s\0' ${__z2x_new_functions:|__z2x_functions} >"$__z2x_dump/functions"
+"""
+
+
+class EnvDiffError(RuntimeError):
+    """Indicates the script can't be run in env-diff mode"""
+
+
+class EnvDiff(NamedTuple):
+    changed_vars: dict[str, str]
+    removed_vars: list[str]
+    changed_aliases: dict[str, str]
+    removed_aliases: list[str]
+
+
+def _parse_env(data: str) -> dict[str, str]:
+    res = {}
+    for entry in data.split("\0"):
+        name, sep, value = entry.partition("=")
+        if sep and name not in IGNORED_VARS:
+            res[name] = value
+    return res
+
+
+# The forms of quoting used by `alias -L` (other than `$'...'`, which we don't support)
+_ALIAS_WORD_PATTERN = re.compile(r"(?:'[^']*'|\\.|[^\s'\\$])+")
+
+
+def _parse_aliases(data: str) -> dict[str, str]:
+    """Parse the output of `alias -rL`"""
+    res = {}
+    for line in data.splitlines():
+        if _ALIAS_WORD_PATTERN.sub("", line).strip():
+            # Something like `alias nl=$'\n'`
+            words = None
+        else:
+            words = shlex.split(line)
+        if words and words[1:2] == ["--"]:
+            del words[1]
+        if not words or len(words) != 2 or words[0] != "alias" or "=" not in words[1]:
+            raise EnvDiffError(f"Unable to parse alias definition: {line!r}")
+        name, _, value = words[1].partition("=")
+        res[name] = value
+    return res
+
+
+# A function declaration at the start of a line, like `function foo` or `foo() {`
+_FUNCTION_PATTERN = re.compile(
+    r"^[^\S\n]*(?:function[^\S\n]+([\w.:-]+)|([\w.:-]+)[^\S\n]*\([^\S\n]*\))", re.M
+)
+
+
+def declared_functions(script: str) -> list[str]:
+    """The names of the functions declared by the script, found without running it
+
+    This uses the translator's parser when it supports the script.
+    Otherwise, this conservatively looks for lines that start like a function declaration."""
+    from ..ast import FunctionDeclaration, walk
+    from ..parser import ShellParser, TranslationError
+
+    try:
+        stmts = list(ShellParser(script).statements())
+    except TranslationError:
+        return [
+            m.group(1) or m.group(2) for m in _FUNCTION_PATTERN.finditer(script)
+        ]
+    return [node.name for node in walk(stmts) if isinstance(node, FunctionDeclaration)]
+
+
+def _refuse_functions(names: list[str]):
+    raise EnvDiffError(
+        "The script defines functions, which xonsh can't call after zsh exits: "
+        + ", ".join(sorted(set(names)))
+        + ". Translate it normally instead."
+    )
+
+
+def _diff(before: dict[str, str], after: dict[str, str]):
+    changed = {
+        name: value for name, value in after.items() if before.get(name) != value
+    }
+    removed = [name for name in before if name not in after]
+    return changed, removed
+
+
+def _read(directory: str, name: str) -> Optional[str]:
+    try:
+        with open(os.path.join(directory, name), "rt", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def capture_env_diff(
+    script: str, env: dict[str, str], positional_vars: list[str]
+) -> EnvDiff:
+    """Run the script with a single zsh process, returning the changes it made
+
+    Raises `EnvDiffError` if the script can't be run in this mode
+    (including if its syntax is invalid).
+    Scripts that declare functions are refused without running them."""
+    assert "\0" not in script
+    declared = declared_functions(script)
+    if declared:
+        _refuse_functions(declared)
+    with tempfile.TemporaryDirectory(prefix="zsh2xonsh-") as dump:
+        # NOTE: Inherit stdout & stderr, just like sourcing the script would
+        res = run(
+            [shell.zsh_executable(), "-c", _DRIVER, *positional_vars],
+            input=script,
+            env={**env, "__ZSH2XONSH_DUMP": dump},
+            encoding="utf-8",
+        )
+        if res.returncode == 2 and _read(dump, "env.before") is None:
+            reason = (_read(dump, "syntax") or "").strip()
+            raise EnvDiffError(f"Invalid syntax: {reason}")
+        new_functions = _read(dump, "functions")
+        if new_functions is None:
+            raise EnvDiffError(
+                f"The script exited early (with status {res.returncode}), so its changes are unknown"
+            )
+        new_functions = [name for name in new_functions.split("\0") if name]
+        if new_functions:
+            # Something like `eval "$(nvm init)"` (which isn't visible before running it)
+            _refuse_functions(new_functions)
+        changed_vars, removed_vars = _diff(
+            _parse_env(_read(dump, "env.before")), _parse_env(_read(dump, "env.after"))
+        )
+        changed_aliases, removed_aliases = _diff(
+            _parse_aliases(_read(dump, "aliases.before")),
+            _parse_aliases(_read(dump, "aliases.after")),
+        )
+    return EnvDiff(changed_vars, removed_vars, changed_aliases, removed_aliases)
+
+
+__all__ = ["EnvDiff", "EnvDiffError", "declared_functions", "capture_env_diff"]
@@ -0,0 +1,181 @@
+"""Instrumentation of the runtime (where does the time go?)
+
+Every interesting `ZshContext` operation records an `Event`,
+with its duration and how it was handled (the "path"),
+for example whether a fast path or cache was used, or a zsh process was spawned.
+
+Aggregate counters are always kept (which is cheap enough to leave on).
+Listeners can be added to see the individual events.
+
+If `ZSH2XONSH_TRACE` is set to a file, then the events are written there
+in Chrome's trace-event format (viewable in `chrome://tracing` or Perfetto).
+Events are appended, so a file can hold traces from many contexts (and processes).
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+
+class Event(NamedTuple):
+    # The operation (usually the name of the `ZshContext` method)
+    name: str
+    # The start time (from `time.perf_counter`)
+    start: float
+    duration: float
+    # How the operation was handled (like "native", "cache", "worker" or "spawn")
+    path: Optional[str]
+    # The command (or variable) involved
+    detail: Optional[str]
+    # The exit status (if zsh was run), or None if unknown
+    status: Optional[int]
+    # The number of environment variables passed to zsh
+    env_size: Optional[int]
+    thread_id: int
+
+
+class Counter:
+    __slots__ = ("count", "total", "max")
+    count: int
+    # The total duration (in seconds)
+    total: float
+    max: float
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return f"Counter(count={self.count}, total={self.total:.6f}, max={self.max:.6f})"
+
+
+class Instrumentation:
+    """Records the events of a context (and all its children)"""
+
+    __slots__ = ("counters", "_listeners", "_lock")
+    # The aggregate counters, for each (name, path)
+    counters: dict[tuple[str, Optional[str]], Counter]
+    _listeners: list[Callable[[Event], None]]
+
+    def __init__(self):
+        self.counters = {}
+        self._listeners = []
+        # NOTE: Prefetched commands are recorded from other threads
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener: Callable[[Event], None]):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[Event], None]):
+        self._listeners.remove(listener)
+
+    def record(
+        self,
+        name: str,
+        start: float,
+        *,
+        path: Optional[str] = None,
+        detail: Optional[str] = None,
+        status: Optional[int] = None,
+        env_size: Optional[int] = None,
+    ):
+        """Record an operation that started at `start` (from `time.perf_counter`) and just finished"""
+        duration = time.perf_counter() - start
+        key = (name, path)
+        with self._lock:
+            counter = self.counters.get(key)
+            if counter is None:
+                counter = self.counters[key] = Counter()
+            counter.count += 1
+            counter.total += duration
+            if duration > counter.max:
+                counter.max = duration
+        if self._listeners:
+            event = Event(
+                name,
+                start,
+                duration,
+                path,
+                detail,
+                status,
+                env_size,
+                threading.get_ident(),
+            )
+            for listener in self._listeners:
+                listener(event)
+
+    def summary(self) -> str:
+        """A table of the counters (slowest first)"""
+        lines = [f"{'operation':<32} {'count':>8} {'total ms':>10} {'max ms':>10}"]
+        with self._lock:
+            items = sorted(self.counters.items(), key=lambda item: -item[1].total)
+            for (name, path), counter in items:
+                label = f"{name} ({path})" if path is not None else name
+                lines.append(
+                    f"{label:<32} {counter.count:>8} {counter.total * 1e3:>10.3f} {counter.max * 1e3:>10.3f}"
+                )
+        return "\n".join(lines)
+
+
+class ChromeTrace:
+    """Collects events in Chrome's trace-event format (as "complete" events)
+
+    Use as a listener, then call `save` to append them to a file."""
+
+    __slots__ = ("events", "_clock_offset")
+    events: list[dict]
+
+    def __init__(self):
+        self.events = []
+        # Converts `perf_counter` timestamps into wall clock time, so traces from different processes line up
+        self._clock_offset = time.time() - time.perf_counter()
+
+    def __call__(self, event: Event):
+        args = {}
+        if event.path is not None:
+            args["path"] = event.path
+        if event.detail is not None:
+            args["detail"] = event.detail
+        if event.status is not None:
+            args["status"] = event.status
+        if event.env_size is not None:
+            args["env_size"] = event.env_size
+        self.events.append(
+            {
+                "name": event.name,
+                "cat": event.path or "zsh2xonsh",
+                "ph": "X",
+                "ts": (event.start + self._clock_offset) * 1e6,
+                "dur": event.duration * 1e6,
+                "pid": os.getpid(),
+                "tid": event.thread_id,
+                "args": args,
+            }
+        )
+
+    def save(self, path: str):
+        """Append the events to the file, using the JSON array format
+
+        The closing `]` is optional in this format, so appending keeps the file valid."""
+        if not self.events:
+            return
+        import json
+
+        data = "".join(json.dumps(event) + ",\n" for event in self.events)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            if os.fstat(fd).st_size == 0:
+                data = "[\n" + data
+            # NOTE: A single write (usually), so concurrent processes don't interleave
+            data = data.encode("utf-8")
+            while data:
+                data = data[os.write(fd, data) :]
+        finally:
+            os.close(fd)
+        self.events.clear()
+
+
+__all__ = ["ChromeTrace", "Counter", "Event", "Instrumentation"]
@@ -0,0 +1,107 @@
+"""Memoization of pure zsh commands
+
+A command is pure if its output only depends on its text, the positional args,
+and the parameters it references (see `shell.referenced_params`).
+The translator marks commands as pure (with the `# zsh2xonsh: pure` pragma),
+and the runtime does the same for simple quote expansions.
+
+Entries are evicted in LRU order, to keep the total size under a byte budget.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+DEFAULT_BUDGET = 1 << 20
+
+
+def default_budget() -> int:
+    """The budget from `ZSH2XONSH_MEMO_BYTES` (zero disables memoization)"""
+    try:
+        return max(int(os.environ["ZSH2XONSH_MEMO_BYTES"]), 0)
+    except (KeyError, ValueError):
+        return DEFAULT_BUDGET
+
+
+def _entry_size(key: tuple, value: str) -> int:
+    # NOTE: This is approximate (it ignores the overhead of python objects)
+    cmd, positional, params = key
+    return (
+        len(cmd)
+        + sum(map(len, positional))
+        + sum(len(name) + len(value or "") for name, value in params)
+        + len(value)
+    )
+
+
+class MemoTable:
+    __slots__ = ("budget", "size", "hits", "misses", "evictions", "_entries", "_lock")
+    # The maximum total size (in bytes) of all the entries
+    budget: int
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+    _entries: OrderedDict[Hashable, tuple[str, int]]
+
+    def __init__(self, budget: int = DEFAULT_BUDGET):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(
+        cmd: str, positional_vars: list[str], params: frozenset[str], env: dict
+    ) -> tuple:
+        # NOTE: $PATH determines which executables are run
+        names = sorted(params | {"PATH"})
+        return (cmd, tuple(positional_vars), tuple((name, env.get(name)) for name in names))
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: tuple, value: str):
+        size = _entry_size(key, value)
+        if size > self.budget:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.budget:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return (
+            f"MemoTable(entries={len(self)}, size={self.size}, budget={self.budget}, "
+            f"hits={self.hits}, misses={self.misses}, evictions={self.evictions})"
+        )
+
+
+__all__ = ["MemoTable", "default_budget"]
@@ -0,0 +1,204 @@
+"""A persistent `zsh` coprocess, used to avoid a fork/exec per expansion.
+
+The worker is a single long-lived `zsh -c` process running a small driver loop.
+Requests are sent over its stdin, and responses are read back from its stdout.
+
+Each request is a sequence of NUL-terminated fields:
+1. The request kind (`run` or `check`)
+2. The command text
+3. The value of `$0`, followed by the number of positional args and the args themselves
+4. The number of changed environment variables, followed by (key, value) pairs
+5. The number of removed environment variables, followed by their names
+
+The environment is sent as a diff against the environment the worker was started with.
+This means variables that zsh itself adjusts on startup (like $SHLVL)
+are treated the same way as they would be with a fresh process.
+
+Each response is `<exit status>:<length in bytes>:<output>`.
+
+Every command is executed in a subshell (a fork, but not an exec),
+so commands can't interfere with each other or with the driver loop.
+
+There are some small differences from spawning a fresh process each time:
+1. Startup files (like ~/.zshenv) are only run once, when the worker is started
+2. The command's stdin is /dev/null instead of being inherited
+"""
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING, Optional
+
+from .. import shell
+
+if TYPE_CHECKING:
+    from subprocess import Popen
+
+_DRIVER = r"""
+__z2x_read_field() {
+    IFS= read -r -d $'\0' "$1"
+}
+__z2x_read_list() {
+    local __z2x_count __z2x_item __z2x_i
+    __z2x_read_field __z2x_count || return 1
+    set -A "$1"
+    for (( __z2x_i = 0; __z2x_i < __z2x_count; __z2x_i++ )); do
+        __z2x_read_field __z2x_item || return 1
+        set -A "$1" "${(@P)1}" "$__z2x_item"
+    done
+}
+__z2x_respond() {
+    local __z2x_len
+    () { setopt local_options no_multibyte; __z2x_len=${#__z2x_out} }
+    print -rn -- "$1:$__z2x_len:$__z2x_out"
+}
+while __z2x_read_field __z2x_kind; do
+    __z2x_read_field __z2x_cmd || exit 1
+    __z2x_read_field __z2x_argzero || exit 1
+    __z2x_read_list __z2x_args || exit 1
+    __z2x_read_list __z2x_set || exit 1
+    __z2x_read_list __z2x_unset || exit 1
+    if [[ $__z2x_kind == check ]]; then
+        __z2x_out=$( { functions[__z2x_syntax_check]=$__z2x_cmd } 2>&1 )
+        __z2x_respond $?
+        continue
+    fi
+    __z2x_out=$(
+        for __z2x_key __z2x_value in "${__z2x_set[@]}"; do
+            export "$__z2x_key=$__z2x_value"
+        done
+        (( ${#__z2x_unset} )) && unset -- "${__z2x_unset[@]}"
+        0=$__z2x_argzero
+        set -- "${__z2x_args[@]}"
+        ( eval "$__z2x_cmd" ) </dev/null
+        __z2x_status=$?
+        print -rn -- x
+        exit $__z2x_status
+    )
+    __z2x_status=$?
+    __z2x_out=${__z2x_out%x}
+    __z2x_respond $__z2x_status
+done
+"""
+
+
+class ZshWorkerDied(RuntimeError):
+    """Indicates the worker process has died (or was never started)
+
+    Callers are expected to fallback to spawning a fresh process."""
+
+
+def _encode_fields(fields) -> bytes:
+    return b"".join(str(field).encode("utf-8") + b"\0" for field in fields)
+
+
+class ZshWorker:
+    """A persistent zsh process that executes commands on request.
+
+    All methods are thread-safe (requests are serialized)."""
+
+    __slots__ = ("_proc", "_base_env", "_lock", "alive")
+    _proc: Optional[Popen]
+    _base_env: dict[str, str]
+    alive: bool
+
+    def __init__(self):
+        self._proc = None
+        self._base_env = {}
+        self._lock = threading.Lock()
+        self.alive = True
+
+    def _ensure_started(self, env: dict[str, str]) -> Popen:
+        if self._proc is None:
+            # NOTE: Imported lazily, to keep importing the runtime fast
+            from subprocess import PIPE, Popen
+
+            try:
+                self._proc = Popen(
+                    [shell.zsh_executable(), "-c", _DRIVER],
+                    stdin=PIPE,
+                    stdout=PIPE,
+                    env=env,
+                )
+            except OSError as cause:
+                self.alive = False
+                raise ZshWorkerDied("Unable to start zsh worker") from cause
+            self._base_env = dict(env)
+        return self._proc
+
+    def _request(
+        self, kind: str, cmd: str, argzero: str, args: list[str], env: dict[str, str]
+    ) -> tuple[int, str]:
+        if not self.alive:
+            raise ZshWorkerDied("The zsh worker has already died")
+        with self._lock:
+            proc = self._ensure_started(env)
+            base = self._base_env
+            changed = [
+                item
+                for key, value in env.items()
+                if base.get(key) != value
+                for item in (key, value)
+            ]
+            removed = [key for key in base if key not in env]
+            fields = [kind, cmd, argzero, len(args), *args]
+            fields.extend((len(changed), *changed, len(removed), *removed))
+            try:
+                proc.stdin.write(_encode_fields(fields))
+                proc.stdin.flush()
+                status = self._read_until(b":")
+                length = self._read_until(b":")
+                output = proc.stdout.read(int(length))
+                if len(output) != int(length):
+                    raise EOFError("Truncated response")
+            except (OSError, EOFError, ValueError) as cause:
+                self._kill()
+                raise ZshWorkerDied("The zsh worker died unexpectedly") from cause
+        return int(status), output.decode("utf-8")
+
+    def _read_until(self, delim: bytes) -> bytes:
+        res = bytearray()
+        while (b := self._proc.stdout.read(1)) != delim:
+            if not b:
+                raise EOFError("Worker closed its output")
+            res.extend(b)
+        return bytes(res)
+
+    def run(
+        self, cmd: str, positional_vars: list[str], env: dict[str, str]
+    ) -> tuple[int, str]:
+        """Run the specified command, returning its exit status and output
+
+        The positional vars are `[$0, $1, $2, ...]`, like for `zsh -c`.
+
+        Raises ZshWorkerDied if the worker is no longer usable."""
+        if positional_vars:
+            argzero, *args = positional_vars
+        else:
+            argzero, args = "zsh", []
+        return self._request("run", cmd, argzero, args, env)
+
+    def check_syntax(self, cmd: str, env: dict[str, str]) -> Optional[str]:
+        """Check the syntax of the specified command (without running it)
+
+        Returns the error message if it is invalid, or None if it is valid."""
+        status, output = self._request("check", cmd, "zsh", [], env)
+        return output.strip() if status != 0 else None
+
+    def _kill(self):
+        self.alive = False
+        proc, self._proc = self._proc, None
+        if proc is not None:
+            proc.kill()
+            proc.wait()
+
+    def close(self):
+        with self._lock:
+            proc, self._proc = self._proc, None
+            self.alive = False
+        if proc is not None:
+            proc.stdin.close()
+            proc.wait()
+            proc.stdout.close()
+
+
+__all__ = ["ZshWorker", "ZshWorkerDied"]
@@ -7,50 +7,68 @@ xonsh is not detected (useful for testing)
 """
 from __future__ import annotations
 
+import collections.abc
 import os
 import sys
-from dataclasses import dataclass
-from enum import Enum
-from typing import Optional
-
-if "xonsh" in sys.modules:
-    import xonsh
-    import xonsh.environ
-    import xonsh.tools
-else:
-    if "pytest" not in sys.modules:
-        print(
-            "WARNING: Could not detect `xonsh` support (enabling fallback)",
-            file=sys.stderr,
-        )
-    xonsh = None
-
-
-class VarKind(Enum):
-    STRING = str
-    BOOLEAN = bool
-    INTEGER = int
-    PY_NONE = type(None)
-    PATH = "EnvPath"
+from typing import Mapping, Optional
+
+# NOTE: This module is imported by generated code on every shell startup,
+# so xonsh is resolved lazily (on first use) instead of on import.
+_UNRESOLVED = object()
+_xsh = _UNRESOLVED
+
+
+def _session():
+    """xonsh's `XSH` session, or None if xonsh isn't present (printing a warning the first time)"""
+    global _xsh
+    xsh = _xsh
+    if xsh is _UNRESOLVED:
+        if "xonsh" in sys.modules:
+            from xonsh.built_ins import XSH as xsh
+        else:
+            if "pytest" not in sys.modules:
+                print(
+                    "WARNING: Could not detect `xonsh` support (enabling fallback)",
+                    file=sys.stderr,
+                )
+            xsh = None
+        _xsh = xsh
+    return xsh
+
+
+class VarKind:
+    """The type of an environment variable
+
+    This is like an `Enum` (with the members STRING, BOOLEAN, INTEGER, PY_NONE and PATH),
+    but without the cost of creating an enum on import."""
+
+    __slots__ = ("name", "value")
+    name: str
+    # The python type, or the name of xonsh's type
+    value: object
+
+    def __init__(self, name: str, value: object):
+        self.name = name
+        self.value = value
 
     def parse(self, text: str) -> TypedVar:
-        if self == VarKind.STRING:
+        if self is VarKind.STRING:
             value = text
-        elif self == VarKind.BOOLEAN:
+        elif self is VarKind.BOOLEAN:
             if text in ("True", "true", "1"):
                 value = True
             elif text in ("False", "false", "0"):
                 value = False
             else:
                 raise ValueError(f"Unexpected value for bool var: {text!r}")
-        elif self == VarKind.INTEGER:
+        elif self is VarKind.INTEGER:
             value = int(text)
-        elif self == VarKind.PY_NONE:
+        elif self is VarKind.PY_NONE:
             if text == "":
                 value = None
             else:
                 raise ValueError(f"Expected empty string for `None` var: {text!r}")
-        elif self == VarKind.PATH:
+        elif self is VarKind.PATH:
             raise NotImplementedError  # Paths are a special case
         else:
             raise AssertionError("Unexpected VarKind: " + str(self))
@@ -62,22 +80,48 @@ class VarKind(Enum):
         else:
             return str(self.value)
 
+    def __repr__(self):
+        return f"<VarKind.{self.name}: {self.value!r}>"
+
     @staticmethod
     def detect(value: object) -> Optional[VarKind]:
-        try:
-            return VarKind(type(value))
-        except ValueError:
-            try:
-                return VarKind(type(value).__name__)
-            except ValueError:
-                return None
+        kind = _VAR_KINDS.get(type(value))
+        if kind is None:
+            kind = _VAR_KINDS.get(type(value).__name__)
+        return kind
+
+
+VarKind.STRING = VarKind("STRING", str)
+VarKind.BOOLEAN = VarKind("BOOLEAN", bool)
+VarKind.INTEGER = VarKind("INTEGER", int)
+VarKind.PY_NONE = VarKind("PY_NONE", type(None))
+VarKind.PATH = VarKind("PATH", "EnvPath")
+_VAR_KINDS = {
+    kind.value: kind
+    for kind in (
+        VarKind.STRING,
+        VarKind.BOOLEAN,
+        VarKind.INTEGER,
+        VarKind.PY_NONE,
+        VarKind.PATH,
+    )
+}
 
 
-@dataclass
 class TypedVar:
+    __slots__ = ("value", "kind")
     value: object
     kind: Optional[VarKind]
 
+    def __init__(self, value: object, kind: Optional[VarKind]):
+        self.value = value
+        self.kind = kind
+
+    def __eq__(self, other):
+        if not isinstance(other, TypedVar):
+            return NotImplemented
+        return self.value == other.value and self.kind is other.kind
+
     def __str__(self):
         return str(self.value)
 
@@ -100,11 +144,85 @@ def assign_env_var(target: str, value: str):
     thisModule.assign_env_var('FOO', '1')
     $FOO # Is now a string typed variable :(
     """
-    if xonsh is not None:
+    xsh = _session()
+    if xsh is not None:
         # NOTE: This preserves the type of the passed in value
-        xonsh.environ.XSH.env[target] = value
+        xsh.env[target] = value
     else:
         os.environ[target] = str(value) if value is not None else ""
+    invalidate_env(target)
+
+
+def delete_env_var(target: str):
+    """Delete the specified environment variable (if it exists)"""
+    xsh = _session()
+    if xsh is not None:
+        xsh.env.pop(target, None)
+    else:
+        os.environ.pop(target, None)
+    invalidate_env(target)
+
+
+# Used in place of xonsh's aliases when xonsh isn't present
+_FALLBACK_ALIASES: dict[str, object] = {}
+
+
+def _aliases():
+    xsh = _session()
+    if xsh is not None:
+        return xsh.aliases
+    else:
+        return _FALLBACK_ALIASES
+
+
+def assign_alias(name: str, value: object):
+    """Define the specified xonsh alias (either a list of args or a callable)"""
+    _aliases()[name] = value
+
+
+def delete_alias(name: str):
+    """Remove the specified xonsh alias (if it exists)"""
+    _aliases().pop(name, None)
+
+
+class _FallbackEnv(collections.abc.MutableMapping):
+    """Used in place of xonsh's `XSH.env` when xonsh isn't present (backed by `os.environ`)"""
+
+    def __getitem__(self, key: str) -> str:
+        return os.environ[key]
+
+    def __setitem__(self, key: str, value: object):
+        assign_env_var(key, value)
+
+    def __delitem__(self, key: str):
+        if key not in os.environ:
+            raise KeyError(key)
+        delete_env_var(key)
+
+    def __iter__(self):
+        return iter(os.environ)
+
+    def __len__(self):
+        return len(os.environ)
+
+
+class _FallbackSession:
+    """Used in place of xonsh's `XSH` session when xonsh isn't present"""
+
+    __slots__ = ()
+    env = _FallbackEnv()
+    aliases = _FALLBACK_ALIASES
+
+
+def session():
+    """The xonsh session (`XSH`), as used by the code from `translate_to_python`
+
+    Without xonsh, this is a fallback that only has `env` and `aliases`."""
+    xsh = _session()
+    if xsh is not None:
+        return xsh
+    else:
+        return _FallbackSession()
 
 
 def get_typed_env_var(target: str, *, allow_unknown_type=False) -> TypedVar:
@@ -113,32 +231,160 @@ def get_typed_env_var(target: str, *, allow_unknown_type=False) -> TypedVar:
     Raises KeyError if the specified environment variable doesn't exist.
 
     Correctly falls back to os.getenv if xonsh is not present"""
-    if xonsh is None:
+    xsh = _session()
+    if xsh is None:
         value = os.getenv(target)
         if value is not None:
             return TypedVar(value, kind=VarKind.STRING)
         else:
             raise KeyError(f"Undefined environment variable: {target}")
     # From now on, we should have xonsh present
-    assert xonsh is not None, "Expected xonsh to be present"
+    assert xsh is not None, "Expected xonsh to be present"
     # NOTE: This properly respects type and it also throws KeyError
     #
     # Really we're just patching support
-    value = xonsh.environ.XSH.env[target]
+    value = xsh.env[target]
     detected_kind = VarKind.detect(value)
     if detected_kind is None and not allow_unknown_type:
         raise TypeError(f"Unknown type for var {target!r}: {type(value)!r}")
     return TypedVar(value, kind=detected_kind)
 
 
-def get_correct_env() -> dict:
+class _EnvSnapshot:
+    """A cached copy of the detyped xonsh environment
+
+    Instead of detyping the whole environment on every call,
+    this only re-detypes the keys that have been invalidated.
+
+    Keys are invalidated by our own assignments (`invalidate_env`),
+    and by xonsh's `on_envvar_new` and `on_envvar_change` events.
+    Anything else (like deleting a variable) is detected
+    by comparing the number of variables, triggering a full refresh.
+
+    Modifying a path in-place (like `$PATH.insert(0, ...)`) doesn't fire any events,
+    so the length and the first & last entries of each path are checked on every `get`.
+    (Other in-place changes to the middle of a path must be reported with `invalidate_env`)."""
+
+    __slots__ = ("values", "known_keys", "dirty", "generation", "listening", "paths")
+    # The detyped values, or None if there is no snapshot yet
+    values: Optional[dict[str, str]]
+    # All the keys in the environment (including those that don't detype)
+    known_keys: set[str]
+    dirty: set[str]
+    # Incremented every time the environment changes
+    generation: int
+    listening: bool
+    # The fingerprints of the (mutable) path values, when they were last detyped
+    paths: dict[str, tuple]
+
+    def __init__(self):
+        self.values = None
+        self.known_keys = set()
+        self.dirty = set()
+        self.generation = 0
+        self.listening = False
+        self.paths = {}
+
+    def invalidate(self, keys):
+        self.generation += 1
+        if self.values is not None:
+            self.dirty.update(keys)
+
+    def _on_envvar(self, name, **_):
+        self.invalidate((name,))
+
+    def _refresh(self, env):
+        if not self.listening:
+            from xonsh.events import events
+
+            events.on_envvar_new(self._on_envvar)
+            events.on_envvar_change(self._on_envvar)
+            self.listening = True
+        self.values = dict(env.detype())
+        self.known_keys = set(env.keys())
+        self.dirty.clear()
+        self.paths.clear()
+        for key in self.values:
+            self._track_path(key, env[key])
+
+    def _track_path(self, key: str, value):
+        if isinstance(value, collections.abc.MutableSequence):
+            self.paths[key] = _path_fingerprint(value)
+        else:
+            self.paths.pop(key, None)
+
+    def _redetype(self, env, key: str):
+        values = self.values
+        values.pop(key, None)
+        self.paths.pop(key, None)
+        if key not in env:
+            self.known_keys.discard(key)
+            return
+        self.known_keys.add(key)
+        # NOTE: This mirrors `Env.detype`
+        value = env[key]
+        self._track_path(key, value)
+        if callable(value) or isinstance(value, collections.abc.MutableMapping):
+            return
+        detyper = env.get_detyper(key)
+        if detyper is None:
+            return
+        detyped = detyper(value)
+        if detyped is not None:
+            values[key] = detyped
+
+    def get(self, env) -> dict[str, str]:
+        if self.values is None:
+            self._refresh(env)
+            return self.values
+        for key, fingerprint in self.paths.items():
+            value = env.get(key)
+            if value is None or _path_fingerprint(value) != fingerprint:
+                # Modified in-place (or replaced) without an event
+                self.invalidate((key,))
+        if self.dirty:
+            for key in self.dirty:
+                self._redetype(env, key)
+            self.dirty.clear()
+        if len(env) != len(self.known_keys):
+            # Something changed without us noticing
+            self.generation += 1
+            self._refresh(env)
+        return self.values
+
+
+def _path_fingerprint(value) -> tuple:
+    if not value:
+        return (id(value), 0)
+    return (id(value), len(value), value[0], value[-1])
+
+
+_SNAPSHOT = _EnvSnapshot()
+
+
+def invalidate_env(*keys: str):
+    """Invalidate the cached values of the specified environment variables
+
+    This must be called after modifying a variable in-place (like appending to $PATH)."""
+    _SNAPSHOT.invalidate(keys)
+
+
+def env_generation() -> int:
+    """A counter that changes whenever the environment changes"""
+    return _SNAPSHOT.generation
+
+
+def get_correct_env() -> Mapping[str, str]:
     """Get the correct values of the environment variables
 
-    Works around issue #2"""
-    if xonsh is not None:
+    Works around issue #2
+
+    The result is a cached snapshot, which must not be modified."""
+    xsh = _session()
+    if xsh is not None:
         # WARNING: There are some variables in ${...} that are not in ${...}.detype()
         #
         # See xonsh/xonsh#4636
-        return xonsh.environ.XSH.env.detype()
+        return _SNAPSHOT.get(xsh.env)
     else:
-        return os.environ()
+        return dict(os.environ)
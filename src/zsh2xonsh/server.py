@@ -0,0 +1,168 @@
+"""A long-running translation daemon (`zsh2xonsh serve`)
+
+This avoids paying for python startup (and imports) on every translation,
+which matters for editor integrations and pre-commit hooks.
+Use `zsh2xonsh.client` to talk to it.
+
+The protocol is newline-delimited JSON over a Unix socket.
+Each request is an object like:
+
+    {"op": "translate", "source": "export FOO=bar", "extra_builtins": [], "check_syntax": false}
+
+The `op` is either "translate", "validate" (parse & translate, but don't return the output) or "ping".
+Each response is either `{"ok": true, "output": "..."}`
+or `{"ok": false, "error": {"kind": "...", "message": "...", "line": 1, "offset": 0}}`,
+where the location is omitted if unknown.
+
+A connection may send any number of requests, and clients are handled concurrently.
+"""
+from __future__ import annotations
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+from typing import Optional
+
+from . import client, translate_to_xonsh
+from .parser import (
+    STANDARD_BUILTINS,
+    STATEMENT_KEYWORDS,
+    WORD_PATTERN,
+    TranslationError,
+)
+from .translate import Settings
+
+OPS = frozenset({"translate", "validate", "ping"})
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _parse_request(request) -> tuple[str, str, frozenset[str], bool]:
+    if not isinstance(request, dict):
+        raise BadRequest("Request must be an object")
+    op = request.get("op")
+    if op not in OPS:
+        raise BadRequest(f"Unknown op: {op!r}")
+    source = request.get("source", "")
+    if not isinstance(source, str):
+        raise BadRequest("The source must be a string")
+    extra_builtins = request.get("extra_builtins", [])
+    if not isinstance(extra_builtins, list) or not all(
+        isinstance(name, str) and WORD_PATTERN.fullmatch(name) is not None
+        for name in extra_builtins
+    ):
+        raise BadRequest("The extra builtins must be a list of words")
+    extra_builtins = frozenset(extra_builtins)
+    conflicts = extra_builtins & (STANDARD_BUILTINS | STATEMENT_KEYWORDS)
+    if conflicts:
+        raise BadRequest(
+            "Extra builtins conflict with existing builtins: "
+            + ", ".join(sorted(conflicts))
+        )
+    return op, source, extra_builtins, bool(request.get("check_syntax", False))
+
+
+def handle_request(request) -> dict:
+    """Handle a single (decoded) request, returning the response
+
+    This is also used directly by the client, when the daemon isn't running."""
+    try:
+        op, source, extra_builtins, check_syntax = _parse_request(request)
+    except BadRequest as e:
+        return {"ok": False, "error": {"kind": "Bad request", "message": str(e)}}
+    if op == "ping":
+        return {"ok": True, "output": ""}
+    settings = Settings.default()
+    settings.validate_syntax = check_syntax
+    try:
+        output = translate_to_xonsh(
+            source, settings=settings, extra_builtins=extra_builtins
+        )
+    except TranslationError as e:
+        error = {"kind": e.kind, "message": e.args[0]}
+        if e.location is not None:
+            error.update(line=e.location.line, offset=e.location.offset)
+        return {"ok": False, "error": error}
+    return {"ok": True, "output": output if op == "translate" else ""}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {
+                    "ok": False,
+                    "error": {"kind": "Bad request", "message": f"Invalid JSON: {e}"},
+                }
+            else:
+                try:
+                    response = handle_request(request)
+                except Exception as e:
+                    # Don't let a bug take down the whole server
+                    response = {
+                        "ok": False,
+                        "error": {
+                            "kind": "Internal error",
+                            "message": f"{type(e).__name__}: {e}",
+                        },
+                    }
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class TranslationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _is_listening(path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def create_server(socket_path: Optional[str] = None) -> TranslationServer:
+    """Bind the server to the socket (replacing a stale socket, if any)
+
+    Raises a `RuntimeError` if another server is already listening."""
+    if socket_path is None:
+        socket_path = client.default_socket_path()
+    if os.path.exists(socket_path):
+        if _is_listening(socket_path):
+            raise RuntimeError(f"A server is already listening on {socket_path}")
+        os.unlink(socket_path)
+    # NOTE: Only the current user may connect
+    old_umask = os.umask(0o177)
+    try:
+        return TranslationServer(socket_path, _Handler)
+    finally:
+        os.umask(old_umask)
+
+
+def _terminate(signum, frame):
+    sys.exit(0)
+
+
+def serve(server: TranslationServer):
+    """Serve requests until interrupted (or terminated), then remove the socket"""
+    previous = signal.signal(signal.SIGTERM, _terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        server.server_close()
+        os.unlink(server.server_address)
+
+
+__all__ = ["handle_request", "create_server", "serve", "TranslationServer"]
@@ -0,0 +1,108 @@
+"""Helpers about zsh itself, shared by the translator and the runtime
+
+This is imported by the runtime, so it must stay cheap to import
+(no dataclasses, and none of the translator's modules)."""
+from __future__ import annotations
+
+import os
+import re
+from typing import Optional
+
+# Things that we allow outside a quote without delegating to `zsh`
+# NOTE: We do not include '*' or any whitespace, because I dont' wanna deal with glob expansion
+#
+# We do include beginning `~` because python has a fast way to deal with that
+#
+# TODO: Are there any literals we recognize that are not 'safe'?
+SAFE_LITERAL_PATTERN = re.compile(r"[\w\~\/\\\.\-]+")
+
+
+def is_simple_literal(s, *, smart=False):
+    """Determines if the specified literal can be output directly without delegating to zsh for expansion
+
+    This is the case for things like foo/bar and 12.
+
+    It is *not* the case for anything involving globbing or variables.
+
+    These require special logic best done in zsh.
+
+    If the mode is `smart`, then this allows a leading `~` at the beginning of the string.
+    Python can quickly (and sanely) emulate this using `os.path.expanduser`.
+    This avoids the overhead of an extenral process call in those (common cases).
+    """
+    if not smart and s.startswith("~"):
+        return False  # Requires os.path.expanduser` expansion, which they are too dumb to do
+    else:
+        return SAFE_LITERAL_PATTERN.fullmatch(s) is not None
+
+
+def can_safely_be_split(text):
+    """Detrmines if something can safely be split along spaces.
+
+    Specifically how would we convert `alias foo="bar baz"` into ?
+
+    The simple solution is to always split along spaces.
+
+    This is incorrect for things like `alias foo='/usr/bin/egre*'`.
+    zsh has to do glob expansion at runtime, which xonsh will (sanely) refuse to do.
+
+    To workaround this edge-case, we could:
+    1. Unconditionally delegate aliases entirely into zsh
+       - This would be slow, especially if your alias is called in some sort of a loop
+    2. Recognize that bar and baz are "simple" literals,
+       that can be split entirely along their
+
+    We take the second option, calling out to `is_simple_literal` for each whitespace.
+    Hopefully this should avoid .
+    """
+    # TODO: What if we have nested quotes `alias='foo "bar"`.
+    # This is (technically) safe to expand without calling out to zsh
+    return all(is_simple_literal(part) for part in text.split(" "))
+
+
+# Parameters that change by themselves
+_DYNAMIC_PARAMS = frozenset(
+    {"RANDOM", "SECONDS", "EPOCHSECONDS", "EPOCHREALTIME", "LINENO", "SRANDOM"}
+)
+# NOTE: Compiled on first use (by `re`'s cache), to keep importing the runtime fast
+_PARAM_REFERENCE_PATTERN = (
+    r"\$(?:\{[#^=~+]*(?P<braced>[A-Za-z_]\w*|[0-9]+)|(?P<name>[A-Za-z_]\w*)|(?P<other>.?))"
+)
+
+
+def referenced_params(code: str) -> Optional[frozenset[str]]:
+    """The (named) parameters that the zsh code references, or None if unsure
+
+    Positional parameters aren't included.
+    This is used to key memoized results, so it must not miss anything (but can include extras).
+    Special parameters like `$$`, `$?` or `$RANDOM` return None,
+    since their values aren't determined by the environment."""
+    names = set()
+    for m in re.finditer(_PARAM_REFERENCE_PATTERN, code, re.DOTALL):
+        name = m.group("braced") or m.group("name")
+        if name is not None:
+            if name in _DYNAMIC_PARAMS:
+                return None
+            elif not name.isdigit():
+                names.add(name)
+        elif m.group("other") not in ("", "(", "@", "*", "#") and not m.group(
+            "other"
+        ).isdigit():
+            return None
+    return frozenset(names)
+
+
+def zsh_executable() -> str:
+    """The zsh executable to run (`$ZSH2XONSH_ZSH`, or just `zsh` from the PATH)
+
+    Overriding this is mostly useful for benchmarks and testing."""
+    return os.environ.get("ZSH2XONSH_ZSH") or "zsh"
+
+
+__all__ = [
+    "SAFE_LITERAL_PATTERN",
+    "can_safely_be_split",
+    "is_simple_literal",
+    "referenced_params",
+    "zsh_executable",
+]
@@ -1,9 +1,20 @@
 """Utilites for translation"""
 from __future__ import annotations
 
-import ast as pyast
 import re
-from dataclasses import dataclass, field
+import shutil
+import subprocess
+from dataclasses import dataclass, field, fields
+from typing import NamedTuple, Optional
+
+from . import params
+from .shell import (
+    SAFE_LITERAL_PATTERN,
+    can_safely_be_split,
+    is_simple_literal,
+    referenced_params,
+    zsh_executable,
+)
 
 
 @dataclass
@@ -18,6 +29,22 @@ class Settings:
         }.copy
     )
 
+    """Validate the syntax of every delegated zsh command at translation time
+
+    This requires zsh to be installed when translating.
+    The runtime can then skip checking the syntax of those commands."""
+    validate_syntax: bool = False
+    """Substitute the values of parameters that are known at translation time (see `passes.propagate_constants`)"""
+    propagate_constants: bool = True
+    """Inline calls to small functions with literal arguments (see `passes.inline_functions`)"""
+    inline_functions: bool = True
+    """Merge consecutive updates to the same path variable (see `passes.coalesce_path_updates`)"""
+    coalesce_path_updates: bool = True
+    """Evaluate runs of consecutive assignments with a single zsh process"""
+    batch_assignments: bool = True
+    """Run independent zsh commands concurrently (see `passes.schedule_prefetch`)"""
+    prefetch: bool = True
+
     def is_path_like_var(self, name: str) -> bool:
         """Detect if the variable should be treated like a $PATH EnvList
         See xonsh documentation on environment variables: https://xon.sh/envvars.html
@@ -27,6 +54,17 @@ class Settings:
         """
         return name.endswith("PATH") or name in self.other_path_like_vars
 
+    def fingerprint(self) -> str:
+        """A stable description of these settings (used for caching translations)"""
+        values = {f.name: getattr(self, f.name) for f in fields(self)}
+        values["strict_env_types"] = self.strict_env_types
+        return repr(
+            sorted(
+                (name, sorted(value) if isinstance(value, (set, frozenset)) else value)
+                for name, value in values.items()
+            )
+        )
+
     @staticmethod
     def default() -> Settings:
         return Settings()
@@ -50,34 +88,6 @@ def is_simple_quoted(s: str) -> bool:
     return SAFE_QUOTED_STRING.fullmatch(s) is not None
 
 
-# Things that we allow outside a quote without delegating to `zsh`
-# NOTE: We do not include '*' or any whitespace, because I dont' wanna deal with glob expansion
-#
-# We do include beginning `~` because python has a fast way to deal with that
-#
-# TODO: Are there any literals we recognize that are not 'safe'?
-SAFE_LITERAL_PATTERN = re.compile(r"[\w\~\/\\\.\-]+")
-
-
-def is_simple_literal(s, *, smart=False):
-    """Determines if the specified literal can be output directly without delegating to zsh for expansion
-
-    This is the case for things like foo/bar and 12.
-
-    It is *not* the case for anything involving globbing or variables.
-
-    These require special logic best done in zsh.
-
-    If the mode is `smart`, then this allows a leading `~` at the beginning of the string.
-    Python can quickly (and sanely) emulate this using `os.path.expanduser`.
-    This avoids the overhead of an extenral process call in those (common cases).
-    """
-    if not smart and s.startswith("~"):
-        return False  # Requires os.path.expanduser` expansion, which they are too dumb to do
-    else:
-        return SAFE_LITERAL_PATTERN.fullmatch(s) is not None
-
-
 INTEGER_PATTERN = re.compile(r"[\d](\d|_\d)*")
 
 
@@ -85,25 +95,151 @@ def is_valid_integer(s: str) -> bool:
     return INTEGER_PATTERN.fullmatch(s) is not None
 
 
-def can_safely_be_split(text):
-    """Detrmines if something can safely be split along spaces.
-
-    Specifically how would we convert `alias foo="bar baz"` into ?
-
-    The simple solution is to always split along spaces.
-
-    This is incorrect for things like `alias foo='/usr/bin/egre*'`.
-    zsh has to do glob expansion at runtime, which xonsh will (sanely) refuse to do.
-
-    To workaround this edge-case, we could:
-    1. Unconditionally delegate aliases entirely into zsh
-       - This would be slow, especially if your alias is called in some sort of a loop
-    2. Recognize that bar and baz are "simple" literals,
-       that can be split entirely along their
-
-    We take the second option, calling out to `is_simple_literal` for each whitespace.
-    Hopefully this should avoid .
-    """
-    # TODO: What if we have nested quotes `alias='foo "bar"`.
-    # This is (technically) safe to expand without calling out to zsh
-    return all(is_simple_literal(part) for part in text.split(" "))
+# A comment that marks the commands on a line as pure (so the runtime can memoize them)
+#
+# For example `export PREFIX=$(brew --prefix)  # zsh2xonsh: pure`
+PURE_PRAGMA_PATTERN = re.compile(r"(?:^|\s)#\s*zsh2xonsh:\s*pure\s*$")
+
+
+class PathUpdate(NamedTuple):
+    """Entries added to the start and end of a path variable (see `match_path_update`)
+
+    Each entry is the parsed text between the colons,
+    which may contain parameters (so it could expand into several entries)."""
+
+    prefix: list[tuple[params.Part, ...]]
+    suffix: list[tuple[params.Part, ...]]
+
+
+def _split_entries(
+    parts: tuple[params.Part, ...]
+) -> Optional[list[tuple[params.Part, ...]]]:
+    """Split the parts at every colon, or return None if there are any empty entries"""
+    entries = [[]]
+    for part in parts:
+        if isinstance(part, str):
+            first, *rest = part.split(":")
+            if first:
+                entries[-1].append(first)
+            entries.extend([piece] if piece else [] for piece in rest)
+        else:
+            entries[-1].append(part)
+    if not all(entries):
+        return None
+    return [tuple(entry) for entry in entries]
+
+
+def _strip_separator(parts: tuple[params.Part, ...], *, trailing: bool):
+    """Remove the colon that separates the parts from the old value
+
+    Returns None if there isn't one, or if there's nothing else (which would be an empty entry)."""
+    if not parts:
+        return parts
+    idx = -1 if trailing else 0
+    text = parts[idx]
+    if not isinstance(text, str) or not (
+        text.endswith(":") if trailing else text.startswith(":")
+    ):
+        return None
+    text = text[:-1] if trailing else text[1:]
+    if trailing:
+        res = (*parts[:-1], text) if text else parts[:-1]
+    else:
+        res = (text, *parts[1:]) if text else parts[1:]
+    return res if res else None
+
+
+def match_path_update(name: str, quoted: str) -> Optional[PathUpdate]:
+    """Match the common idioms for adding entries to a path variable
+
+    For example, `"/opt/homebrew/bin${PATH+:$PATH}"`, `"$PATH:$1"` or `"/x:${INFOPATH:-}"`.
+
+    Returns None if the (double-quoted) text isn't one of them,
+    or would add empty entries (which zsh treats as the current directory)."""
+    try:
+        parts = params.parse_quoted(quoted)
+    except params.UnsupportedExpansion:
+        return None
+    refs = [
+        idx
+        for idx, part in enumerate(parts)
+        if isinstance(part, params.Param) and name in params.referenced_names((part,))
+    ]
+    if len(refs) != 1:
+        return None
+    idx = refs[0]
+    ref = parts[idx]
+    plain = params.Param(name, None, ())
+    before, after = parts[:idx], parts[idx + 1 :]
+    if ref.name == name and ref.op in (None, ":-") and not ref.word:
+        # Separated by colons like `/x:$PATH`
+        before = _strip_separator(before, trailing=True)
+        after = _strip_separator(after, trailing=False)
+    elif ref.op in ("+", ":+") and ref.name == name and ref.word == (":", plain):
+        # Like `/x${PATH+:$PATH}`
+        if not before:
+            return None
+        after = _strip_separator(after, trailing=False)
+    elif ref.op in ("+", ":+") and ref.name == name and ref.word == (plain, ":"):
+        # Like `${PATH+$PATH:}/x`
+        if not after:
+            return None
+        before = _strip_separator(before, trailing=True)
+    else:
+        return None
+    if before is None or after is None:
+        return None
+    prefix = _split_entries(before) if before else []
+    suffix = _split_entries(after) if after else []
+    if prefix is None or suffix is None or not (prefix or suffix):
+        return None
+    return PathUpdate(prefix, suffix)
+
+
+def expand_quote_command(quoted: str) -> str:
+    """The command `ZshContext.zsh_expand_quote` runs to expand the specified quoted text
+
+    NOTE: This must be kept in sync with the runtime"""
+    return f'print -rn -- "{quoted}"'
+
+
+# Assigning to $functions parses the body (without executing it),
+# so we can check many commands in a single process.
+_BATCH_SYNTAX_CHECK = r"""
+while IFS= read -r -d $'\0' __z2x_cmd; do
+    __z2x_err=$( { functions[__z2x_syntax_check]=$__z2x_cmd } 2>&1 )
+    printf '%s\0%s\0' $? "$__z2x_err"
+done
+"""
+
+
+def validate_zsh_syntax(commands: list[str]) -> list[Optional[str]]:
+    """Validate the syntax of the specified zsh commands, using a single zsh process.
+
+    Returns the error message for each command (or None if it is valid).
+
+    None of the commands are executed."""
+    if not commands:
+        return []
+    zsh = zsh_executable()
+    if shutil.which(zsh) is None:
+        raise RuntimeError(f"Unable to validate syntax: `{zsh}` is not installed")
+    assert all("\0" not in cmd for cmd in commands)
+    res = subprocess.run(
+        [zsh, "-f", "-c", _BATCH_SYNTAX_CHECK],
+        input="".join(cmd + "\0" for cmd in commands),
+        stdout=subprocess.PIPE,
+        check=True,
+        encoding="utf-8",
+    )
+    fields = res.stdout.split("\0")
+    assert fields.pop() == "", "Expected trailing NUL"
+    assert len(fields) == 2 * len(commands), f"Unexpected output: {res.stdout!r}"
+    errors = []
+    for status, err in zip(fields[::2], fields[1::2]):
+        err = err.strip()
+        if status != "0" or err:
+            errors.append(err or f"exit status {status}")
+        else:
+            errors.append(None)
+    return errors
@@ -0,0 +1,62 @@
+import ast
+import os
+
+from click.testing import CliRunner
+
+from zsh2xonsh import batch
+from zsh2xonsh.__main__ import zsh2xonsh
+
+
+def _run(*args):
+    return CliRunner().invoke(zsh2xonsh, list(args), catch_exceptions=False)
+
+
+def test_batch(tmp_path):
+    src = tmp_path / "src"
+    (src / "nested").mkdir(parents=True)
+    (src / "a.zsh").write_text('export FOO="bar"\n')
+    (src / "nested" / "b.zsh").write_text("alias ll='ls -l'\n")
+    (src / "bad.zsh").write_text("if [[ -d foo ]]; then\n")
+    out = tmp_path / "out"
+
+    res = _run("batch", "--jobs", "1", "-o", str(out), str(src))
+    assert res.exit_code == 1
+    assert "Translated 2, up to date 0, failed 1" in res.output
+    assert "bad.zsh:" in res.output
+    translated = (out / "a.xsh").read_text()
+    assert translated.startswith(batch.HEADER_PREFIX)
+    assert "from zsh2xonsh import runtime" in translated
+    assert (out / "nested" / "b.xsh").exists()
+    assert not (out / "bad.xsh").exists()
+
+    (src / "bad.zsh").unlink()
+    res = _run("batch", "--jobs", "1", "-o", str(out), str(src))
+    assert res.exit_code == 0
+    assert "Translated 0, up to date 2, failed 0" in res.output
+
+    # Touching the input makes it newer than its output, so it is translated again
+    # (even though its hash is unchanged)
+    st = (out / "a.xsh").stat()
+    os.utime(src / "a.zsh", (st.st_atime + 10, st.st_mtime + 10))
+    res = _run("batch", "--jobs", "1", "-o", str(out), str(src))
+    assert "Translated 1, up to date 1" in res.output
+    # Changing the settings invalidates everything
+    res = _run("batch", "--jobs", "1", "-b", "foo", "-o", str(out), str(src))
+    assert "Translated 2, up to date 0" in res.output
+
+
+def test_empty_input(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "empty.zsh").write_text("# just a comment\n")
+    out = tmp_path / "out"
+    res = _run("batch", "--jobs", "1", "-o", str(out), str(src))
+    assert res.exit_code == 0
+    # The output must still be valid (so it can be sourced)
+    ast.parse((out / "empty.xsh").read_text())
+
+
+def test_default_command():
+    res = _run("--cmd", 'export FOO="bar"')
+    assert res.exit_code == 0
+    assert res.output.startswith("from zsh2xonsh import runtime\n")
@@ -0,0 +1,44 @@
+import os
+
+from zsh2xonsh.cache import TranslationCache
+from zsh2xonsh.translate import Settings
+
+
+def test_roundtrip(tmp_path):
+    cache = TranslationCache(tmp_path)
+    settings = Settings.default()
+    key = cache.key("export FOO=bar", settings=settings, extra_builtins={"extend_path"})
+    assert cache.load(key) is None
+    code = compile("x = 42", "<test>", "exec")
+    cache.store(key, "$FOO='bar'", code)
+    cached = cache.load(key)
+    assert cached.translated == "$FOO='bar'"
+    namespace = {}
+    exec(cached.code, namespace)
+    assert namespace["x"] == 42
+    # Everything that affects the output should be part of the key
+    settings.validate_syntax = True
+    assert key != cache.key(
+        "export FOO=bar", settings=settings, extra_builtins={"extend_path"}
+    )
+    assert key != cache.key("export FOO=bar", settings=Settings(), extra_builtins=())
+
+
+def test_corrupt_entry(tmp_path):
+    cache = TranslationCache(tmp_path)
+    (tmp_path / "deadbeef.z2xc").write_bytes(b"garbage")
+    assert cache.load("deadbeef") is None
+    assert not (tmp_path / "deadbeef.z2xc").exists()
+
+
+def test_eviction(tmp_path):
+    code = compile("pass", "<test>", "exec")
+    cache = TranslationCache(tmp_path, max_bytes=10_000)
+    for i in range(3):
+        cache.store(f"key{i}", "x" * 1000, code)
+        os.utime(tmp_path / f"key{i}.z2xc", (i, i))
+    assert cache.load("key0") is not None  # Marks as recently used
+    cache.max_bytes = 2500
+    cache.store("key3", "x" * 1000, code)
+    remaining = sorted(path.stem for path in tmp_path.glob("*.z2xc"))
+    assert remaining == ["key0", "key3"]
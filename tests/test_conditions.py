@@ -0,0 +1,107 @@
+import shutil
+import subprocess
+
+import pytest
+
+from zsh2xonsh.conditions import (
+    StatCache,
+    UnsupportedCondition,
+    evaluate,
+    is_supported,
+    parse_test,
+    to_text,
+)
+
+requires_zsh = pytest.mark.skipif(shutil.which("zsh") is None, reason="requires zsh")
+
+# Each test is paired with its expected result (inside the sandbox)
+TESTS = {
+    '[[ -d "$DIR" ]]': True,
+    '[[ -d "$FILE" ]]': False,
+    "[[ -f $FILE ]]": True,
+    '[[ -e "${DIR}/missing" ]]': False,
+    '[[ -x "$DIR/script" && -r "$FILE" ]]': True,
+    '[[ -x "$FILE" ]]': False,
+    '[[ -L "$DIR/link" && -f "$DIR/link" ]]': True,
+    '[[ -L "$FILE" || ! -e "$DIR/link" ]]': False,
+    '[[ -n "$EMPTY" ]]': False,
+    "[[ -z $EMPTY ]]": True,
+    '[[ -n "${UNSET:-x}" ]]': True,
+    '[[ "$1" == first ]]': True,
+    "[[ $1 != 'first' ]]": False,
+    '[[ "$DIR"/file == "$FILE" ]]': True,
+    '[[ ! ( -d "$FILE" || -z "$1" ) ]]': True,
+    "[[ foo ]]": True,
+    '[[ -d "" ]]': False,
+}
+UNSUPPORTED = [
+    "[[ $1 == f* ]]",
+    "[[ $1 == $2 ]]",
+    '[[ -s "$FILE" ]]',
+    "[[ -d ~/foo ]]",
+    '[[ $(pwd) == "/" ]]',
+    '[[ "$FILE" -nt "$DIR" ]]',
+    "[[ $HOME:h == / ]]",
+    "test -d foo",
+]
+
+
+@pytest.fixture
+def sandbox(tmp_path):
+    (tmp_path / "file").write_text("hello")
+    script = tmp_path / "script"
+    script.write_text("#!/bin/sh\n")
+    script.chmod(0o755)
+    (tmp_path / "link").symlink_to(tmp_path / "file")
+    env = {"DIR": str(tmp_path), "FILE": str(tmp_path / "file"), "EMPTY": ""}
+    positional = ["zsh", "first"]
+
+    def lookup(name):
+        if name.isdigit():
+            idx = int(name)
+            return positional[idx] if idx < len(positional) else None
+        return env.get(name)
+
+    return env, positional, lookup
+
+
+def test_unsupported():
+    for text in UNSUPPORTED:
+        assert not is_supported(text), text
+        with pytest.raises(UnsupportedCondition):
+            parse_test(text)
+
+
+def test_special_params():
+    # zsh sets these itself (so they are never in the environment)
+    for text in ['[[ -n "$ZSH_VERSION" ]]', "[[ $ZSH_NAME == zsh ]]"]:
+        assert not is_supported(text), text
+
+
+@pytest.mark.parametrize("text", TESTS.keys())
+def test_native(sandbox, text):
+    _, _, lookup = sandbox
+    assert evaluate(parse_test(text), lookup, StatCache()) == TESTS[text]
+    # Rendering the condition (with every operand quoted) must not change it
+    rendered = to_text(parse_test(text))
+    assert evaluate(parse_test(rendered), lookup, StatCache()) == TESTS[text], rendered
+
+
+def test_stat_cache_relative(sandbox, monkeypatch):
+    env, _, lookup = sandbox
+    stats = StatCache()
+    cond = parse_test('[[ -f "file" ]]')
+    monkeypatch.chdir(env["DIR"])
+    assert evaluate(cond, lookup, stats)
+    # Relative paths are cached separately for each working directory
+    monkeypatch.chdir("/")
+    assert not evaluate(cond, lookup, stats)
+
+
+@requires_zsh
+@pytest.mark.parametrize("text", TESTS.keys())
+def test_matches_zsh(sandbox, text):
+    env, positional, lookup = sandbox
+    res = subprocess.run(["zsh", "-f", "-c", text, *positional], env=env)
+    assert res.returncode in (0, 1)
+    assert evaluate(parse_test(text), lookup, StatCache()) == (res.returncode == 0)
@@ -0,0 +1,74 @@
+import random
+from pathlib import Path
+
+import pytest
+
+from zsh2xonsh import incremental, translate, translate_to_xonsh
+from zsh2xonsh.parser import TranslationError
+
+EXAMPLES = Path(__file__).parent.parent / "examples"
+
+
+def _summary(artifact):
+    return [
+        (r.text, r.span, r.output, r.start, r.checked_end, r.defined_functions)
+        for r in artifact.statements
+    ]
+
+
+@pytest.mark.parametrize("name", ["macbook2021-config.zsh", "opam_env.zsh"])
+def test_random_edits(name):
+    lines = (EXAMPLES / name).read_text().split("\n")
+    rng = random.Random(name)
+    previous = incremental.translate("\n".join(lines))
+    for _ in range(100):
+        edited = list(lines)
+        idx = rng.randrange(len(edited))
+        op = rng.randrange(3)
+        if op == 0 and len(edited) > 1:
+            del edited[idx]
+        elif op == 1:
+            edited.insert(idx, rng.choice(lines))
+        else:
+            edited[idx] += rng.choice([" ", "x", "; export FOO=1"])
+        source = "\n".join(edited)
+        try:
+            expected = incremental.translate(source)
+        except TranslationError:
+            continue
+        actual = incremental.translate(source, previous)
+        assert _summary(actual) == _summary(expected)
+        previous, lines = actual, edited
+
+
+def test_function_state():
+    source = "function foo() {\n    export A=1\n}\nfoo\nexport B=2\n"
+    previous = incremental.translate(source)
+    # Changing the function name changes how later invocations are parsed
+    with pytest.raises(TranslationError):
+        incremental.translate(source.replace("foo()", "bar()"), previous)
+    edited = source.replace("A=1", "A=3")
+    actual = incremental.translate(edited, previous)
+    assert actual.text == incremental.translate(edited).text
+    # The statements after the edit are reused as is
+    assert actual.statements[-1].output is previous.statements[-1].output
+    assert translate_to_xonsh(edited, previous=previous) == actual.text
+
+
+@pytest.mark.parametrize("path", sorted(EXAMPLES.glob("*.zsh")), ids=lambda p: p.name)
+def test_matches_full_translation(path):
+    source = path.read_text()
+    settings = translate.Settings.default()
+    # The passes that work across statements are skipped by incremental translation
+    settings.propagate_constants = False
+    settings.inline_functions = False
+    settings.coalesce_path_updates = False
+    settings.batch_assignments = False
+    settings.prefetch = False
+    expected = translate_to_xonsh(source, settings=settings)
+    previous = incremental.translate(source, settings=settings)
+    assert previous.text == expected
+    edited = source + "\nexport EDITED=1\n"
+    assert translate_to_xonsh(edited, previous=previous, settings=settings) == (
+        translate_to_xonsh(edited, settings=settings)
+    )
@@ -0,0 +1,114 @@
+import shutil
+import subprocess
+
+import pytest
+
+from zsh2xonsh.params import (
+    Param,
+    UnsupportedExpansion,
+    expand,
+    parse_quoted,
+    quote,
+    substitute,
+)
+
+requires_zsh = pytest.mark.skipif(shutil.which("zsh") is None, reason="requires zsh")
+
+ENV = {"HOME": "/home/example", "PATH": "/usr/bin:/bin", "EMPTY": ""}
+POSITIONAL = ["func", "first"]
+SUPPORTED = [
+    "$HOME/bin",
+    "${HOME}",
+    "/opt/homebrew/bin:/opt/homebrew/sbin${PATH+:$PATH}",
+    "/opt/homebrew/share/man${MANPATH+:$MANPATH}:",
+    "/opt/homebrew/share/info:${INFOPATH:-}",
+    "${EMPTY:-default} ${EMPTY-default} ${EMPTY+set} ${EMPTY:+nonempty}",
+    "${UNSET:-default} ${UNSET-default} ${UNSET+set} ${UNSET:+nonempty}",
+    "${HOME:-${UNSET:-nested}} ${UNSET:-${HOME}/x}",
+    "$PATH:$1",
+    "${1}/bin $2 ${12}",
+    r"\$HOME \\ \" \a",
+]
+UNSUPPORTED = [
+    "$(pwd)",
+    "`pwd`",
+    "${HOME:h}",
+    "$HOME:h",
+    "$path[1]",
+    "${#HOME}",
+    "${(U)HOME}",
+    "$RANDOM",
+    "$ZSH_VERSION",
+    "${zsh_eval_context:-}",
+    "$histchars",
+    "$0",
+    "$$",
+    "${HOME:-\\}}",
+    "$ foo",
+    "$12",
+]
+
+
+def lookup(name):
+    if name.isdigit():
+        idx = int(name)
+        return POSITIONAL[idx] if idx < len(POSITIONAL) else None
+    return ENV.get(name)
+
+
+def test_parse():
+    assert parse_quoted("$HOME/bin") == (Param("HOME", None, ()), "/bin")
+    assert parse_quoted("${PATH+:$PATH}") == (
+        Param("PATH", "+", (":", Param("PATH", None, ()))),
+    )
+    for text in UNSUPPORTED:
+        with pytest.raises(UnsupportedExpansion):
+            parse_quoted(text)
+
+
+def test_expand():
+    assert expand(parse_quoted("$HOME/bin"), lookup) == "/home/example/bin"
+    assert (
+        expand(parse_quoted(SUPPORTED[5]), lookup) == "default  set "
+    ), "Empty vs unset"
+    assert expand(parse_quoted(SUPPORTED[6]), lookup) == "default default  "
+    # zsh would initialize $PATH itself
+    with pytest.raises(UnsupportedExpansion):
+        expand(parse_quoted("${PATH+:$PATH}"), lambda name: None)
+
+
+
+@pytest.mark.parametrize("text", SUPPORTED)
+def test_substitute(text):
+    parts = parse_quoted(text)
+    assert parse_quoted(quote(parts)) == parts
+    # Substituting some of the values (then expanding the rest) is the same as expanding everything
+    known = {"HOME": "/home/$x \\ {}", "EMPTY": ""}
+
+    def full_lookup(name):
+        return known[name] if name in known else lookup(name)
+
+    expected = expand(parts, full_lookup)
+    substituted = substitute(parts, known.get)
+    assert expand(substituted, full_lookup) == expected
+    try:
+        requoted = quote(substituted)
+    except UnsupportedExpansion:
+        # The value can't be written inside `${UNSET:-word}`
+        assert "${UNSET:-${HOME}" in text
+    else:
+        assert expand(parse_quoted(requoted), full_lookup) == expected
+    assert substitute(parts, lambda name: None) == parts
+
+
+@requires_zsh
+@pytest.mark.parametrize("text", SUPPORTED)
+def test_matches_zsh(text):
+    expected = subprocess.run(
+        ["zsh", "-f", "-c", f'print -rn -- "{text}"', *POSITIONAL],
+        env=ENV,
+        stdout=subprocess.PIPE,
+        check=True,
+        encoding="utf-8",
+    ).stdout
+    assert expand(parse_quoted(text), lookup) == expected
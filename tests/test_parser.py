@@ -1,3 +1,5 @@
+from zsh2xonsh.ast import Location
+from zsh2xonsh.lexer import Lexer, TokenKind
 from zsh2xonsh.parser import ShellParser
 
 
@@ -19,3 +21,74 @@ def test_parse_balanced_parens():
         parser.parse_balanced_parens()
         == 'import sys; print(".".join(map(str, sys.version_info[:2])))'
     )
+
+
+def test_multiline_subcommand():
+    parser = ShellParser(["export FOO=$(echo foo |", "  tr a-z A-Z)", "export BAR=1"])
+    stmt = parser.statement()
+    assert stmt.value.command == "echo foo |\n  tr a-z A-Z"
+    assert stmt.span.end == Location(line=2, offset=13)
+    stmt = parser.statement()
+    assert stmt.target == "BAR"
+    assert stmt.span.start == Location(line=3, offset=0)
+    assert parser.statement() is None
+
+
+def test_lexer_offsets():
+    lexer = Lexer('export A="x y"; # hi\nB=~/c')
+    assert [
+        (token.kind, lexer.token_text(token)) for token in lexer.tokens()
+    ] == [
+        (TokenKind.WORD, "export"),
+        (TokenKind.WHITESPACE, " "),
+        (TokenKind.WORD, "A"),
+        (TokenKind.EQUALS, "="),
+        (TokenKind.DOUBLE_QUOTED, '"x y"'),
+        (TokenKind.SEMICOLON, ";"),
+        (TokenKind.WHITESPACE, " "),
+        (TokenKind.COMMENT, "# hi"),
+        (TokenKind.NEWLINE, "\n"),
+        (TokenKind.WORD, "B"),
+        (TokenKind.EQUALS, "="),
+        (TokenKind.LITERAL, "~/c"),
+    ]
+    assert lexer.location(23) == Location(line=2, offset=2)
+    # Quotes and escapes can contain unbalanced parens
+    text = """(echo ")" \\( '(' (nested)) trailing"""
+    assert Lexer(text).scan_balanced(0, "(", ")") == text.index(" trailing")
+    assert Lexer("(unbalanced").scan_balanced(0, "(", ")") == -1
+
+
+def test_long_multiline_regions():
+    class CountingLexer(Lexer):
+        __slots__ = ("loads",)
+
+        def _load(self, count=1):
+            self.loads = getattr(self, "loads", 0) + 1
+            return super()._load(count)
+
+    # A quote inside the region contains (unbalanced) parens and spans lines
+    lines = ["$(echo 'a (", *(f"  echo {idx} (x)" for idx in range(1000)), "  ' b) after"]
+    lexer = CountingLexer(lines)
+    end = lexer.scan_balanced(1, "(", ")")
+    assert lexer.text_between(end, end + 6) == " after"
+    # The lines are loaded in exponentially growing batches (not rescanning each time)
+    assert lexer.loads < 20
+    assert end == Lexer("\n".join(lines)).scan_balanced(1, "(", ")")
+    lexer = CountingLexer(['"start', *(f"line {idx}" for idx in range(1000)), 'end" x'])
+    token = lexer.token(0)
+    assert token.kind == TokenKind.DOUBLE_QUOTED
+    assert lexer.token_text(token).endswith('end"')
+    assert lexer.loads < 20
+
+
+def test_packed_spans():
+    lines = [f"export VAR{idx}='{'x' * 100}'" for idx in range(200)]
+    parser = ShellParser(lines)
+    stmts = list(parser.statements())
+    # NOTE: The text of the early statements was discarded, but their spans still decode
+    assert stmts[0].span.start == Location(line=1, offset=0)
+    assert stmts[150].span.start == Location(line=151, offset=0)
+    assert stmts[150].span.start_offset == sum(len(line) + 1 for line in lines[:150])
+    assert all(stmt.span.lines is parser.line_table for stmt in stmts)
+    assert stmts[0].span.to(stmts[1].span).end == stmts[1].span.end
@@ -0,0 +1,402 @@
+import ast as pyast
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from zsh2xonsh.runtime.xonshi import _EnvSnapshot
+
+requires_zsh = pytest.mark.skipif(shutil.which("zsh") is None, reason="requires zsh")
+
+
+class FakeEnv(dict):
+    """Mimics the parts of `xonsh.environ.Env` used by the snapshot"""
+
+    detype_calls = 0
+
+    @staticmethod
+    def get_detyper(key):
+        return lambda value: ":".join(value) if isinstance(value, list) else str(value)
+
+    def detype(self):
+        self.detype_calls += 1
+        return {key: self.get_detyper(key)(value) for key, value in self.items()}
+
+
+def test_env_snapshot():
+    env = FakeEnv(PATH=["/bin", "/usr/bin"], FOO=True)
+    snapshot = _EnvSnapshot()
+    snapshot.listening = True  # Don't register xonsh events
+    assert snapshot.get(env) == {"PATH": "/bin:/usr/bin", "FOO": "True"}
+    assert snapshot.get(env) is snapshot.get(env)
+    generation = snapshot.generation
+    env["PATH"].append("/sbin")
+    env["BAR"] = 7
+    snapshot.invalidate(["PATH", "BAR"])
+    assert snapshot.generation != generation
+    assert snapshot.get(env) == {
+        "PATH": "/bin:/usr/bin:/sbin",
+        "FOO": "True",
+        "BAR": "7",
+    }
+    assert env.detype_calls == 1
+    # Unobserved deletion triggers a full refresh
+    del env["FOO"]
+    assert snapshot.get(env) == {"PATH": "/bin:/usr/bin:/sbin", "BAR": "7"}
+    assert env.detype_calls == 2
+    # In-place changes to paths are noticed without any events (or a full refresh)
+    generation = snapshot.generation
+    env["PATH"].insert(0, "/opt/bin")
+    assert snapshot.get(env)["PATH"] == "/opt/bin:/bin:/usr/bin:/sbin"
+    env["PATH"].pop()
+    assert snapshot.get(env)["PATH"] == "/opt/bin:/bin:/usr/bin"
+    assert snapshot.generation != generation
+    assert env.detype_calls == 2
+
+
+def test_parse_env_diff_dumps():
+    from zsh2xonsh.runtime import envdiff
+
+    before = envdiff._parse_env("_=/bin/env\0FOO=1\0PATH=/bin\0GONE=x\0")
+    after = envdiff._parse_env("_=/bin/true\0FOO=1\0PATH=/opt/bin:/bin\0NEW=a=b\nc\0")
+    assert envdiff._diff(before, after) == (
+        {"PATH": "/opt/bin:/bin", "NEW": "a=b\nc"},
+        ["GONE"],
+    )
+    aliases = envdiff._parse_aliases(
+        "alias ll='ls -la'\nalias -- -='cd -'\nalias q='echo '\\''hi'\\'''\n"
+    )
+    assert aliases == {"ll": "ls -la", "-": "cd -", "q": "echo 'hi'"}
+    with pytest.raises(envdiff.EnvDiffError):
+        envdiff._parse_aliases("alias nl=$'\\n'")
+
+
+def test_env_diff_refuses_functions(monkeypatch, tmp_path):
+    from zsh2xonsh.runtime import envdiff
+
+    def run(*args, **kwargs):
+        raise AssertionError("The script must not be run")
+
+    monkeypatch.setattr(envdiff, "run", run)
+    marker = tmp_path / "marker"
+    # Parsed by the translator
+    script = f"touch {marker}\nfunction extend_path() {{\n    export PATH=\"$PATH:$1\"\n}}"
+    assert envdiff.declared_functions(script) == ["extend_path"]
+    with pytest.raises(envdiff.EnvDiffError, match="exits: extend_path"):
+        envdiff.capture_env_diff(script, {}, [])
+    # Outside the subset supported by the translator
+    script = f"touch {marker}\nnvm() {{ echo nvm }}\n  function _nvm_complete {{ }}"
+    assert envdiff.declared_functions(script) == ["nvm", "_nvm_complete"]
+    with pytest.raises(envdiff.EnvDiffError, match="exits: _nvm_complete, nvm"):
+        envdiff.capture_env_diff(script, {}, [])
+    assert envdiff.declared_functions('export FOO="f() {"\nunset BAR') == []
+    assert not marker.exists()
+
+
+@requires_zsh
+def test_capture_env_diff():
+    from zsh2xonsh.runtime import envdiff
+
+    env = {"PATH": os.environ["PATH"], "HOME": "/nonexistent"}
+    diff = envdiff.capture_env_diff(
+        'export FOO=bar\nexport PATH="/opt/bin:$PATH"\nalias ll="ls -la"\nunset HOME',
+        env,
+        [],
+    )
+    assert diff.changed_vars == {"FOO": "bar", "PATH": "/opt/bin:" + env["PATH"]}
+    assert diff.removed_vars == ["HOME"]
+    assert diff.changed_aliases == {"ll": "ls -la"}
+    with pytest.raises(envdiff.EnvDiffError, match="defines functions"):
+        envdiff.capture_env_diff("nvm() { echo nvm }", env, [])
+    with pytest.raises(envdiff.EnvDiffError, match="syntax"):
+        envdiff.capture_env_diff("if; then", env, [])
+
+
+def test_prefetch():
+    from zsh2xonsh.runtime import ZshContext, _SharedState
+
+    spawned = []
+
+    class FakeZshContext(ZshContext):
+        __slots__ = ()
+
+        def _check_syntax(self, cmd):
+            pass
+
+        def _spawn_zsh(self, cmd, env, *, pipe=True):
+            spawned.append(cmd)
+            return 0, f"{cmd}:{env.get('FOO')}\n"
+
+    shared = _SharedState(prefetch_workers=2)
+    try:
+        ctx = FakeZshContext(shared=shared)
+        ctx.prefetch(["a", "b"])
+        assert ctx.zsh("a") == "a:None"
+        # Changing the inputs invalidates the prefetched result
+        ctx.assign_local("FOO", "x")
+        assert ctx.zsh("b") == "b:x"
+        # NOTE: The stale prefetch of "b" may or may not have been cancelled in time
+        assert spawned.count("a") == 1
+        assert not shared.prefetched
+    finally:
+        shared.close()
+
+
+def test_instrumentation(tmp_path, monkeypatch):
+    from zsh2xonsh.runtime import init_context
+
+    trace_file = tmp_path / "trace.json"
+    monkeypatch.setenv("ZSH2XONSH_TRACE", str(trace_file))
+    monkeypatch.setenv("FOO", "bar")
+    events = []
+    with init_context(persistent_worker=False, parallel=0) as ctx:
+        ctx.instrumentation.add_listener(events.append)
+        assert ctx.expand_quote("$FOO/baz") == "bar/baz"
+        assert ctx.test_condition('[[ -n "$FOO" ]]')
+        ctx.assume_valid_syntax(["true"])
+        ctx._check_syntax("true")
+        counters = ctx.instrumentation.counters
+        assert counters[("expand_quote", "native")].count == 1
+        assert counters[("test_condition", "native")].count == 1
+        assert counters[("check_syntax", "cache")].count == 1
+        assert "expand_quote (native)" in ctx.instrumentation.summary()
+    assert [event.name for event in events] == [
+        "expand_quote",
+        "test_condition",
+        "check_syntax",
+    ]
+    # NOTE: The closing bracket (and trailing comma) are optional in this format
+    trace = json.loads(trace_file.read_text().rstrip().rstrip(",") + "]")
+    assert [event["name"] for event in trace] == [event.name for event in events]
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in trace)
+
+
+def test_memo(monkeypatch):
+    from zsh2xonsh.runtime import ZshContext, _SharedState
+
+    # NOTE: $PATH is part of every key (and counts towards the size)
+    monkeypatch.setenv("PATH", "/bin")
+    spawned = []
+
+    class FakeZshContext(ZshContext):
+        __slots__ = ()
+
+        def _check_syntax(self, cmd):
+            pass
+
+        def _spawn_zsh(self, cmd, env, *, pipe=True):
+            spawned.append(cmd)
+            return 0, f"{cmd}:{env.get('FOO')}:{env.get('BAR')}\n"
+
+    shared = _SharedState(memo_budget=100)
+    ctx = FakeZshContext(shared=shared)
+    assert ctx.zsh("a $FOO", pure=["FOO"]) == "a $FOO:None:None"
+    # Unreferenced variables don't matter
+    ctx.assign_local("BAR", "x")
+    assert ctx.zsh("a $FOO", pure=["FOO"]) == "a $FOO:None:None"
+    assert spawned == ["a $FOO"]
+    ctx.assign_local("FOO", "y")
+    assert ctx.zsh("a $FOO", pure=["FOO"]) == "a $FOO:y:x"
+    # Impure commands are always run
+    ctx.zsh("a $FOO")
+    assert len(spawned) == 3
+    assert (ctx.memo.hits, ctx.memo.misses) == (1, 2)
+    # Evicts the least recently used entries to stay within the budget
+    for idx in range(10):
+        ctx.zsh(f"b{idx}", pure=())
+    assert ctx.memo.evictions > 0
+    assert ctx.memo.size <= ctx.memo.budget
+    assert ctx.instrumentation.counters[("zsh", "memo")].count == 1
+
+
+def test_scope_chain():
+    from zsh2xonsh.runtime import ZshContext, _SharedState
+
+    root = ZshContext(shared=_SharedState())
+    root.assign_local("a", 1)
+    with root.begin_function("f", ["x"]) as f:
+        assert f._positional_vars == ["f", "x"]
+        # Without its own locals, the parent's view is shared
+        assert f._resolved_locals() is root._resolved_locals()
+        with f.begin_function("g", []) as g:
+            g.assign_local("b", 2)
+            resolved = g._resolved_locals()
+            assert resolved == {"a": "1", "b": "2"}
+            assert g._resolved_locals() is resolved
+            # Assigning in an outer scope invalidates the inner ones
+            root.assign_local("a", 3)
+            assert g._resolved_locals() == {"a": "3", "b": "2"}
+            g.assign_local("a", 4)
+            assert g._resolved_locals() == {"a": "4", "b": "2"}
+            assert f._resolved_locals() == {"a": "3"}
+    assert not g._locals
+
+
+def test_splice_path_var():
+    from zsh2xonsh.runtime import ZshContext, ZshError, _SharedState
+
+    ctx = ZshContext(shared=_SharedState(unique_paths=["MANPATH"]))
+    path = ["/usr/bin", "/bin"]
+    ctx._splice_path_var("PATH", path, "/opt/a:/opt/b:/usr/bin:/bin:/sbin")
+    assert path == ["/opt/a", "/opt/b", "/usr/bin", "/bin", "/sbin"]
+    # Like `${PATH+:$PATH}` with an empty path
+    path = []
+    ctx._splice_path_var("PATH", path, "/opt/a:")
+    assert path == ["/opt/a"]
+    with pytest.raises(ZshError, match="too complicated"):
+        ctx._splice_path_var("PATH", path, "/opt/b")
+    # Unique paths keep the first occurrence of each entry
+    manpath = ["/usr/share/man", "/opt/man"]
+    ctx._splice_path_var("MANPATH", manpath, "/opt/man:/usr/share/man:/opt/man:/x")
+    assert manpath == ["/opt/man", "/usr/share/man", "/x"]
+    ctx._splice_path_var("MANPATH", manpath, "/opt/man:/usr/share/man:/x:/x")
+    assert manpath == ["/opt/man", "/usr/share/man", "/x"]
+
+
+def test_extend_path_var(monkeypatch):
+    from zsh2xonsh.runtime import ZshContext, _SharedState, xonshi
+
+    class EnvPath(list):
+        pass
+
+    class FakeSession:
+        env = FakeEnv(PATH=EnvPath(["/usr/bin", "/bin"]), MANPATH=EnvPath())
+
+    snapshot = _EnvSnapshot()
+    snapshot.listening = True  # Don't register xonsh events
+    monkeypatch.setattr(xonshi, "_SNAPSHOT", snapshot)
+    monkeypatch.setattr(xonshi, "_xsh", FakeSession())
+    ctx = ZshContext(shared=_SharedState(unique_paths=["PATH"]))
+    ctx.extend_path_var("PATH", ["/opt/a", "/bin"], ["/opt/b"], "<unused>")
+    assert FakeSession.env["PATH"] == ["/opt/a", "/bin", "/usr/bin", "/opt/b"]
+    # Empty (or missing) paths fallback to assigning the expanded string
+    ctx.extend_path_var("MANPATH", ["/opt/man"], [], "/opt/man:$MANPATH")
+    assert FakeSession.env["MANPATH"] == ["/opt/man"]
+    ctx.extend_path_var("INFOPATH", ["/opt/info"], [], "/opt/info${INFOPATH+:$INFOPATH}")
+    assert FakeSession.env["INFOPATH"] == "/opt/info"
+
+
+def test_exec_python_target(monkeypatch):
+    from zsh2xonsh import translate, translate_to_python
+    from zsh2xonsh.runtime import init_context, xonshi
+
+    monkeypatch.setenv("FOO", "foo")
+    monkeypatch.delenv("BAR", raising=False)
+    settings = translate.Settings.default()
+    # Otherwise everything would be run by zsh
+    settings.batch_assignments = False
+    module = translate_to_python(
+        'local dir="$FOO/bar"\nif [[ -n "$dir" ]]; then\n  export BAR="$dir-1"\nfi',
+        settings=settings,
+    )
+    code = compile(module, "<test>", "exec")
+    with init_context(persistent_worker=False, parallel=0) as ctx:
+        exec(code, {"ctx": ctx, "XSH": xonshi.session()})
+    assert os.environ["BAR"] == "foo/bar-1"
+
+
+def test_builtins_clear_stat_cache(tmp_path, monkeypatch):
+    from zsh2xonsh.runtime import init_context
+
+    monkeypatch.setenv("DIR", str(tmp_path / "new"))
+    with init_context(persistent_worker=False, parallel=0) as ctx:
+        mkdir = ctx.wrap_builtin(os.mkdir)
+        assert not ctx.test_condition('[[ -d "$DIR" ]]')
+        mkdir(os.environ["DIR"])
+        # The builtin could have changed the filesystem (so the cached result is discarded)
+        assert ctx.test_condition('[[ -d "$DIR" ]]')
+
+
+@requires_zsh
+def test_exec_batched_assignments(monkeypatch):
+    from zsh2xonsh import translate, translate_to_python
+    from zsh2xonsh.runtime import init_context, xonshi
+
+    zsh = """export A=$(echo a)
+export N=017
+export C=$(false)
+local d="$(echo $A)/d"
+export D="$d"
+"""
+    results = []
+    for batch in (True, False):
+        for name in ("A", "N", "C", "D"):
+            monkeypatch.delenv(name, raising=False)
+        settings = translate.Settings.default()
+        settings.batch_assignments = batch
+        module = translate_to_python(zsh, settings=settings)
+        assert ("assign_batch" in pyast.unparse(module)) == batch
+        code = compile(module, "<test>", "exec")
+        with init_context(persistent_worker=False, parallel=0) as ctx:
+            exec(code, {"ctx": ctx, "XSH": xonshi.session()})
+        results.append({name: os.environ[name] for name in ("A", "N", "C", "D")})
+    assert results[0] == results[1] == {"A": "a", "N": "17", "C": "", "D": "a/d"}
+
+
+def test_exec_inlined_functions(tmp_path, monkeypatch):
+    from zsh2xonsh import translate, translate_to_python
+    from zsh2xonsh.runtime import init_context, xonshi
+
+    monkeypatch.setenv("HOME", str(tmp_path))
+    (tmp_path / "bin").mkdir()
+    zsh = """function extend_path() {
+    if [[ -d "$1" ]]; then
+        export PATH="$PATH:$1"
+    fi
+}
+extend_path ~/bin
+extend_path ~/missing
+extend_path "$HOME/bin"
+"""
+    results = []
+    for inline in (True, False):
+        monkeypatch.setenv("PATH", "/bin")
+        settings = translate.Settings.default()
+        settings.inline_functions = inline
+        code = compile(translate_to_python(zsh, settings=settings), "<test>", "exec")
+        with init_context(persistent_worker=False, parallel=0) as ctx:
+            exec(code, {"ctx": ctx, "XSH": xonshi.session()})
+        results.append(os.environ["PATH"])
+    assert results == [f"/bin:{tmp_path}/bin:{tmp_path}/bin"] * 2
+
+
+def _imported_modules(code: str) -> set[str]:
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        encoding="utf-8",
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+        check=True,
+    )
+    assert "WARNING" not in res.stderr
+    return {
+        line.rsplit("|", 1)[-1].strip()
+        for line in res.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+
+
+def test_runtime_import_is_minimal():
+    # Generated code imports the runtime on every shell startup
+    imported = _imported_modules("from zsh2xonsh import runtime")
+    imported -= _imported_modules("pass")
+    assert "zsh2xonsh.runtime" in imported
+    forbidden = {
+        "click",
+        "xonsh",
+        "dataclasses",
+        "subprocess",
+        "concurrent.futures",
+        "tempfile",
+        "json",
+        "zsh2xonsh.translate",
+        "zsh2xonsh.parser",
+        "zsh2xonsh.lexer",
+        "zsh2xonsh.ast",
+        "zsh2xonsh.passes",
+        "zsh2xonsh.runtime.envdiff",
+    }
+    assert not imported & forbidden
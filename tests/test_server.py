@@ -0,0 +1,86 @@
+import os
+import threading
+
+import pytest
+
+from zsh2xonsh import client, parser, server, translate_to_xonsh
+from zsh2xonsh.parser import TranslationError
+
+SOURCE = 'export FOO="bar"\nlocal x=12'
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    path = str(tmp_path / "zsh2xonsh.sock")
+    srv = server.create_server(path)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield path
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_translate(socket_path):
+    expected = translate_to_xonsh(SOURCE)
+    assert client.translate(SOURCE, socket_path=socket_path) == expected
+    client.validate(SOURCE, socket_path=socket_path)
+    with pytest.raises(TranslationError) as exc_info:
+        client.translate("export FOO=bar\nif [[ -d x ]]; then", socket_path=socket_path)
+    assert exc_info.value.location is not None
+    with pytest.raises(RuntimeError):
+        server.create_server(socket_path)
+
+
+def test_concurrent_clients(socket_path):
+    sources = [f"export FOO{idx}=bar\n{SOURCE}" for idx in range(20)]
+    results = {}
+
+    def run(idx):
+        results[idx] = client.translate(
+            sources[idx], extra_builtins=["foo"], socket_path=socket_path
+        )
+
+    threads = [threading.Thread(target=run, args=(idx,)) for idx in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for idx, source in enumerate(sources):
+        assert results[idx] == translate_to_xonsh(source, extra_builtins={"foo"})
+
+
+def test_bad_request(socket_path):
+    response = client.request(
+        {"op": "translate", "source": "", "extra_builtins": ["export"]},
+        socket_path=socket_path,
+    )
+    assert not response["ok"]
+    assert "conflict" in response["error"]["message"]
+
+
+def test_fallback(tmp_path):
+    missing = str(tmp_path / "missing.sock")
+    assert client.translate(SOURCE, socket_path=missing) == translate_to_xonsh(SOURCE)
+    with pytest.raises(FileNotFoundError):
+        client.request({"op": "ping"}, socket_path=missing, fallback=False)
+
+
+def test_untrusted_socket(socket_path, tmp_path, monkeypatch):
+    not_socket = tmp_path / "file.sock"
+    not_socket.write_text("")
+    with pytest.raises(PermissionError):
+        client.request({"op": "ping"}, socket_path=str(not_socket))
+    # Someone else's socket (at a predictable path) can't be trusted either
+    uid = os.getuid()
+    monkeypatch.setattr(os, "getuid", lambda: uid + 1)
+    with pytest.raises(PermissionError):
+        client.translate(SOURCE, socket_path=socket_path)
+
+
+def test_bounded_parser_cache(socket_path):
+    # Each distinct set of builtins is cached, but a long-running server must not grow forever
+    maxsize = parser._dispatch_table.cache_info().maxsize
+    assert maxsize is not None
+    for idx in range(maxsize + 1):
+        client.translate(SOURCE, extra_builtins=[f"b{idx}"], socket_path=socket_path)
+    assert parser._dispatch_table.cache_info().currsize <= maxsize
@@ -0,0 +1,418 @@
+import re
+import shutil
+from pathlib import Path
+
+import pytest
+
+from zsh2xonsh import ast, params, translate, translate_to_python, translate_to_xonsh
+from zsh2xonsh.parser import ShellParseError, ShellParser, ZshSyntaxValidationError
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "examples"
+requires_zsh = pytest.mark.skipif(shutil.which("zsh") is None, reason="requires zsh")
+
+
+def parse_all(text: str) -> list[ast.Statement]:
+    parser = ShellParser(text.splitlines())
+    stmts = []
+    while (stmt := parser.statement()) is not None:
+        stmts.append(stmt)
+    return stmts
+
+
+def test_delegated_commands():
+    stmts = parse_all(
+        """export FOO=$(echo bar)
+if [[ -s "$FOO" ]]; then
+    export BAR="$FOO/baz"
+    export BAZ="$(pwd)/baz"
+fi
+alias lsdot="echo .*"
+export BAZ"""
+    )
+    # NOTE: "$FOO/baz" and the implicit "${BAZ}" are expanded natively
+    # but zsh2xonsh doesn't (natively) support `-s` tests
+    assert [cmd for _, cmd in ast.delegated_commands(stmts)] == [
+        "echo bar",
+        '[[  -s "$FOO"  ]]',
+        'print -rn -- "$(pwd)/baz"',
+    ]
+
+
+@requires_zsh
+def test_validate_syntax():
+    reasons = translate.validate_zsh_syntax(
+        ["echo foo", "if; then", "[[ -d foo ]]", "echo ${"]
+    )
+    assert reasons[0] is None and reasons[2] is None
+    # Every invalid command is reported (with a reason)
+    assert reasons[1] is not None and reasons[3] is not None
+    settings = translate.Settings.default()
+    settings.validate_syntax = True
+    # Otherwise both assignments would be reported as a single batch
+    settings.batch_assignments = False
+    with pytest.raises(ZshSyntaxValidationError) as e:
+        translate_to_xonsh(
+            'export FOO="$(echo ${)"\nexport BAR=$(fi)', settings=settings
+        )
+    assert [location.line for location, _, _ in e.value.failures] == [1, 2]
+    translated = translate_to_xonsh(
+        (EXAMPLES / "macbook2021-config.zsh").read_text(), settings=settings
+    )
+    assert translated.startswith("ctx.assume_valid_syntax(")
+
+
+def test_batch_assignments():
+    from zsh2xonsh import passes
+
+    stmts = parse_all(
+        """export FOO=bar
+export BREW=$(brew --prefix)
+local prefix="$BREW/opt"
+export PYENV_ROOT="$(pyenv root)"
+alias ls=exa
+export ONE=$(one)
+if [[ -d "$prefix" ]]; then
+    export A=$(a)
+    export B="$(b)"
+fi"""
+    )
+    settings = translate.Settings.default()
+    batched = passes.batch_assignments(stmts, settings)
+    assert [type(stmt).__name__ for stmt in batched] == [
+        "AssignmentStmt",
+        "AssignmentBatch",
+        "AssignmentStmt",
+        "AssignmentStmt",
+        "ConditionalStmt",
+    ]
+    batch = batched[1]
+    assert [stmt.target for stmt in batch.assignments] == ["BREW", "prefix", "PYENV_ROOT"]
+    assert batch.script().splitlines() == [
+        "export BREW",
+        "BREW=$(brew --prefix)",
+        "printf '%s\\0' \"$?\" \"${BREW}\"",
+        'export prefix="$BREW/opt"',
+        "printf '%s\\0' 0 \"${prefix}\"",
+        'export PYENV_ROOT="$(pyenv root)"',
+        "printf '%s\\0' 0 \"${PYENV_ROOT}\"",
+    ]
+    assert [cmd for _, cmd in ast.delegated_commands(batched)][:1] == [batch.script()]
+    assert isinstance(batched[-1].then[0], ast.AssignmentBatch)
+    # The translated code must still be valid (even when nested)
+    translated = "\n".join(stmt.translate(settings) for stmt in batched)
+    # NOTE: Replace xonsh's `$VAR = ...` so python can compile it
+    compile(re.sub(r"^(\s*)\$", r"\1", translated, flags=re.M), "<test>", "exec")
+    # Path updates are spliced in directly (instead of going through zsh)
+    batched = passes.batch_assignments(
+        parse_all('export A=$(x)\nexport PATH="/opt/bin:$PATH"\nexport B=$(y)'), settings
+    )
+    assert [type(stmt).__name__ for stmt in batched] == ["AssignmentStmt"] * 3
+    assert "ctx.extend_path_var('PATH', ['/opt/bin']" in batched[1].translate(settings)
+    # So do literals (which aren't always strings)
+    batched = passes.batch_assignments(
+        parse_all("export A=$(x)\nexport N=017\nexport B=$(y)"), settings
+    )
+    assert [type(stmt).__name__ for stmt in batched] == ["AssignmentStmt"] * 3
+    assert batched[1].translate(settings) == "$N=17"
+
+
+def test_inline_functions():
+    from zsh2xonsh import passes
+
+    settings = translate.Settings.default()
+    stmts = passes.inline_functions(
+        parse_all(
+            """function extend_path() {
+    if [[ -d "$1" ]]; then
+        export PATH="$PATH:$1"
+    fi
+}
+function set_pair() {
+    local first="$1"
+    export PAIR="$first:$2"
+}
+extend_path ~/bin
+extend_path "$PREFIX/bin" ignored
+extend_path "$PATH"
+extend_path $(brew --prefix)
+set_pair a b
+if [[ -n "$MAYBE" ]]; then
+    function maybe() {
+        export FOO="$1"
+    }
+fi
+maybe x
+"""
+        ),
+        settings,
+    )
+    translated = [stmt.translate(settings) for stmt in stmts]
+    assert translated[2:4] == [
+        "\n".join(
+            [
+                f"if ctx.test_condition('[[ -d \"{entry}\" ]]'):",
+                f"    ctx.extend_path_var('PATH', [], [*ctx.expand_quote({entry!r}).split(':')], '${{PATH}}:{entry}')",
+            ]
+        )
+        for entry in ("${HOME}/bin", "${PREFIX}/bin")
+    ]
+    # The body assigns $PATH (which is used by the argument)
+    assert translated[4].startswith("extend_path(ctx.expand_quote('$PATH')")
+    # Command substitutions (and functions with locals) are never inlined
+    assert translated[5].startswith("extend_path(ctx.zsh('brew --prefix')")
+    assert translated[6].startswith("set_pair(")
+    # The function may not have been defined
+    assert translated[8] == "maybe('x',parent_ctx=ctx,)"
+
+
+def test_coalesce_path_updates():
+    from zsh2xonsh import passes
+
+    settings = translate.Settings.default()
+    stmts = passes.coalesce_path_updates(
+        parse_all(
+            """export PATH="$PATH:/a"
+export PATH="/b:${PATH}:$HOME/c"
+export PATH="/d${PATH+:$PATH}"
+export MANPATH="$MANPATH:/e"
+"""
+        ),
+        settings,
+    )
+    assert [stmt.translate(settings) for stmt in stmts[:2]] == [
+        "ctx.extend_path_var('PATH', ['/b'], ['/a', *ctx.expand_quote('${HOME}/c').split(':')], '/b:${PATH}:/a:${HOME}/c')",
+        "ctx.extend_path_var('PATH', ['/d'], [], '/d${PATH+:$PATH}')",
+    ]
+    assert stmts[0].span.start.line == 1 and stmts[0].span.end.line == 2
+    assert len(stmts) == 3
+
+
+def test_propagate_constants():
+    from zsh2xonsh import passes
+
+    settings = translate.Settings.default()
+    stmts = passes.propagate_constants(
+        parse_all(
+            """local version=17
+export PREFIX="/opt/jdk-${version}"
+echo "$PREFIX/bin" "${version:+v$version}" "$1/$version"
+if [[ -d "$PREFIX" ]]; then
+    local version=18
+    echo "$version"
+fi
+echo "$version" "$PREFIX"
+function f() {
+    local dir="$PREFIX/lib"
+    echo "$dir/x"
+}
+f
+echo "$PREFIX"
+"""
+        ),
+        settings,
+    )
+    translated = [stmt.translate(settings) for stmt in stmts]
+    assert translated[1] == "$PREFIX='/opt/jdk-17'"
+    assert "'/opt/jdk-17/bin'" in translated[2]
+    assert "'v17'" in translated[2]
+    assert "ctx.expand_quote('${1}/17')" in translated[2]
+    assert "print('18'" in translated[3]
+    # The conditional may or may not have run
+    assert "ctx.expand_quote('$version')" in translated[4]
+    assert "'/opt/jdk-17'" in translated[4]
+    # Functions can run at any time (and calls can change anything)
+    assert "ctx.expand_quote('${dir}/x')" not in translated[5]
+    assert "'$PREFIX/lib'" in translated[5]
+    assert translated[7] == "print(ctx.expand_quote('$PREFIX'),)"
+
+
+def test_path_idioms():
+    match = translate.match_path_update
+    assert match("PATH", "/opt/homebrew/bin:/opt/homebrew/sbin${PATH+:$PATH}") == (
+        [("/opt/homebrew/bin",), ("/opt/homebrew/sbin",)],
+        [],
+    )
+    assert match("INFOPATH", "/opt/homebrew/share/info:${INFOPATH:-}").prefix == [
+        ("/opt/homebrew/share/info",)
+    ]
+    update = match("PATH", "/a:${PATH}:$HOME/bin:/b")
+    assert update.prefix == [("/a",)]
+    assert [params.quote(entry) for entry in update.suffix] == ["${HOME}/bin", "/b"]
+    # Empty entries (and anything else) are left to the runtime
+    for text in (
+        "/opt/homebrew/share/man${MANPATH+:$MANPATH}:",
+        "$PATH:",
+        "/a::$PATH",
+        "/a$PATH",
+        "$PATH:$PATH",
+        "${PATH+:$PATH}",
+        "/a:${PATH:-/usr/bin}",
+        "$(brew --prefix)/bin:$PATH",
+    ):
+        assert match("MANPATH" if "MAN" in text else "PATH", text) is None, text
+    settings = translate.Settings.default()
+    assert translate_to_xonsh('export PATH="$PATH:$1"', settings=settings) == (
+        "ctx.extend_path_var('PATH', [], [*ctx.expand_quote('${1}').split(':')], '$PATH:$1')"
+    )
+    # Only for path-like variables
+    assert "extend_path_var" not in translate_to_xonsh(
+        'export FOO="/a:$FOO"', settings=settings
+    )
+
+
+def test_schedule_prefetch():
+    from zsh2xonsh import passes
+
+    stmts = passes.schedule_prefetch(
+        parse_all(
+            """alias ll="ls -la"
+if [[ -s "$(brew --prefix)/x" ]]; then
+    echo hi
+fi
+echo $(fd foo)  # zsh2xonsh: pure
+export A=$(pyenv root)  # zsh2xonsh: pure
+export B=$(b)  # zsh2xonsh: pure
+export C="$A/c"
+echo $(mkdir /tmp/q)
+if [[ -O /tmp/q ]]; then
+    echo hi
+fi
+echo $(ls /tmp/q)  # zsh2xonsh: pure
+echo "${C:h}"
+echo $(rm -r /tmp/q)"""
+        )
+    )
+    # The test has a command substitution (which could have side effects)
+    assert isinstance(stmts[2], ast.PrefetchStmt)
+    # Everything after `export A=...` could depend on it
+    assert stmts[2].commands == ["fd foo", "pyenv root"]
+    # Nothing is moved past (or prefetched with) `mkdir` and `rm`
+    assert isinstance(stmts[8], ast.PrefetchStmt)
+    assert stmts[8].commands == [
+        "[[  -O /tmp/q  ]]",
+        "ls /tmp/q",
+        'print -rn -- "${C:h}"',
+    ]
+    assert sum(isinstance(stmt, ast.PrefetchStmt) for stmt in stmts) == 2
+    # The prefetched commands still belong to the statements that use them
+    assert [cmd for _, cmd in ast.delegated_commands(stmts)] == [
+        '[[  -s "$(brew --prefix)/x"  ]]',
+        "fd foo",
+        "pyenv root",
+        "b",
+        "mkdir /tmp/q",
+        "[[  -O /tmp/q  ]]",
+        "ls /tmp/q",
+        'print -rn -- "${C:h}"',
+        "rm -r /tmp/q",
+    ]
+
+
+def test_iter_translate_streams():
+    from zsh2xonsh import STREAMING_CHUNK_SIZE, iter_translate
+
+    count = STREAMING_CHUNK_SIZE * 4
+    consumed = 0
+
+    def lines():
+        nonlocal consumed
+        for idx in range(count):
+            consumed += 1
+            yield f"export VAR{idx}='value {idx}'\n"
+
+    output = iter_translate(lines())
+    assert next(output) == "$VAR0='value 0'"
+    assert consumed < count
+    rest = list(output)
+    assert len(rest) == count - 1
+    assert "\n".join(["$VAR0='value 0'", *rest]) == translate_to_xonsh(
+        "".join(f"export VAR{idx}='value {idx}'\n" for idx in range(count))
+    )
+
+
+def test_validate_whole_input(monkeypatch):
+    import zsh2xonsh
+    from zsh2xonsh import STREAMING_CHUNK_SIZE, iter_translate
+
+    calls = []
+
+    def validate(stmts):
+        calls.append([cmd for _, cmd in ast.delegated_commands(stmts)])
+        return tuple(calls[-1])
+
+    monkeypatch.setattr(zsh2xonsh, "_validate_syntax", validate)
+    settings = translate.Settings.default()
+    settings.validate_syntax = True
+    count = STREAMING_CHUNK_SIZE * 2 + 1
+    zsh = "".join(f"echo $(cmd{idx})\n" for idx in range(count))
+    # Unless streaming, all the commands are validated at once
+    translated = translate_to_xonsh(zsh, settings=settings)
+    assert len(calls) == 1 and len(calls[0]) == count
+    assert translated.count("ctx.assume_valid_syntax(") == 1
+    translate_to_python(zsh, settings=settings)
+    assert len(calls) == 2
+    list(iter_translate(zsh.splitlines(), settings=settings))
+    assert [len(cmds) for cmds in calls[2:]] == [
+        STREAMING_CHUNK_SIZE,
+        STREAMING_CHUNK_SIZE,
+        1,
+    ]
+
+
+def test_optimize_whole_input():
+    from zsh2xonsh import STREAMING_CHUNK_SIZE, iter_translate
+
+    count = STREAMING_CHUNK_SIZE + 2
+    zsh = "".join(f"export VAR{idx}=$(cmd{idx})\n" for idx in range(count))
+    # Unless streaming, the passes see every statement (so the batch isn't split)
+    translated = translate_to_xonsh(zsh)
+    assert translated.count("ctx.assign_batch(") == 1
+    assert "\n".join(iter_translate(zsh)) == translated
+    # When streaming, the last two statements are in a chunk of their own
+    streamed = "\n".join(iter_translate(zsh.splitlines()))
+    assert streamed.count("ctx.assign_batch(") == 2
+
+
+def test_pure_pragma():
+    settings = translate.Settings.default()
+    settings.batch_assignments = False
+    translated = translate_to_xonsh(
+        "local a=$(brew --prefix $NAME)  # zsh2xonsh: pure\nlocal b=$(date)",
+        settings=settings,
+    )
+    assert "ctx.zsh('brew --prefix $NAME', pure=('NAME',))" in translated
+    assert "ctx.zsh('date')" in translated
+    assert translate.referenced_params("a$(b ${C:-$1})") == {"C"}
+    assert translate.referenced_params("echo $RANDOM $$") is None
+
+
+@pytest.mark.parametrize("path", sorted(EXAMPLES.glob("*.zsh")), ids=lambda p: p.name)
+def test_python_target(path):
+    import ast as pyast
+
+    settings = translate.Settings.default()
+    module = translate_to_python(path.read_text(), settings=settings)
+    compile(module, str(path), "exec")
+    # Besides the env vars (and aliases), it's the same as the xonsh code
+    xonsh_code = translate_to_xonsh(path.read_text(), settings=settings)
+    xonsh_code = re.sub(
+        r"^(\s*)\$(\w+)=", r"\1XSH.env['\2']=", xonsh_code, flags=re.MULTILINE
+    )
+    xonsh_code = re.sub(
+        r"^(\s*)aliases\[", r"\1XSH.aliases[", xonsh_code, flags=re.MULTILINE
+    )
+    assert pyast.dump(module) == pyast.dump(pyast.parse(xonsh_code))
+
+
+@pytest.mark.parametrize("method", ["translate", "to_python"])
+def test_translation_errors(method):
+    from zsh2xonsh.runtime import ZshError
+
+    settings = translate.Settings.default()
+    (alias,) = parse_all("alias ll=$(echo ls)")
+    with pytest.raises(ShellParseError, match="alias target"):
+        getattr(alias, method)(settings)
+    (call,) = parse_all("echo hi")
+    call.name = "printf"
+    with pytest.raises(ZshError, match="Builtin printf"):
+        getattr(call, method)(settings)